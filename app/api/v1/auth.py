@@ -1,7 +1,7 @@
 """
 Authentication endpoints - register, login, join family
 """
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, status
 
 from app.api.v1.schemas import (
     UserRegister,
@@ -12,65 +12,61 @@ from app.api.v1.schemas import (
     PasswordResetRequest,
     PasswordResetResponse,
 )
+from app.core.admission import admit, hash_slot
 from app.core.dependencies import get_current_user
 from app.core.security import (
     create_access_token,
-    get_password_hash,
-    verify_password,
+    get_password_hash_async,
+    verify_password_async,
 )
-from app.models.family import Family
+from app.core.responses import FastJSONResponse
 from app.models.user import User
 from app.models.password_reset import PasswordResetToken
+from app.services.family import FamilyService
+from app.services.onboarding import EmailTaken, OnboardingService
 from fastapi import Depends
 
 
-router = APIRouter(prefix="/auth", tags=["Authentication"])
+router = APIRouter(prefix="/auth", tags=["Authentication"], default_response_class=FastJSONResponse)
 
 
 @router.post("/register", response_model=Token, status_code=status.HTTP_201_CREATED)
-async def register(data: UserRegister):
+async def register(data: UserRegister, request: Request):
     """
     Register new user and auto-create a family
     """
-    # Check if user already exists
-    existing_user = await User.filter(email=data.email).first()
-    if existing_user:
+    await admit(request, data.email)
+
+    async with hash_slot():
+        password_hash = await get_password_hash_async(data.password)
+
+    # User and their family in one statement; the unique email is checked by the database
+    try:
+        user_id, family_id, invite_code = await OnboardingService.register(data.email, password_hash)
+    except EmailTaken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    # Create family (without patient data for now)
-    family = await Family.create()
-    
-    # Create user
-    password_hash = get_password_hash(data.password)
-    user = await User.create(
-        email=data.email,
-        password_hash=password_hash,
-        family_id=family.id,
-    )
-    
-    # Set the user as family owner
-    family.owner_id = str(user.id)
-    await family.save()
-    
     # Generate JWT token
-    access_token = create_access_token(data={"sub": str(user.id)})
+    access_token = create_access_token(data={"sub": user_id})
     
     return Token(
         access_token=access_token,
-        user_id=str(user.id),
-        family_id=str(family.id),
-        invite_code=family.invite_code,
+        user_id=user_id,
+        family_id=family_id,
+        invite_code=invite_code,
     )
 
 
 @router.post("/login", response_model=Token)
-async def login(data: UserLogin):
+async def login(data: UserLogin, request: Request):
     """
     Login user with email and password
     """
+    await admit(request, data.email)
+
     # Find user
     user = await User.filter(email=data.email).prefetch_related("family").first()
     if not user:
@@ -87,7 +83,9 @@ async def login(data: UserLogin):
         )
     
     # Verify password
-    if not verify_password(data.password, user.password_hash):
+    async with hash_slot():
+        valid = await verify_password_async(data.password, user.password_hash)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
@@ -105,42 +103,39 @@ async def login(data: UserLogin):
 
 
 @router.post("/join-family", response_model=Token, status_code=status.HTTP_201_CREATED)
-async def join_family(data: JoinFamily):
+async def join_family(data: JoinFamily, request: Request):
     """
     Join existing family using invite code
     """
-    # Check if user already exists
-    existing_user = await User.filter(email=data.email).first()
-    if existing_user:
+    await admit(request, data.email)
+
+    async with hash_slot():
+        password_hash = await get_password_hash_async(data.password)
+
+    # Create user in the family found by invite code, in one statement
+    try:
+        joined = await OnboardingService.join(data.email, password_hash, data.invite_code.upper())
+    except EmailTaken:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
-    
-    # Find family by invite code
-    family = await Family.filter(invite_code=data.invite_code.upper()).first()
-    if not family:
+    if joined is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Invalid invite code"
         )
-    
-    # Create user
-    password_hash = get_password_hash(data.password)
-    user = await User.create(
-        email=data.email,
-        password_hash=password_hash,
-        family_id=family.id,
-    )
+    user_id, family_id, invite_code = joined
+    FamilyService.invalidate(family_id)
     
     # Generate JWT token
-    access_token = create_access_token(data={"sub": str(user.id)})
+    access_token = create_access_token(data={"sub": user_id})
     
     return Token(
         access_token=access_token,
-        user_id=str(user.id),
-        family_id=str(family.id),
-        invite_code=family.invite_code,
+        user_id=user_id,
+        family_id=family_id,
+        invite_code=invite_code,
     )
 
 
@@ -1,12 +1,15 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, Request, Response, status, Depends
 from app.models.family import Family
 from app.models.user import User
-from app.api.v1.schemas import Token, JoinFamilyRequest, FamilyDetailsResponse, RemoveMemberRequest, UserResponse
-from app.core.dependencies import get_current_user
+from app.api.v1.schemas import Token, JoinFamilyRequest, FamilyDetailsResponse, RemoveMemberRequest
+from app.core.dependencies import get_current_user, invalidate_user
 from app.core.security import create_access_token
+from app.core.responses import FastJSONResponse
+from app.services.family import FamilyService
+from app.services.onboarding import OnboardingService
 from typing import List
 
-router = APIRouter(prefix="/family", tags=["Family"])
+router = APIRouter(prefix="/family", tags=["Family"], default_response_class=FastJSONResponse)
 
 @router.post("/join", response_model=Token)
 async def join_family(
@@ -43,8 +46,12 @@ async def join_family(
         )
     
     # Update user's family
-    current_user.family_id = family.id
-    await current_user.save()
+    # Только family_id: current_user может быть копией из кэша, и save() записал бы
+    # поверх уже изменённых в другом месте полей (например, password_hash)
+    previous_family_id = current_user.family_id
+    await User.filter(id=current_user.id).update(family_id=family.id)
+    invalidate_user(current_user.id)
+    FamilyService.invalidate(previous_family_id, family.id)
     
     # Generate new token (optional, but good practice if token contains family_id claims)
     access_token = create_access_token(data={"sub": str(current_user.id)})
@@ -56,36 +63,21 @@ async def join_family(
         invite_code=family.invite_code,
     )
 @router.get("/", response_model=FamilyDetailsResponse)
-async def get_family_details(current_user: User = Depends(get_current_user)):
+async def get_family_details(request: Request, current_user: User = Depends(get_current_user)):
     """
     Get current family details and members
     """
-    await current_user.fetch_related("family")
-    family = current_user.family
-    
-    # Get all members
-    members = await User.filter(family_id=family.id).all()
-    
-    member_responses = [
-        UserResponse(
-            id=m.id,
-            email=m.email,
-            family_id=m.family_id,
-            invite_code=family.invite_code,
-            created_at=m.created_at
+    rendered = await FamilyService.details(current_user.family_id)
+    if rendered is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Family not found"
         )
-        for m in members
-    ]
-    
-    return FamilyDetailsResponse(
-        id=family.id,
-        invite_code=family.invite_code,
-        owner_id=family.owner_id,
-        patient_name=family.patient_name,
-        patient_current_weight=family.patient_current_weight,
-        patient_birth_date=family.patient_birth_date,
-        members=member_responses
-    )
+    etag, body = rendered
+    if request.headers.get("if-none-match") == etag:
+        # Состав и данные семьи не менялись с прошлого запроса приложения
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 
 @router.post("/leave", response_model=Token)
@@ -104,10 +96,9 @@ async def leave_family(current_user: User = Depends(get_current_user)):
         )
 
     # Create new family for the user
-    new_family = await Family.create(owner_id=str(current_user.id))
-    
-    current_user.family_id = new_family.id
-    await current_user.save()
+    family_id, invite_code = await OnboardingService.move_to_new_family(str(current_user.id))
+    invalidate_user(current_user.id)
+    FamilyService.invalidate(current_user.family_id)
     
     # Generate new token
     access_token = create_access_token(data={"sub": str(current_user.id)})
@@ -115,8 +106,8 @@ async def leave_family(current_user: User = Depends(get_current_user)):
     return Token(
         access_token=access_token,
         user_id=str(current_user.id),
-        family_id=str(new_family.id),
-        invite_code=new_family.invite_code,
+        family_id=family_id,
+        invite_code=invite_code,
     )
 
 
@@ -151,9 +142,16 @@ async def remove_member(
         )
         
     # Create new family for the removed user
-    new_family = await Family.create(owner_id=str(target_user.id))
-    target_user.family_id = new_family.id
-    await target_user.save()
+    await OnboardingService.move_to_new_family(str(target_user.id))
+    invalidate_user(target_user.id)
+    FamilyService.invalidate(current_user.family_id)
     
     # Return updated family details
-    return await get_family_details(current_user)
+    rendered = await FamilyService.details(current_user.family_id)
+    if rendered is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Family not found"
+        )
+    etag, body = rendered
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
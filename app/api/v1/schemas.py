@@ -80,8 +80,8 @@ class TableChanges(BaseModel):
 
 
 class SyncPushRequest(BaseModel):
-    """Request for push synchronization"""
-    changes: Dict[str, TableChanges]
+    """Request for push synchronization (records are decoded per table, see DecoderPlan)"""
+    changes: Dict[str, TableChanges] = {}
 
 
 # ============= Family Schemas =============
@@ -1,47 +1,246 @@
 from datetime import datetime, timezone
 from typing import Optional
-from fastapi import APIRouter, Depends, Query, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, Header, Query, Request, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
+from app.api.v1.schemas import SyncPushRequest
+from app.core.config import settings
 from app.core.dependencies import get_current_user
+from app.core.responses import FastJSONResponse
+from app.models.sync_job import SyncJob
 from app.models.user import User
-from app.services.sync import SyncService
+from app.services.idempotency import IdempotencyConflict, IdempotencyService
+from app.services.sync import PULL_TABLES, PullBusy, PushConflict, SyncService
+from app.services.sync_changelog import SyncChangelogService
+from app.services import sync_push_stream
+from app.services.sync_jobs import SyncJobService
+from app.services.sync_plans import PushValidationError
+from app.services.sync_retention import ResyncRequired, SyncRetentionService
+from app.services.sync_versions import SyncVersionService
 
-router = APIRouter(prefix="/sync", tags=["Synchronization"])
+router = APIRouter(prefix="/sync", tags=["Synchronization"], default_response_class=FastJSONResponse)
 
 @router.get("")
 async def pull_changes(
     request: Request,
     last_pulled_at: Optional[int] = Query(None),
+    stream: Optional[bool] = Query(None),
     current_user: User = Depends(get_current_user),
 ):
+    if settings.SYNC_PULL_SOURCE == "changelog":
+        return await pull_changelog(current_user, last_pulled_at, stream)
+
     last_sync = None
     if last_pulled_at:
         last_sync = datetime.fromtimestamp(last_pulled_at / 1000, tz=timezone.utc)
-    
+
+    # Время ответа - до чтения версий: pull дожидается push этой семьи, которые пишут сейчас
+    try:
+        timestamp = await SyncService.pull_started(current_user.family_id)
+    except PullBusy as e:
+        return pull_busy(e)
+    versions = await SyncVersionService.get_versions(current_user.family_id)
+    try:
+        SyncRetentionService.check(versions, last_sync)
+    except ResyncRequired as e:
+        return resync_required(e)
+
+    if stream is None:
+        stream = last_sync is None and settings.SYNC_STREAM_INITIAL_PULL
+    if stream:
+        # Документ пишется по таблицам и пачкам строк, целиком в памяти не собирается
+        return StreamingResponse(
+            SyncService.stream_pull(
+                family_id=current_user.family_id, last_pulled_at=last_sync, versions=versions, timestamp=timestamp
+            ),
+            media_type="application/json",
+        )
+
+    etag = SyncVersionService.etag(current_user.family_id, versions) if versions else None
+    if (
+        etag
+        and last_sync is not None
+        and request.headers.get("if-none-match") == etag
+        and not SyncVersionService.changed_tables(versions, current_user.family_id, last_sync, PULL_TABLES)
+    ):
+        # Ничего не менялось с прошлого pull - клиент оставляет свой last_pulled_at
+        return Response(status_code=304, headers={"ETag": etag})
+
     try:
         result = await SyncService.pull_changes(
             family_id=current_user.family_id,
-            last_pulled_at=last_sync
+            last_pulled_at=last_sync,
+            versions=versions,
+            timestamp=timestamp,
         )
-        return JSONResponse(content=result)
+        headers = {"ETag": etag} if etag else None
+        return FastJSONResponse(content=result, headers=headers)
     except Exception as e:
         print(f"ERROR in pull_changes: {e}")
         raise
 
+async def pull_changelog(current_user: User, cursor: Optional[int], stream: Optional[bool]):
+    family_id = current_user.family_id
+    if cursor is None and (stream or (stream is None and settings.SYNC_STREAM_INITIAL_PULL)):
+        # Первая синхронизация: полный скан, курсор - версия журнала до его начала
+        head = await SyncChangelogService.head(str(family_id))
+        return StreamingResponse(
+            SyncService.stream_pull(family_id=family_id, cursor=head),
+            media_type="application/json",
+        )
+    try:
+        result = await SyncService.pull_changelog(family_id=family_id, cursor=cursor)
+    except ResyncRequired as e:
+        return resync_required(e)
+    except PullBusy as e:
+        return pull_busy(e)
+    return FastJSONResponse(content=result)
+
+def resync_required(e: ResyncRequired):
+    # Удалённые записи старше курсора уже стёрты - клиент должен начать с last_pulled_at=null
+    return FastJSONResponse(
+        status_code=410,
+        content={"detail": str(e), "code": "resync_required", "purged_before": int(e.horizon.timestamp() * 1000)},
+    )
+
+def pull_busy(e: PullBusy):
+    # Push семьи всё ещё пишет: pull повторяется позже, соединения пула не ждут
+    return FastJSONResponse(
+        status_code=503,
+        content={"detail": str(e), "code": "push_in_progress"},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
 @router.post("")
 async def push_changes(
     request: Request,
+    last_pulled_at: Optional[int] = Query(None),
+    idempotency_key: Optional[str] = Header(None),
+    prefer: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
 ):
+    content_length = request.headers.get("content-length")
+    size = int(content_length) if content_length and content_length.isdigit() else None
+    if size is not None and size > settings.SYNC_PUSH_MAX_BODY:
+        raise HTTPException(status_code=413, detail=f"Request body exceeds {settings.SYNC_PUSH_MAX_BODY} bytes")
+
+    # Prefer: respond-async - push ставится в очередь, ответ 202 сразу, статус - GET /sync/jobs/{id}
+    run_async = bool(prefer) and "respond-async" in prefer and SyncJobService.enabled()
+    scope = str(current_user.family_id)
+
+    threshold = settings.SYNC_PUSH_STREAM_THRESHOLD
+    if not run_async and threshold > 0 and sync_push_stream.available() and (size is None or size > threshold):
+        # Большое тело не собирается в памяти: сначала оно целиком (медленный клиент - без
+        # соединения с БД и транзакции) ложится во временный файл, затем записи пишутся
+        # пачками по мере разбора файла в одной короткой транзакции
+        try:
+            spooled, body_hash = await sync_push_stream.spool(
+                request.stream(), settings.SYNC_PUSH_MAX_BODY, threshold
+            )
+        except sync_push_stream.BodyTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+        async def apply():
+            # Родители, которые придут в теле позже своих детей - не сироты
+            pending = await sync_push_stream.record_ids(spooled, SyncService.parent_tables())
+            await spooled.seek(0)
+            deleted, orphans = await SyncService.push_stream(
+                family_id=current_user.family_id,
+                batches=sync_push_stream.iter_push(spooled, settings.SYNC_PUSH_BATCH_SIZE),
+                last_pulled_at=last_pulled_at,
+                pending=pending,
+            )
+            return {"status": "ok", "deleted": deleted, "orphans": orphans}
+
+        try:
+            key = IdempotencyService.hashed_key(scope, body_hash, idempotency_key, last_pulled_at)
+            return await run_push(key, body_hash, apply)
+        finally:
+            await spooled.close()
+
     try:
-        data = await request.json()
-    except Exception as e:
+        body = await sync_push_stream.read_body(request.stream(), settings.SYNC_PUSH_MAX_BODY)
+    except sync_push_stream.BodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        # Разбор и проверка структуры за один проход; записи проверяет декодер таблицы
+        data = SyncPushRequest.model_validate_json(body)
+    except ValidationError as e:
+        if any(error["type"] == "json_invalid" for error in e.errors()):
+            raise HTTPException(status_code=400, detail="Invalid JSON")
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+    changes = {
+        table_name: {"created": table.created, "updated": table.updated, "deleted": table.deleted}
+        for table_name, table in data.changes.items()
+    }
+
+    async def apply():
+        deleted, orphans = await SyncService.push_changes(
+            family_id=current_user.family_id,
+            changes=changes,
+            last_pulled_at=last_pulled_at,
+        )
+        return {"status": "ok", "deleted": deleted, "orphans": orphans}
+
+    if run_async:
+        async def apply():
+            records = sum(len(t["created"]) + len(t["updated"]) + len(t["deleted"]) for t in changes.values())
+            job = await SyncJobService.submit(current_user.family_id, body, last_pulled_at, records)
+            return {"status": "accepted", "job_id": job.id}
+        scope += ":async"
+
+    # Повтор того же push (обрыв связи, ретрай клиента) отдаёт сохранённый ответ без записи в БД
+    key, body_hash = IdempotencyService.request_key(scope, body, idempotency_key, last_pulled_at)
+    return await run_push(key, body_hash, apply, jobs_path=f"{request.url.path}/jobs" if run_async else None)
+
+
+async def run_push(key: Optional[str], body_hash: Optional[str], apply, jobs_path: Optional[str] = None) -> Response:
+    """
+    Run `apply` through the idempotency store (skipped without a key) and
+    map push errors to responses; with `jobs_path` the push was queued.
+    """
+    try:
+        if key is None:
+            content, replayed = await apply(), False
+        else:
+            content, replayed = await IdempotencyService.run(key, body_hash, apply)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body")
+    except PushConflict as e:
+        # Клиент должен сделать pull и повторить push
+        return FastJSONResponse(
+            status_code=409,
+            content={
+                "detail": "Records were changed on the server after last_pulled_at",
+                "code": "conflict",
+                "conflicts": e.conflicts,
+            },
+        )
+    except PushValidationError as e:
+        raise HTTPException(
+            status_code=422,
+            detail={"table": e.table, "id": e.record_id, "field": e.key, "message": e.message},
+        )
+    except sync_push_stream.BodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except sync_push_stream.JSON_ERRORS:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
-    changes = data.get("changes", {})
-    await SyncService.push_changes(
-        family_id=current_user.family_id,
-        changes=changes
-    )
-    return {"status": "ok"}
+    headers = {"Idempotent-Replayed": "true"} if replayed else {}
+    if jobs_path is not None:
+        headers.update({"Location": f"{jobs_path}/{content['job_id']}", "Preference-Applied": "respond-async"})
+        return FastJSONResponse(status_code=202, content=content, headers=headers)
+    return FastJSONResponse(content=content, headers=headers)
+
+
+@router.get("/jobs/{job_id}")
+async def get_push_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+):
+    job = await SyncJob.filter(id=job_id, family_id=current_user.family_id).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return SyncJobService.describe(job)
@@ -1,24 +1,45 @@
 """
 File upload endpoint
 """
-import os
-import uuid
 from pathlib import Path
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 
 from app.api.v1.schemas import FileUploadResponse
 from app.core.config import settings
 from app.core.dependencies import get_current_user
 from app.models.user import User
+from app.services.upload_stream import (
+    MULTIPART_OVERHEAD,
+    FormParserError,
+    InvalidUpload,
+    UploadTooLarge,
+    save_upload,
+)
 
 
 router = APIRouter(prefix="/upload", tags=["File Upload"])
 
+# Тело читается потоково, поэтому форма описана для Swagger вручную
+UPLOAD_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
 
-@router.post("", response_model=FileUploadResponse, status_code=status.HTTP_201_CREATED)
+
+@router.post("", response_model=FileUploadResponse, status_code=status.HTTP_201_CREATED, openapi_extra=UPLOAD_FORM)
 async def upload_file(
-    file: UploadFile = File(...),
+    request: Request,
     current_user: User = Depends(get_current_user),
 ):
     """
@@ -26,35 +47,38 @@ async def upload_file(
     
     Files are saved to uploads/ directory with unique names.
     """
-    # Validate file size
-    contents = await file.read()
-    file_size = len(contents)
-    
-    if file_size > settings.MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"File too large. Maximum size: {settings.MAX_FILE_SIZE} bytes"
-        )
-    
-    # Generate unique filename
-    file_extension = Path(file.filename).suffix if file.filename else ""
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File too large. Maximum size: {settings.MAX_FILE_SIZE} bytes"
+    )
+
+    # Validate declared size before reading anything
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+        raise too_large
     
-    # Create family subdirectory
+    # Stream into the family subdirectory
     family_dir = Path(settings.UPLOAD_DIR) / str(current_user.family_id)
-    family_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Save file
-    file_path = family_dir / unique_filename
-    
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    try:
+        filename, unique_filename, file_size = await save_upload(
+            request.headers.get("content-type"),
+            request.stream(),
+            family_dir,
+            settings.MAX_FILE_SIZE,
+            settings.UPLOAD_CHUNK_SIZE,
+        )
+    except UploadTooLarge:
+        raise too_large
+    except InvalidUpload as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except FormParserError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid multipart body")
     
     # Return file URL (relative path)
     file_url = f"{current_user.family_id}/{unique_filename}"
     
     return FileUploadResponse(
         file_url=file_url,
-        filename=file.filename or unique_filename,
+        filename=filename,
         size=file_size,
     )
@@ -0,0 +1,106 @@
+"""
+Admission control for the auth routes: token buckets per IP and per email,
+and a cap on concurrent password hashing
+"""
+import importlib
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Protocol
+
+from fastapi import HTTPException, Request, status
+
+from app.core.cache import get_cache
+from app.core.config import settings
+
+
+class AdmissionBackend(Protocol):
+    """Token bucket counters; implement it over Redis etc. to share limits between workers"""
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Take one token; 0 if admitted, otherwise seconds until a token is available"""
+        ...
+
+
+class MemoryBackend:
+    """Per-process buckets (default); idle buckets are full again and simply expire"""
+
+    def __init__(self) -> None:
+        self.cache = get_cache("auth_admission", maxsize=settings.AUTH_ADMISSION_MAX_KEYS)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self.cache.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self.cache.set(key, (tokens, now), ttl=burst / rate)
+        return wait
+
+
+_backend: Optional[AdmissionBackend] = None
+_hashing = 0
+
+
+def get_backend() -> AdmissionBackend:
+    global _backend
+    if _backend is None:
+        module_name, _, class_name = settings.AUTH_ADMISSION_BACKEND.rpartition(".")
+        _backend = getattr(importlib.import_module(module_name), class_name)()
+    return _backend
+
+
+def set_backend(backend: Optional[AdmissionBackend]) -> None:
+    global _backend
+    _backend = backend
+
+
+def _reject(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many attempts, try again later",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+async def admit(request: Request, email: Optional[str] = None) -> None:
+    """
+    Spend a token of the client's IP bucket and of the email's bucket, or
+    answer 429 with Retry-After.
+
+    Behind a reverse proxy run uvicorn with --forwarded-allow-ips, otherwise
+    every client shares the proxy's address.
+    """
+    backend = get_backend()
+    buckets = [("ip", request.client.host if request.client else "unknown",
+                settings.AUTH_IP_RATE_PER_MINUTE, settings.AUTH_IP_BURST)]
+    if email:
+        buckets.append(("email", email.strip().lower(),
+                        settings.AUTH_EMAIL_RATE_PER_MINUTE, settings.AUTH_EMAIL_BURST))
+    for scope, value, per_minute, burst in buckets:
+        if per_minute <= 0:
+            continue
+        wait = await backend.take(f"{scope}:{value}", per_minute / 60, max(burst, 1))
+        if wait > 0:
+            raise _reject(wait)
+
+
+@asynccontextmanager
+async def hash_slot() -> AsyncIterator[None]:
+    """
+    Hold one of AUTH_MAX_CONCURRENT_HASHES slots for a bcrypt call, or answer
+    429 right away: queueing more hashes than the pool can work off only
+    delays everyone and keeps the CPU busy for requests that time out.
+    """
+    global _hashing
+    limit = settings.AUTH_MAX_CONCURRENT_HASHES
+    if limit > 0 and _hashing >= limit:
+        raise _reject(1)
+    _hashing += 1
+    try:
+        yield
+    finally:
+        _hashing -= 1
@@ -31,11 +31,80 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "your-secret-key-change-this"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 10080  # 7 days
+    # "jose" (python-jose) или "hmac" (стандартная библиотека, только HS256/HS384/HS512; токены совместимы)
+    JWT_BACKEND: str = "jose"
+    # Проверенные токены помнятся до их exp (0 = проверять каждый раз)
+    JWT_CACHE_MAX_ENTRIES: int = 10000
+    # Потоки для bcrypt (хэширование и проверка паролей вне event loop)
+    PASSWORD_HASH_WORKERS: int = 2
+    # Кэш пользователя и семьи по токену в get_current_user (секунды, 0 = выключен).
+    # Сбрасывается при смене семьи и пароля только в том процессе, где она произошла:
+    # другие воркеры до TTL видят прежнюю семью (удалённый участник ещё может
+    # синхронизироваться с ней) и принимают токен пользователя, удалённого в другом процессе
+    AUTH_USER_CACHE_TTL: int = 5
+    AUTH_USER_CACHE_MAX_ENTRIES: int = 10000
+    # Ограничение входа, регистрации и вступления в семью (429 + Retry-After): попыток в минуту
+    # и запас на всплеск для IP и для email (0 = без ограничения), одновременных bcrypt на процесс.
+    # Счётчики - класс с методом take, по умолчанию в памяти процесса
+    AUTH_IP_RATE_PER_MINUTE: int = 30
+    AUTH_IP_BURST: int = 10
+    AUTH_EMAIL_RATE_PER_MINUTE: int = 5
+    AUTH_EMAIL_BURST: int = 5
+    AUTH_MAX_CONCURRENT_HASHES: int = 8
+    AUTH_ADMISSION_MAX_KEYS: int = 100000
+    AUTH_ADMISSION_BACKEND: str = "app.core.admission.MemoryBackend"
+    # Кэш ответа GET /family/ (секунды, 0 = выключен); сбрасывается при смене состава семьи
+    FAMILY_DETAILS_CACHE_TTL: int = 60
+    FAMILY_DETAILS_CACHE_MAX_ENTRIES: int = 10000
     
     # File Upload
     UPLOAD_DIR: str = "uploads"
     MAX_FILE_SIZE: int = 10485760  # 10MB
-    
+    # Загрузка пишется на диск кусками этого размера (байты) - память на загрузку постоянна
+    UPLOAD_CHUNK_SIZE: int = 64 * 1024
+
+    # Sync
+    # Сколько запросов к таблицам один pull может держать одновременно, 1 = последовательный режим.
+    # Не больше половины пула (asyncpg по умолчанию - 5 соединений, maxsize в URL БД): остальное
+    # остаётся другим pull, push и авторизации. Большее значение урезается до этой половины
+    SYNC_PULL_CONCURRENCY: int = 2
+    # Потоковый pull: размер пачки строк и включение по умолчанию для первой синхронизации
+    SYNC_STREAM_BATCH_SIZE: int = 1000
+    SYNC_STREAM_INITIAL_PULL: bool = False
+    # Кэш строк справочников по умолчанию (секунды), 0 = всегда из БД
+    SYNC_LOOKUP_CACHE_TTL: int = 300
+    # Источник pull: "updated_at" (скан таблиц) или "changelog" (журнал sync_changes, курсор - версия)
+    SYNC_PULL_SOURCE: str = "updated_at"
+    # Сколько pull ждёт окончания push своей семьи (секунды), затем 503 + Retry-After.
+    # Соединение пула между попытками не занято
+    SYNC_PULL_LOCK_WAIT: float = 2.0
+    # Фоновое обслуживание синхронизации (сжатие журнала), секунды; 0 = выключено
+    SYNC_MAINTENANCE_INTERVAL: int = 300
+    SYNC_COMPACT_BATCH_SIZE: int = 5000
+    # Удалённые записи (tombstones) старше срока удаляются физически; 0 = хранить вечно (по умолчанию).
+    # Клиенты с last_pulled_at старше срока получают 410 и делают полную синхронизацию.
+    SYNC_TOMBSTONE_RETENTION_DAYS: int = 0
+    SYNC_PURGE_BATCH_SIZE: int = 1000
+    # Push: строк в одном INSERT ... ON CONFLICT
+    SYNC_PUSH_BATCH_SIZE: int = 500
+    # Максимальный размер тела push (байты, больше - 413). Тела больше порога (и без Content-Length)
+    # разбираются потоково, пачками по SYNC_PUSH_BATCH_SIZE записей (нужен ijson); 0 = всегда целиком
+    SYNC_PUSH_MAX_BODY: int = 50 * 1024 * 1024
+    SYNC_PUSH_STREAM_THRESHOLD: int = 1024 * 1024
+    # Повторы push (Idempotency-Key или хэш тела + last_pulled_at): сколько помнить ответ.
+    # Хранилище - класс с методами get/set, по умолчанию кэш в памяти процесса
+    SYNC_IDEMPOTENCY_TTL: int = 600
+    SYNC_IDEMPOTENCY_MAX_ENTRIES: int = 10000
+    SYNC_IDEMPOTENCY_BACKEND: str = "app.services.idempotency.MemoryBackend"
+    # Асинхронный push (Prefer: respond-async): фоновые обработчики в процессе (0 = выключено),
+    # опрос очереди и перезапуск задач без heartbeat дольше таймаута (секунды; heartbeat - каждую
+    # треть таймаута), попытки, хранение готовых задач (часы)
+    SYNC_JOB_WORKERS: int = 2
+    SYNC_JOB_POLL_INTERVAL: int = 5
+    SYNC_JOB_TIMEOUT: int = 600
+    SYNC_JOB_MAX_ATTEMPTS: int = 3
+    SYNC_JOB_RETENTION_HOURS: int = 24
+
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -72,6 +141,7 @@ TORTOISE_ORM = {
                 "app.models.document",
                 "aerich.models",
                 "app.models.password_reset",
+                "app.models.sync_version", "app.models.sync_change", "app.models.sync_job",
                 ],
             "default_connection": "default",
         },
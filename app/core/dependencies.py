@@ -1,17 +1,52 @@
 """
 FastAPI dependencies for authentication and authorization
 """
+import copy
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
+from app.core.cache import TTLCache, get_cache
+from app.core.config import settings
 from app.core.security import decode_access_token
 from app.models.user import User
 
 
 security = HTTPBearer()
 
+USER_CACHE = "auth_users"
+
+# Bumped by invalidate_user: a user loaded before an invalidation is not put into the cache
+_invalidations = 0
+
+
+def _user_cache() -> TTLCache:
+    return get_cache(USER_CACHE, maxsize=settings.AUTH_USER_CACHE_MAX_ENTRIES, ttl=settings.AUTH_USER_CACHE_TTL)
+
+
+def invalidate_user(user_id) -> None:
+    """
+    Forget the cached user and family of every token of `user_id`.
+
+    Call it after changing the user's family or credentials. Only this
+    process is affected; other workers keep serving the old user and family
+    until their entry expires, at most AUTH_USER_CACHE_TTL seconds.
+    """
+    global _invalidations
+    _invalidations += 1
+    user_id = str(user_id)
+    _user_cache().discard(lambda key: key[0] == user_id)
+
+
+def _detached(user: User) -> User:
+    """Per-request copy, so handlers that modify current_user never touch the cached one"""
+    clone = copy.copy(user)
+    clone._await_when_save = {}
+    if user.family is not None:
+        clone.family = copy.copy(user.family)
+    return clone
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security)
@@ -37,6 +72,14 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    cache = _user_cache() if settings.AUTH_USER_CACHE_TTL > 0 else None
+    key = (user_id, token)
+    invalidations = _invalidations
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return _detached(cached)
+
     try:
         user = await User.get(id=user_id).prefetch_related("family")
     except Exception:
@@ -52,7 +95,10 @@ async def get_current_user(
             detail="User has been deleted",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
+
+    if cache is not None and invalidations == _invalidations:
+        cache.set(key, user)
+        return _detached(user)
     return user
 
 
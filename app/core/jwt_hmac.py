@@ -0,0 +1,82 @@
+"""
+Minimal HS256/HS384/HS512 JWT on the standard library (JWT_BACKEND=hmac)
+
+Tokens are interchangeable with python-jose ones: the same header, claims
+and signature, so the backend can be switched without logging users out.
+"""
+import base64
+import calendar
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+DIGESTS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+
+
+class InvalidToken(Exception):
+    """Malformed token, bad signature or expired claims"""
+
+
+def supports(algorithm: str) -> bool:
+    return algorithm in DIGESTS
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def _sign(signing_input: bytes, key: str, algorithm: str) -> bytes:
+    return hmac.new(key.encode("utf-8"), signing_input, DIGESTS[algorithm]).digest()
+
+
+def encode(claims: Dict[str, Any], key: str, algorithm: str) -> str:
+    claims = dict(claims)
+    for claim in ("exp", "iat", "nbf"):
+        if isinstance(claims.get(claim), datetime):
+            claims[claim] = calendar.timegm(claims[claim].utctimetuple())
+    header = json.dumps({"alg": algorithm, "typ": "JWT"}, separators=(",", ":"), sort_keys=True)
+    payload = json.dumps(claims, separators=(",", ":"))
+    signing_input = _b64encode(header.encode("utf-8")) + b"." + _b64encode(payload.encode("utf-8"))
+    return (signing_input + b"." + _b64encode(_sign(signing_input, key, algorithm))).decode("ascii")
+
+
+def decode(token: str, key: str, algorithm: str) -> Dict[str, Any]:
+    """Verified claims; the same checks python-jose makes for the tokens this app issues"""
+    try:
+        raw = token.encode("ascii")
+        if raw.count(b".") != 2:
+            raise InvalidToken("Not enough segments" if raw.count(b".") < 2 else "Too many segments")
+        signing_input, _, signature = raw.rpartition(b".")
+        header_segment, _, payload_segment = signing_input.partition(b".")
+        header = json.loads(_b64decode(header_segment))
+        if not isinstance(header, dict) or header.get("alg") != algorithm:
+            raise InvalidToken("Unexpected algorithm")
+        if not hmac.compare_digest(_sign(signing_input, key, algorithm), _b64decode(signature)):
+            raise InvalidToken("Signature verification failed")
+        claims = json.loads(_b64decode(payload_segment))
+    except (ValueError, UnicodeError) as e:
+        raise InvalidToken(str(e)) from e
+    if not isinstance(claims, dict):
+        raise InvalidToken("Invalid payload")
+
+    now = time.time()
+    for claim in ("exp", "nbf", "iat"):
+        if claim in claims and not isinstance(claims[claim], (int, float)):
+            raise InvalidToken(f"Invalid {claim} claim")
+    if "exp" in claims and claims["exp"] <= now:
+        raise InvalidToken("Signature has expired")
+    if "nbf" in claims and claims["nbf"] > now:
+        raise InvalidToken("The token is not yet valid")
+    # python-jose отклоняет aud, если аудитория не задана - так же и здесь
+    if "aud" in claims:
+        raise InvalidToken("Invalid audience")
+    if "sub" in claims and not isinstance(claims["sub"], str):
+        raise InvalidToken("Subject must be a string")
+    return claims
@@ -0,0 +1,52 @@
+"""
+JSON response class backed by orjson, with a stdlib fallback
+"""
+import json
+from datetime import date, datetime
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional dependency (pip install .[fast])
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    # WatermelonDB хранит даты как миллисекунды
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def stdlib_dumps(content: Any) -> bytes:
+    """Same settings as starlette's JSONResponse, plus datetime handling"""
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+        default=_default,
+    ).encode("utf-8")
+
+
+def orjson_dumps(content: Any) -> bytes:
+    # Passthrough hands datetimes to _default instead of emitting ISO strings
+    return orjson.dumps(content, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+dumps = orjson_dumps if orjson is not None else stdlib_dumps
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse that encodes with orjson when it is installed.
+    Datetimes are rendered as millisecond timestamps.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,14 +1,21 @@
 """
 Security utilities - JWT, password hashing
 """
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
+from app.core import jwt_hmac
+from app.core.cache import TTLCache, get_cache
 from app.core.config import settings
 
+TOKEN_CACHE = "jwt_claims"
+
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -24,6 +31,48 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+# bcrypt (~250 ms на хэш) отпускает GIL, поэтому хватает потоков; пул ограничен,
+# чтобы всплеск логинов не занял все ядра и не мешал синхронизации
+_hash_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_hash_executor() -> ThreadPoolExecutor:
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+        )
+    return _hash_executor
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the hashing pool, without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_hash_executor(), verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the hashing pool, without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_hash_executor(), get_password_hash, password)
+
+
+def shutdown_hash_executor() -> None:
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False)
+        _hash_executor = None
+
+
+def _use_hmac() -> bool:
+    # Стандартная библиотека умеет только HS*, остальные алгоритмы - через python-jose
+    return settings.JWT_BACKEND == "hmac" and jwt_hmac.supports(settings.ALGORITHM)
+
+
+def _token_cache() -> TTLCache:
+    return get_cache(TOKEN_CACHE, maxsize=settings.JWT_CACHE_MAX_ENTRIES)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token"""
     to_encode = data.copy()
@@ -34,15 +83,42 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
     to_encode.update({"exp": expire})
+    if _use_hmac():
+        return jwt_hmac.encode(to_encode, settings.SECRET_KEY, settings.ALGORITHM)
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     
     return encoded_jwt
 
 
-def decode_access_token(token: str) -> Optional[dict]:
-    """Decode JWT access token"""
+def _verify_access_token(token: str) -> Optional[dict]:
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
-    except JWTError:
+        if _use_hmac():
+            return jwt_hmac.decode(token, settings.SECRET_KEY, settings.ALGORITHM)
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except (JWTError, jwt_hmac.InvalidToken):
         return None
+
+
+def decode_access_token(token: str) -> Optional[dict]:
+    """
+    Decode JWT access token.
+
+    Verified tokens are remembered until their exp, so a long-lived token
+    is checked once per process rather than on every request. Only the
+    claims are cached; membership is still resolved by get_current_user.
+    """
+    if settings.JWT_CACHE_MAX_ENTRIES <= 0:
+        return _verify_access_token(token)
+
+    cache = _token_cache()
+    payload = cache.get(token)
+    if payload is None:
+        payload = _verify_access_token(token)
+        if payload is None:
+            return None
+        exp = payload.get("exp")
+        if not isinstance(exp, (int, float)):
+            return payload
+        if exp - time.time() > 0:
+            cache.set(token, payload, ttl=exp - time.time())
+    return dict(payload)
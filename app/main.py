@@ -25,8 +25,15 @@ from app.models.transfusion import Transfusion
 from app.models.password_reset import PasswordResetToken
 from app.models.analysis_template import AnalysisTemplate
 
+from app.core.cache import cache_stats
+from app.core.dependencies import invalidate_user
 from app.core.mail import send_reset_email
-from passlib.hash import bcrypt 
+from app.core.security import get_password_hash_async, shutdown_hash_executor
+from app.services.maintenance import MaintenanceService
+from app.services.sync import SYNC_MODELS
+from app.services.sync_jobs import SyncJobService
+from app.services.sync_plans import compile_plans
+from app.services.sync_versions import SyncVersionService
 
 templates = Jinja2Templates(directory="app/templates")
 security = HTTPBasic()
@@ -103,6 +110,11 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/health/cache", include_in_schema=False)
+async def cache_health(username: str = Depends(get_current_username)):
+    # Кэши процесса (у каждого воркера свои): размер, попадания, доля попаданий
+    return cache_stats()
+
 # --- СБРОС ПАРОЛЯ ---
 
 @app.post("/api/v1/auth/forgot-password")
@@ -152,8 +164,9 @@ async def reset_password_action(request: Request, token: str = Form(...), passwo
         )
 
     user = reset_token.user
-    user.password_hash = bcrypt.hash(password)
+    user.password_hash = await get_password_hash_async(password)
     await user.save()
+    invalidate_user(user.id)
 
     reset_token.used = True
     await reset_token.save()
@@ -171,3 +184,23 @@ register_tortoise(
     generate_schemas=False,
     add_exception_handlers=True,
 )
+
+
+@app.on_event("startup")
+async def init_sync():
+    # Регистрируется после register_tortoise, поэтому модели уже инициализированы
+    compile_plans(SYNC_MODELS.values())
+    try:
+        await SyncVersionService.ensure_tracking()
+    except Exception as e:
+        # Без отметки pull всегда опрашивает все таблицы
+        logging.error(f"Версии синхронизации не включены: {e}")
+    MaintenanceService.start()
+    SyncJobService.start()
+
+
+@app.on_event("shutdown")
+async def stop_maintenance():
+    await SyncJobService.stop()
+    await MaintenanceService.stop()
+    shutdown_hash_executor()
@@ -8,6 +8,9 @@ from app.models.document import Document
 from app.models.password_reset import PasswordResetToken
 from app.models.component_type import ComponentType
 from app.models.chelator_type import ChelatorType
+from app.models.sync_version import SyncVersion
+from app.models.sync_change import SyncChange
+from app.models.sync_job import SyncJob
 
 __all__ = [
     "User",
@@ -22,4 +25,7 @@ __all__ = [
     "PasswordResetToken",
     "ComponentType",
     "ChelatorType",
+    "SyncVersion",
+    "SyncChange",
+    "SyncJob",
 ]
@@ -2,7 +2,7 @@
 Analysis models - blood analysis records (formerly BloodTest)
 """
 from tortoise import fields
-from app.models.base import WatermelonDBModel
+from app.models.base import WatermelonDBModel, sync_indexes
 
 class Analysis(WatermelonDBModel):
     """
@@ -20,6 +20,7 @@ class Analysis(WatermelonDBModel):
     
     class Meta:
         table = "analyses"
+        indexes = sync_indexes("analyses")
         ordering = ["-date"]
     
     def __str__(self):
@@ -50,6 +51,7 @@ class AnalysisItem(WatermelonDBModel):
     
     class Meta:
         table = "analysis_items"
+        indexes = sync_indexes("analysis_items")
     
     def __str__(self):
         return f"{self.name}: {self.value} {self.unit}"
@@ -2,7 +2,7 @@
 Analysis template model - user-created presets for blood tests
 """
 from tortoise import fields
-from app.models.base import WatermelonDBModel
+from app.models.base import WatermelonDBModel, sync_indexes
 
 class AnalysisTemplate(WatermelonDBModel):
     """
@@ -22,6 +22,7 @@ class AnalysisTemplate(WatermelonDBModel):
     
     class Meta:
         table = "analysis_templates"
+        indexes = sync_indexes("analysis_templates", has_defaults=True)
     
     def __str__(self):
         return self.name
@@ -51,6 +52,7 @@ class AnalysisTemplateItem(WatermelonDBModel):
     
     class Meta:
         table = "analysis_template_items"
+        indexes = sync_indexes("analysis_template_items")
     
     def __str__(self):
         return f"Template Item: {self.name} ({self.unit})"
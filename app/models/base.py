@@ -6,9 +6,35 @@ from typing import Optional
 import uuid
 
 from tortoise import fields
+from tortoise.indexes import Index, PartialIndex
 from tortoise.models import Model
 
 
+def sync_indexes(table: str, has_defaults: bool = False) -> list:
+    """
+    Indexes behind the pull query of a synced table.
+
+    Pull filters by ``family_id`` and ``updated_at > last_pulled_at``, so every
+    synced table gets a composite ``(family_id, updated_at)`` index (it also
+    serves ``family_id IS NULL`` for global rows). Lookup tables that are
+    pulled with ``is_default OR family_id = ...`` additionally get a partial
+    index over the default rows. The tombstone purge looks up old soft-deleted
+    rows through a partial ``(deleted_at) WHERE deleted_at IS NOT NULL`` index.
+
+    Names are fixed so the models and the migration that builds the same
+    indexes with CREATE INDEX CONCURRENTLY stay in agreement.
+    """
+    tombstones = PartialIndex(fields=("deleted_at",), name=f"idx_{table}_deleted")
+    # condition= only renders equality checks
+    tombstones.extra = ' WHERE "deleted_at" IS NOT NULL'
+    indexes = [Index(fields=("family_id", "updated_at"), name=f"idx_{table}_family_updated"), tombstones]
+    if has_defaults:
+        indexes.append(
+            PartialIndex(fields=("updated_at",), condition={"is_default": True}, name=f"idx_{table}_default_updated")
+        )
+    return indexes
+
+
 class WatermelonDBModel(Model):
     """
     Base model for all entities with WatermelonDB sync support.
@@ -2,7 +2,7 @@
 ChelatorType model - medication types (e.g. Desferal, Kelfer)
 """
 from tortoise import fields
-from app.models.base import WatermelonDBModel
+from app.models.base import WatermelonDBModel, sync_indexes
 
 class ChelatorType(WatermelonDBModel):
     """
@@ -22,6 +22,7 @@ class ChelatorType(WatermelonDBModel):
     
     class Meta:
         table = "chelator_types"
+        indexes = sync_indexes("chelator_types", has_defaults=True)
         ordering = ["sort_order"]
     
     def __str__(self):
@@ -2,7 +2,7 @@
 ComponentType model - blood component types (e.g. RBC, Platelets)
 """
 from tortoise import fields
-from app.models.base import WatermelonDBModel
+from app.models.base import WatermelonDBModel, sync_indexes
 
 class ComponentType(WatermelonDBModel):
     """
@@ -23,6 +23,7 @@ class ComponentType(WatermelonDBModel):
     
     class Meta:
         table = "component_types"
+        indexes = sync_indexes("component_types", has_defaults=True)
         ordering = ["sort_order"]
     
     def __str__(self):
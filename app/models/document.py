@@ -3,7 +3,7 @@ Document model - uploaded files and documents
 """
 from tortoise import fields
 
-from app.models.base import WatermelonDBModel
+from app.models.base import WatermelonDBModel, sync_indexes
 
 
 class Document(WatermelonDBModel):
@@ -25,6 +25,7 @@ class Document(WatermelonDBModel):
     
     class Meta:
         table = "documents"
+        indexes = sync_indexes("documents")
         ordering = ["-created_at"]
     
     def __str__(self):
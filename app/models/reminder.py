@@ -2,7 +2,7 @@
 Reminder model - scheduled reminders
 """
 from tortoise import fields
-from app.models.base import WatermelonDBModel
+from app.models.base import WatermelonDBModel, sync_indexes
 
 class Reminder(WatermelonDBModel):
     """
@@ -23,6 +23,7 @@ class Reminder(WatermelonDBModel):
     
     class Meta:
         table = "reminders"
+        indexes = sync_indexes("reminders")
         ordering = ["date", "time"]
     
     def __str__(self):
@@ -0,0 +1,35 @@
+"""
+SyncChange model - append-only changelog of pushed records
+"""
+from tortoise import fields
+from tortoise.indexes import Index
+from tortoise.models import Model
+
+
+class SyncChange(Model):
+    """
+    One write to a synced record.
+
+    ``version`` comes from the scope's changelog counter (see
+    SyncChangelogService.next_version). The counter row stays locked until the
+    writing transaction commits, so versions of one family become visible in
+    order and a pull can safely resume from the highest version it has seen.
+    """
+
+    id = fields.BigIntField(pk=True)
+    scope = fields.CharField(max_length=255)
+    version = fields.BigIntField()
+    table_name = fields.CharField(max_length=64)
+    record_id = fields.CharField(max_length=255)
+    op = fields.CharField(max_length=16)  # create / update / delete
+    changed_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "sync_changes"
+        indexes = [
+            Index(fields=("scope", "version"), name="idx_sync_changes_scope_version"),
+            Index(fields=("scope", "table_name", "record_id"), name="idx_sync_changes_record"),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} v{self.version} {self.op} {self.table_name}/{self.record_id}"
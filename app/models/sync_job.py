@@ -0,0 +1,40 @@
+"""
+SyncJob model - queued push applied by the background worker
+"""
+import uuid
+
+from tortoise import fields
+from tortoise.indexes import Index
+from tortoise.models import Model
+
+
+class SyncJob(Model):
+    """
+    One push submitted with ``Prefer: respond-async``.
+
+    ``payload`` keeps the request body as received until the job finishes;
+    ``status`` moves queued -> running -> done | failed. The worker renews
+    ``heartbeat_at`` while the job runs; a job whose heartbeat is older than
+    SYNC_JOB_TIMEOUT (the worker died or hung) is claimed again.
+    """
+
+    id = fields.CharField(pk=True, max_length=36, default=lambda: str(uuid.uuid4()))
+    family = fields.ForeignKeyField("models.Family", related_name="sync_jobs", on_delete=fields.CASCADE)
+    status = fields.CharField(max_length=16, default="queued")
+    payload = fields.TextField(null=True)
+    last_pulled_at = fields.BigIntField(null=True)
+    records = fields.IntField(default=0)
+    attempts = fields.IntField(default=0)
+    result = fields.JSONField(null=True)
+    error = fields.JSONField(null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+    started_at = fields.DatetimeField(null=True)
+    heartbeat_at = fields.DatetimeField(null=True)
+    finished_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = "sync_jobs"
+        indexes = [Index(fields=("status", "created_at"), name="idx_sync_jobs_status_created")]
+
+    def __str__(self):
+        return f"SyncJob {self.id} ({self.status})"
@@ -0,0 +1,33 @@
+"""
+SyncVersion model - per-family change counters for sync pull
+"""
+from tortoise import fields
+from tortoise.models import Model
+
+
+# Scope of the rows shared by every family (default lookups and templates)
+GLOBAL_SCOPE = "global"
+
+
+class SyncVersion(Model):
+    """
+    Monotonic change counter of one synced table within a scope.
+
+    Scope is a family id, or GLOBAL_SCOPE for default rows with family_id NULL.
+    Every push (and every edit of default data) bumps ``version`` and moves
+    ``changed_at`` forward, so pull can tell that a table has not changed
+    since ``last_pulled_at`` without querying it.
+    """
+
+    id = fields.IntField(pk=True)
+    scope = fields.CharField(max_length=255)
+    table_name = fields.CharField(max_length=64)
+    version = fields.BigIntField(default=0)
+    changed_at = fields.DatetimeField()
+
+    class Meta:
+        table = "sync_versions"
+        unique_together = (("scope", "table_name"),)
+
+    def __str__(self):
+        return f"{self.scope}/{self.table_name} v{self.version}"
@@ -2,7 +2,7 @@
 Transfusion model - blood transfusion records
 """
 from tortoise import fields
-from app.models.base import WatermelonDBModel
+from app.models.base import WatermelonDBModel, sync_indexes
 
 class Transfusion(WatermelonDBModel):
     """
@@ -30,6 +30,7 @@ class Transfusion(WatermelonDBModel):
     
     class Meta:
         table = "transfusions"
+        indexes = sync_indexes("transfusions")
         ordering = ["-date"]
     
     def __str__(self):
@@ -0,0 +1,92 @@
+"""
+Family details: one joined query, cached rendered body with an ETag
+"""
+import hashlib
+from typing import Optional, Tuple
+
+from tortoise import connections
+
+from app.api.v1.schemas import FamilyDetailsResponse, UserResponse
+from app.core import responses
+from app.core.cache import TTLCache, get_cache
+from app.core.config import settings
+
+DETAILS_CACHE = "family_details"
+
+# (etag, JSON body)
+RenderedDetails = Tuple[str, bytes]
+
+
+def _details_cache() -> TTLCache:
+    return get_cache(
+        DETAILS_CACHE, maxsize=settings.FAMILY_DETAILS_CACHE_MAX_ENTRIES, ttl=settings.FAMILY_DETAILS_CACHE_TTL
+    )
+
+
+class FamilyService:
+    @staticmethod
+    async def load_details(family_id: str) -> Optional[FamilyDetailsResponse]:
+        """The family and its members in one query; None if there is no such family"""
+        rows = await connections.get("default").execute_query_dict(
+            'SELECT f."id", f."invite_code", f."owner_id", f."patient_name", f."patient_current_weight", '
+            'f."patient_birth_date", u."id" AS "member_id", u."email", u."created_at" '
+            'FROM "families" f LEFT JOIN "users" u ON u."family_id" = f."id" '
+            'WHERE f."id" = $1 ORDER BY u."created_at", u."id"',
+            [str(family_id)],
+        )
+        if not rows:
+            return None
+        family = rows[0]
+        return FamilyDetailsResponse(
+            id=family["id"],
+            invite_code=family["invite_code"],
+            owner_id=family["owner_id"],
+            patient_name=family["patient_name"],
+            patient_current_weight=family["patient_current_weight"],
+            patient_birth_date=family["patient_birth_date"],
+            members=[
+                UserResponse(
+                    id=row["member_id"],
+                    email=row["email"],
+                    family_id=family["id"],
+                    invite_code=family["invite_code"],
+                    created_at=row["created_at"],
+                )
+                for row in rows
+                if row["member_id"] is not None
+            ],
+        )
+
+    @staticmethod
+    def render(details: FamilyDetailsResponse) -> RenderedDetails:
+        body = responses.dumps(details.model_dump(mode="json"))
+        return f'"{hashlib.sha1(body).hexdigest()}"', body
+
+    @staticmethod
+    async def details(family_id: str) -> Optional[RenderedDetails]:
+        """
+        Rendered details, from the per-process cache when possible.
+
+        The ETag is a hash of the body, so every worker gives the same data the
+        same ETag. Membership changes call invalidate(); other processes and
+        changes made outside the API (admin) show up within the TTL.
+        """
+        family_id = str(family_id)
+        cache = _details_cache() if settings.FAMILY_DETAILS_CACHE_TTL > 0 else None
+        if cache is not None:
+            rendered = cache.get(family_id)
+            if rendered is not None:
+                return rendered
+        details = await FamilyService.load_details(family_id)
+        if details is None:
+            return None
+        rendered = FamilyService.render(details)
+        if cache is not None:
+            cache.set(family_id, rendered)
+        return rendered
+
+    @staticmethod
+    def invalidate(*family_ids) -> None:
+        cache = _details_cache()
+        for family_id in family_ids:
+            cache.pop(str(family_id))
@@ -0,0 +1,109 @@
+"""
+Replay store for idempotent push requests
+"""
+import asyncio
+import hashlib
+import importlib
+from typing import Any, Awaitable, Callable, Dict, Optional, Protocol, Tuple
+
+from app.core.cache import get_cache
+from app.core.config import settings
+
+# (body hash, response) of an applied push
+Entry = Tuple[str, Any]
+
+
+class IdempotencyBackend(Protocol):
+    """Storage for applied pushes; implement it over Redis etc. to share it between workers"""
+
+    async def get(self, key: str) -> Optional[Entry]: ...
+
+    async def set(self, key: str, entry: Entry, ttl: int) -> None: ...
+
+
+class MemoryBackend:
+    """Per-process TTL + LRU store (default)"""
+
+    def __init__(self) -> None:
+        self.cache = get_cache(
+            "sync_idempotency", maxsize=settings.SYNC_IDEMPOTENCY_MAX_ENTRIES, ttl=settings.SYNC_IDEMPOTENCY_TTL
+        )
+
+    async def get(self, key: str) -> Optional[Entry]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, entry: Entry, ttl: int) -> None:
+        self.cache.set(key, entry, ttl=ttl)
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different body"""
+
+
+_backend: Optional[IdempotencyBackend] = None
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def get_backend() -> IdempotencyBackend:
+    global _backend
+    if _backend is None:
+        module_name, _, class_name = settings.SYNC_IDEMPOTENCY_BACKEND.rpartition(".")
+        _backend = getattr(importlib.import_module(module_name), class_name)()
+    return _backend
+
+
+def set_backend(backend: Optional[IdempotencyBackend]) -> None:
+    global _backend
+    _backend = backend
+
+
+class IdempotencyService:
+    @staticmethod
+    def request_key(scope: str, body: bytes, header_key: Optional[str], last_pulled_at: Optional[int]) -> Tuple[str, str]:
+        """(store key, body hash); without a header the body hash plus last_pulled_at is the key"""
+        body_hash = hashlib.sha256(body).hexdigest()
+        return IdempotencyService.hashed_key(scope, body_hash, header_key, last_pulled_at), body_hash
+
+    @staticmethod
+    def hashed_key(scope: str, body_hash: str, header_key: Optional[str], last_pulled_at: Optional[int]) -> str:
+        """Store key of a body whose sha256 is already known (streamed push)"""
+        if header_key:
+            return f"{scope}:key:{header_key}"
+        return f"{scope}:body:{body_hash}:{last_pulled_at}"
+
+    @staticmethod
+    async def run(key: str, body_hash: str, apply: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Return (response, replayed).
+
+        A stored response for `key` is returned without calling `apply`; the
+        same request arriving while the first is still running waits for it
+        first. Only successful pushes are stored, so if the first one fails
+        the waiters take turns: the next one applies, the rest replay it.
+        """
+        backend = get_backend()
+        # Тот же push ещё применяется - дожидаемся его результата. После пробуждения
+        # ключ мог уже занять другой ожидающий, поэтому проверяем снова
+        while True:
+            running = _inflight.get(key)
+            if running is None:
+                break
+            await asyncio.wait([running])
+
+        # Ключ занимаем до первого await: иначе его успел бы занять и другой ожидающий
+        future = asyncio.get_running_loop().create_future()
+        _inflight[key] = future
+        try:
+            entry = await backend.get(key)
+            if entry is not None:
+                if entry[0] != body_hash:
+                    raise IdempotencyConflict(key)
+                return entry[1], True
+
+            response = await apply()
+            await backend.set(key, (body_hash, response), settings.SYNC_IDEMPOTENCY_TTL)
+            return response, False
+        finally:
+            # Failed pushes are not stored: a waiting retry then applies the push itself
+            _inflight.pop(key, None)
+            future.set_result(None)
@@ -0,0 +1,85 @@
+"""
+Invite codes: numbers from a PostgreSQL sequence, scrambled into 6 base36 characters
+"""
+import hashlib
+import hmac
+import logging
+import string
+
+from tortoise import connections
+
+from app.core.config import settings
+from app.models.family import generate_invite_code
+
+ALPHABET = string.digits + string.ascii_uppercase
+CODE_LENGTH = 6
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+
+# Должен совпадать с INCREMENT BY последовательности (миграция 8):
+# процесс берёт у БД блок номеров и раздаёт его без запросов
+SEQUENCE = "family_invite_seq"
+BLOCK_SIZE = 64
+
+_next = 0
+_end = 0
+
+
+def _key() -> bytes:
+    return hashlib.sha256(b"invite-codes:" + settings.SECRET_KEY.encode("utf-8")).digest()
+
+
+def _feistel(value: int, key: bytes) -> int:
+    """Keyed bijection on 32-bit integers (4-round Feistel network)"""
+    left, right = value >> 16, value & 0xFFFF
+    for round_no in range(4):
+        digest = hmac.new(key, f"{round_no}:{right}".encode("ascii"), hashlib.sha256).digest()
+        left, right = right, left ^ int.from_bytes(digest[:2], "big")
+    return (left << 16) | right
+
+
+def scramble(number: int) -> int:
+    """
+    Bijection on [0, CODE_SPACE): consecutive numbers give unrelated codes.
+
+    CODE_SPACE (36**6) is below 2**32, so the 32-bit permutation is applied
+    again until the value falls back into range (cycle walking).
+    """
+    key = _key()
+    value = _feistel(number, key)
+    while value >= CODE_SPACE:
+        value = _feistel(value, key)
+    return value
+
+
+def encode(number: int) -> str:
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+class InviteCodeService:
+    @staticmethod
+    async def allocate() -> str:
+        """
+        Next invite code, unique among codes issued from the sequence.
+
+        Families created before the sequence (or by admin/seed scripts) hold
+        random codes, so callers still retry on a unique violation.
+        """
+        global _next, _end
+        if _next >= _end:
+            try:
+                rows = await connections.get("default").execute_query_dict(
+                    f"SELECT nextval('{SEQUENCE}') AS \"start\""
+                )
+            except Exception as e:
+                # Нет миграции или номера кончились - старые случайные коды
+                logging.error(f"Последовательность кодов приглашения недоступна: {e}")
+                return generate_invite_code()
+            # Если блок одновременно взяли две корутины, остаток первого блока просто пропускается
+            _next, _end = rows[0]["start"], rows[0]["start"] + BLOCK_SIZE
+        number = _next
+        _next += 1
+        return encode(scramble(number))
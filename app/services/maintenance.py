@@ -0,0 +1,126 @@
+"""
+Background sync maintenance (changelog compaction, tombstone purge, finished push jobs)
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from tortoise import connections
+from tortoise.transactions import in_transaction
+
+from app.core.config import settings
+from app.services.sync import PULL_TABLES, SYNC_MODELS, SyncService
+from app.services.sync_changelog import SyncChangelogService
+from app.services.sync_jobs import SyncJobService
+from app.services.sync_retention import SyncRetentionService
+
+# pg_advisory_xact_lock key: only one worker process runs maintenance at a time
+MAINTENANCE_LOCK_KEY = 0x48454D4F  # "HEMO"
+
+_task: Optional[asyncio.Task] = None
+
+
+class MaintenanceService:
+    @staticmethod
+    async def _locked_batch(job) -> Optional[int]:
+        """Run one batch of `job` under the advisory lock; None if another worker holds it"""
+        async with in_transaction():
+            rows = await connections.get("default").execute_query_dict(
+                "SELECT pg_try_advisory_xact_lock($1) AS locked", [MAINTENANCE_LOCK_KEY]
+            )
+            if not rows[0]["locked"]:
+                return None
+            return await job()
+
+    @staticmethod
+    async def compact_changelog(batch_size: Optional[int] = None) -> int:
+        """Compact the changelog in short transactions until nothing is left to collapse"""
+        batch_size = batch_size or settings.SYNC_COMPACT_BATCH_SIZE
+        removed = 0
+        while True:
+            count = await MaintenanceService._locked_batch(lambda: SyncChangelogService.compact(batch_size))
+            if not count:
+                return removed
+            removed += count
+            if count < batch_size:
+                return removed
+
+    @staticmethod
+    async def purge_tombstones(retention_days: Optional[int] = None, batch_size: Optional[int] = None) -> int:
+        """
+        Hard-delete soft-deleted rows older than the retention period.
+
+        The horizon is published first and only rows older than the *previous*
+        horizon are deleted, so a pull that read the old horizon a moment ago
+        cannot miss tombstones. Children are purged before their parents, each
+        chunk in its own short transaction.
+        """
+        if retention_days is None:
+            retention_days = settings.SYNC_TOMBSTONE_RETENTION_DAYS
+        if retention_days <= 0:
+            return 0
+        batch_size = batch_size or settings.SYNC_PURGE_BATCH_SIZE
+
+        horizon = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        before = await SyncRetentionService.advance(horizon)
+        if before is None:
+            return 0
+
+        # documents не трогаем: у записи есть файл на диске
+        tables = [t for t in reversed(SyncService.table_order()) if t in PULL_TABLES]
+        removed = 0
+        for table_name in tables:
+            model = SYNC_MODELS[table_name]
+            children = [
+                (child._meta.db_table, column) for _, child, column in SyncService.child_tables(model, tables)
+            ]
+            while True:
+                count = await MaintenanceService._locked_batch(
+                    lambda: SyncRetentionService.purge_batch(model, children, before, batch_size)
+                )
+                removed += count or 0
+                if count is None or count < batch_size:
+                    break
+        return removed
+
+    @staticmethod
+    async def run_once() -> None:
+        try:
+            removed = await MaintenanceService.compact_changelog()
+            if removed:
+                logging.info(f"Журнал синхронизации сжат: удалено {removed} записей")
+            purged = await MaintenanceService.purge_tombstones()
+            if purged:
+                logging.info(f"Удалено устаревших tombstone-записей: {purged}")
+            jobs = await SyncJobService.purge(
+                datetime.now(timezone.utc) - timedelta(hours=settings.SYNC_JOB_RETENTION_HOURS)
+            )
+            if jobs:
+                logging.info(f"Удалено завершённых задач синхронизации: {jobs}")
+        except Exception as e:
+            logging.error(f"Ошибка обслуживания синхронизации: {e}")
+
+    @staticmethod
+    async def _loop(interval: int) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await MaintenanceService.run_once()
+
+    @staticmethod
+    def start() -> None:
+        global _task
+        interval = settings.SYNC_MAINTENANCE_INTERVAL
+        if interval > 0 and _task is None:
+            _task = asyncio.create_task(MaintenanceService._loop(interval))
+
+    @staticmethod
+    async def stop() -> None:
+        global _task
+        if _task is not None:
+            _task.cancel()
+            try:
+                await _task
+            except asyncio.CancelledError:
+                pass
+            _task = None
@@ -0,0 +1,107 @@
+"""
+Registration, joining a family by invite code and moving to a new family,
+each in a single statement
+"""
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from tortoise import connections
+from tortoise.exceptions import IntegrityError
+
+from app.services.invite_codes import InviteCodeService
+
+# Новый код при совпадении со старым случайным кодом
+INVITE_CODE_ATTEMPTS = 5
+
+# (user_id, family_id, invite_code)
+Onboarded = Tuple[str, str, str]
+
+
+class EmailTaken(Exception):
+    """A user with this email already exists"""
+
+
+def _violated(e: IntegrityError) -> str:
+    """Name of the violated constraint"""
+    original = e.args[0] if e.args else None
+    return getattr(original, "constraint_name", None) or str(e)
+
+
+class OnboardingService:
+    @staticmethod
+    async def register(email: str, password_hash: str) -> Onboarded:
+        """
+        Create the user together with their own family.
+
+        Both rows go in with one INSERT ... WITH statement, which commits or
+        fails as a whole; a taken email raises EmailTaken without leaving an
+        empty family behind.
+        """
+        user_id = str(uuid.uuid4())
+        try:
+            family_id, invite_code = await OnboardingService._with_new_family(
+                user_id,
+                'INSERT INTO "users" ("id", "created_at", "updated_at", "email", "password_hash", "family_id") '
+                'SELECT $2, $3, $3, $5, $6, "id" FROM "family"',
+                [email, password_hash],
+            )
+        except IntegrityError as e:
+            if "email" in _violated(e):
+                raise EmailTaken(email) from e
+            raise
+        return user_id, family_id, invite_code
+
+    @staticmethod
+    async def move_to_new_family(user_id: str) -> Tuple[str, str]:
+        """Give an existing user a family of their own (leave, removal); returns (family_id, invite_code)"""
+        return await OnboardingService._with_new_family(
+            user_id,
+            'UPDATE "users" SET "family_id" = (SELECT "id" FROM "family"), "updated_at" = $3 WHERE "id" = $2',
+            [],
+        )
+
+    @staticmethod
+    async def _with_new_family(owner_id: str, statement: str, params: list) -> Tuple[str, str]:
+        """
+        Insert a family owned by `owner_id` and run `statement` in the same
+        statement, with the new family as the "family" CTE; $1-$4 are the
+        family id, owner id, timestamp and invite code, `params` follow.
+        """
+        family_id = str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
+        for attempt in range(INVITE_CODE_ATTEMPTS):
+            invite_code = await InviteCodeService.allocate()
+            try:
+                await connections.get("default").execute_query(
+                    'WITH "family" AS ('
+                    '  INSERT INTO "families" ("id", "created_at", "updated_at", "invite_code", "owner_id") '
+                    '  VALUES ($1, $3, $3, $4, $2) RETURNING "id") '
+                    + statement,
+                    [family_id, owner_id, now, invite_code, *params],
+                )
+            except IntegrityError as e:
+                if "invite_code" not in _violated(e) or attempt == INVITE_CODE_ATTEMPTS - 1:
+                    raise
+                continue
+            return family_id, invite_code
+
+    @staticmethod
+    async def join(email: str, password_hash: str, invite_code: str) -> Optional[Onboarded]:
+        """Create the user in the family with `invite_code`; None if there is no such family"""
+        user_id = str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
+        try:
+            rows = await connections.get("default").execute_query_dict(
+                'INSERT INTO "users" ("id", "created_at", "updated_at", "email", "password_hash", "family_id") '
+                'SELECT $1, $2, $2, $3, $4, "id" FROM "families" WHERE "invite_code" = $5 '
+                'RETURNING "family_id"',
+                [user_id, now, email, password_hash, invite_code],
+            )
+        except IntegrityError as e:
+            if "email" in _violated(e):
+                raise EmailTaken(email) from e
+            raise
+        if not rows:
+            return None
+        return user_id, rows[0]["family_id"], invite_code
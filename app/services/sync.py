@@ -1,13 +1,25 @@
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional, List
+from typing import Any, AsyncIterator, Dict, Optional, List, Set, Tuple
+import asyncio
 import logging
+import time
 
-from tortoise.expressions import Q
+from tortoise import connections
 from tortoise.exceptions import IntegrityError
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+
+from app.core.config import settings
+from app.core.responses import dumps
+from app.services.sync_changelog import SyncChangelogService
+from app.services.sync_lookups import SyncLookupService
+from app.services.sync_plans import PushValidationError, get_decoder, get_plan
+from app.services.sync_retention import SyncRetentionService
+from app.services.sync_versions import GLOBAL_TABLES, SyncVersionService, Versions
 from app.models import (
     Transfusion, Analysis, AnalysisItem,
     AnalysisTemplate, AnalysisTemplateItem, Reminder, Document,
-    ComponentType, ChelatorType
+    ComponentType, ChelatorType, Family
 )
 
 # Словарь моделей
@@ -24,180 +36,873 @@ SYNC_MODELS = {
     "chelator_types": ChelatorType,
 }
 
+# Таблицы, которые отдаются клиенту при pull (documents синхронизируются через upload)
+PULL_TABLES = [
+    "transfusions", "analyses", "analysis_items",
+    "analysis_templates", "analysis_template_items",
+    "reminders",
+    "component_types", "chelator_types"
+]
+
+# pg_advisory_xact_lock(class, hashtext(family_id)): held by a push until commit
+PUSH_LOCK_CLASS = 0x53594E43  # "SYNC"
+
+# (rows tombstoned per table, ids of skipped records per table whose parent does not exist)
+PushResult = Tuple[Dict[str, int], Dict[str, List[str]]]
+
+
+class PullBusy(Exception):
+    """A push of the family kept writing for longer than SYNC_PULL_LOCK_WAIT"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("A push of this family is still being applied, retry shortly")
+        self.retry_after = retry_after
+
+
+class PushConflict(Exception):
+    """Pushed records were changed on the server after the client's last pull"""
+
+    def __init__(self, conflicts: Dict[str, List[str]]):
+        super().__init__(f"conflicting records: {sum(len(ids) for ids in conflicts.values())}")
+        self.conflicts = conflicts
+
+
 class SyncService:
     @staticmethod
-    async def pull_changes(family_id: str, last_pulled_at: Optional[datetime] = None) -> Dict[str, Any]:
-        changes = {}
+    def table_order() -> List[str]:
+        """SYNC_MODELS tables with every table after the synced tables it references"""
+        models = {model: table_name for table_name, model in SYNC_MODELS.items()}
+        ordered: List[str] = []
+
+        def visit(table_name: str, path: tuple) -> None:
+            if table_name in ordered or table_name in path:
+                return
+            model = SYNC_MODELS[table_name]
+            for fk_name in model._meta.fk_fields:
+                parent = models.get(model._meta.fields_map[fk_name].related_model)
+                if parent:
+                    visit(parent, path + (table_name,))
+            ordered.append(table_name)
+
+        for table_name in SYNC_MODELS:
+            visit(table_name, ())
+        return ordered
+
+    @staticmethod
+    def child_tables(model: Any, tables: Optional[List[str]] = None) -> List[tuple]:
+        """(table_name, model, fk column) of the synced tables that reference `model`"""
+        children = []
+        for table_name in tables or SYNC_MODELS:
+            child = SYNC_MODELS[table_name]
+            for fk_name in child._meta.fk_fields:
+                field = child._meta.fields_map[fk_name]
+                if field.related_model is model:
+                    children.append((table_name, child, field.source_field or f"{fk_name}_id"))
+        return children
+
+    @staticmethod
+    def parent_tables() -> List[str]:
+        """Synced tables referenced by another synced table"""
+        return [table_name for table_name, model in SYNC_MODELS.items() if SyncService.child_tables(model)]
+
+    @staticmethod
+    def descendant_tables(table_name: str) -> List[str]:
+        descendants = []
+        for child_name, _, _ in SyncService.child_tables(SYNC_MODELS[table_name]):
+            if child_name not in descendants:
+                descendants.append(child_name)
+                descendants.extend(t for t in SyncService.descendant_tables(child_name) if t not in descendants)
+        return descendants
+
+    @staticmethod
+    async def lock_pushes(family_id: str) -> None:
+        """Take the family's push lock; called first in every push transaction, held until commit"""
+        await connections.get("default").execute_query(
+            "SELECT pg_advisory_xact_lock($1, hashtext($2))", [PUSH_LOCK_CLASS, str(family_id)]
+        )
+
+    @staticmethod
+    async def pull_started(family_id: str) -> datetime:
+        """
+        The timestamp a pull hands out; versions must be read after this call.
+
+        Pushed rows become visible only at COMMIT, with an updated_at from
+        before it. So the timestamp is taken first and the pull then waits
+        (shared lock, released by the same statement) for the family's pushes
+        that are writing right now: their rows are visible to its queries,
+        and a push that starts later stamps its rows after the timestamp,
+        where the next pull finds them.
+
+        The lock is only tried, and the connection goes back to the pool
+        between attempts, so pulls queued behind a long push do not hold
+        the pool. After SYNC_PULL_LOCK_WAIT seconds PullBusy is raised.
+        """
         timestamp = datetime.now(timezone.utc)
-        
-        tables_to_sync = [
-            "transfusions", "analyses", "analysis_items", 
-            "analysis_templates", "analysis_template_items",
-            "reminders",
-            "component_types", "chelator_types"
-        ]
-
-        for table_name in tables_to_sync:
-            res_created, res_updated, res_deleted = [], [], []
-            
-            model = SYNC_MODELS.get(table_name)
-            if model:
-                try:
-                    # Determine filter based on whether the table is family-specific or global lookup
-                    if table_name in ["component_types", "chelator_types"]:
-                        # Pull items that are default OR belongs to this family
-                        query = model.filter(Q(is_default=True) | Q(family_id=family_id))
-                    elif table_name == "analysis_templates":
-                        # Pull items that are default OR belongs to this family
-                        query = model.filter(Q(is_default=True) | Q(family_id=family_id))
-                    elif table_name == "analysis_template_items":
-                        # Pull items where parent template is default OR template family is this family
-                        # Complex query, simplified: pull all items connected to visible templates
-                        # But simpler: pull items where (family_id is None) OR (family_id == family_id)
-                        # Assuming we set family_id=None for global items too
-                        query = model.filter(Q(family_id=None) | Q(family_id=family_id))
-                    else:
-                        has_family = "family" in model._meta.fields_map
-                        if has_family:
-                            query = model.filter(family_id=family_id)
-                        else:
-                            query = model.all()
-
-                    if last_pulled_at:
-                        query = query.filter(updated_at__gt=last_pulled_at)
-                    
-                    records = await query.all()
-                    
-                    for record in records:
-                        record_dict = await SyncService._serialize_record(record)
-                        if hasattr(record, 'deleted_at') and record.deleted_at is not None:
-                            res_deleted.append(str(record_dict["id"]))
-                        elif last_pulled_at is None or record.created_at > last_pulled_at:
-                            res_created.append(record_dict)
-                        else:
-                            res_updated.append(record_dict)
-                except Exception as e:
-                    logging.error(f"Таблица {table_name} пропущена: {e}")
-            
-            changes[table_name] = {
-                "created": res_created,
-                "updated": res_updated,
-                "deleted": res_deleted
-            }
+        deadline = time.monotonic() + settings.SYNC_PULL_LOCK_WAIT
+        delay = 0.02
+        while True:
+            rows = await connections.get("default").execute_query_dict(
+                'SELECT pg_try_advisory_xact_lock_shared($1, hashtext($2)) AS "locked"',
+                [PUSH_LOCK_CLASS, str(family_id)],
+            )
+            if rows[0]["locked"]:
+                return timestamp
+            if time.monotonic() + delay > deadline:
+                raise PullBusy(retry_after=1)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+    @staticmethod
+    async def pull_changes(
+        family_id: str,
+        last_pulled_at: Optional[datetime] = None,
+        concurrency: Optional[int] = None,
+        versions: Optional[Versions] = None,
+        timestamp: Optional[datetime] = None,
+    ) -> Dict[str, Any]:
+        """
+        Collect changes for every pulled table.
+
+        Tables whose change version has not moved since ``last_pulled_at`` are
+        answered with empty lists without being queried. The remaining table
+        queries are independent, so with ``concurrency > 1`` they are sent
+        to the pool at the same time; the semaphore keeps a single pull from
+        taking more than ``concurrency`` connections, and never more than
+        half of the pool. ``concurrency=1`` keeps
+        the old sequential loop. Callers passing ``versions`` also pass the
+        ``timestamp`` from pull_started() they took before reading them.
+        """
+        if timestamp is None:
+            timestamp = await SyncService.pull_started(family_id)
+        if concurrency is None:
+            concurrency = settings.SYNC_PULL_CONCURRENCY
+        # Один pull не забирает больше половины пула
+        pool_size = getattr(connections.get("default"), "pool_maxsize", None)
+        if pool_size:
+            concurrency = min(concurrency, max(1, pool_size // 2))
+        if versions is None:
+            versions = await SyncVersionService.get_versions(family_id)
+        SyncRetentionService.check(versions, last_pulled_at)
+        tables = SyncVersionService.changed_tables(versions, family_id, last_pulled_at, PULL_TABLES)
+
+        if concurrency > 1 and len(tables) > 1:
+            semaphore = asyncio.Semaphore(concurrency)
 
+            async def pull_limited(table_name: str) -> Dict[str, List[Any]]:
+                async with semaphore:
+                    return await SyncService._pull_table(table_name, family_id, last_pulled_at, versions)
+
+            results = await asyncio.gather(*(pull_limited(t) for t in tables))
+        else:
+            results = [
+                await SyncService._pull_table(t, family_id, last_pulled_at, versions)
+                for t in tables
+            ]
+
+        pulled = dict(zip(tables, results))
+        changes = {
+            table_name: pulled.get(table_name) or {"created": [], "updated": [], "deleted": []}
+            for table_name in PULL_TABLES
+        }
         return {
             "changes": changes,
             "timestamp": int(timestamp.timestamp() * 1000)
         }
 
     @staticmethod
-    async def push_changes(family_id: str, changes: Dict[str, Any]) -> None:
+    async def pull_changelog(family_id: str, cursor: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Pull driven by the changelog instead of ``updated_at`` scans.
+
+        The returned ``timestamp`` is the family's changelog version. A first
+        sync, or a cursor larger than the current version (an old millisecond
+        ``last_pulled_at``), falls back to a table scan and hands out the
+        version read before the scan, so nothing committed meanwhile is lost.
+        """
+        scope = str(family_id)
+        head = await SyncChangelogService.head(scope)
+        if cursor is None or cursor > head:
+            last_pulled_at = datetime.fromtimestamp(cursor / 1000, tz=timezone.utc) if cursor else None
+            result = await SyncService.pull_changes(family_id=family_id, last_pulled_at=last_pulled_at)
+            result["timestamp"] = head
+            return result
+
+        entries = await SyncChangelogService.read(scope, cursor)
+        collapsed = SyncChangelogService.collapse(entries)
+        # Строки по умолчанию не пишутся в журнал семьи. Клиент забирал данные не раньше
+        # последней записи журнала до его курсора - отдаём справочники, изменённые после неё
+        since = await SyncChangelogService.changed_at(scope, cursor)
+        if since is None:
+            # До курсора записей нет (семья ещё ничего не писала, или они сжаты): курсор выдан
+            # не раньше создания семьи, и справочники старше него у клиента уже есть
+            since = await Family.filter(id=family_id).first().values_list("created_at", flat=True)
+        versions = await SyncVersionService.get_versions(family_id)
+        changes = {}
+        for table_name in PULL_TABLES:
+            changes[table_name] = await SyncService._pull_logged(
+                table_name, family_id, collapsed.get(table_name, {}), since, versions
+            )
+
+        return {
+            "changes": changes,
+            "timestamp": max([cursor] + [version for _, _, _, version in entries]),
+        }
+
+    @staticmethod
+    async def _pull_logged(
+        table_name: str,
+        family_id: str,
+        records: Dict[str, tuple],
+        since: Optional[datetime],
+        versions: Versions,
+    ) -> Dict[str, List[Any]]:
+        res_created, res_updated, res_deleted = [], [], []
+        model = SYNC_MODELS.get(table_name)
+        if not model:
+            return {"created": res_created, "updated": res_updated, "deleted": res_deleted}
+
+        try:
+            if table_name in GLOBAL_TABLES:
+                # With SYNC_LOOKUP_CACHE_TTL=0 get_rows simply reads the rows every time
+                lookups = SyncLookupService.split(
+                    await SyncLookupService.get_rows(table_name, model, versions), since
+                )
+                res_created, res_updated, res_deleted = lookups["created"], lookups["updated"], lookups["deleted"]
+
+            plan = get_plan(model)
+            id_index, deleted_index = plan.id_index, plan.deleted_index
+            live = [record_id for record_id, (op, _) in records.items() if op != "delete"]
+            rows = {}
+            for start in range(0, len(live), 1000):
+                query = model.filter(id__in=live[start:start + 1000])
+                if "family" in model._meta.fields_map:
+                    query = query.filter(family_id=family_id)
+                for row in await query.values_list(*plan.columns):
+                    rows[str(row[id_index])] = row
+
+            for record_id, (op, created) in records.items():
+                row = rows.get(record_id)
+                if op == "delete" or (row is not None and row[deleted_index] is not None):
+                    res_deleted.append(record_id)
+                elif row is None:
+                    continue  # запись уже удалена физически
+                elif created:
+                    res_created.append(plan.serialize_row(row))
+                else:
+                    res_updated.append(plan.serialize_row(row))
+        except Exception as e:
+            logging.error(f"Таблица {table_name} пропущена: {e}")
+
+        return {
+            "created": res_created,
+            "updated": res_updated,
+            "deleted": res_deleted
+        }
+
+    @staticmethod
+    def _table_query(
+        table_name: str,
+        model: Any,
+        family_id: str,
+        last_pulled_at: Optional[datetime],
+        include_global: bool = True,
+    ) -> Any:
+        # Determine filter based on whether the table is family-specific or global lookup
+        if not include_global and table_name in ["component_types", "chelator_types", "analysis_templates"]:
+            # Default rows come from SyncLookupService, only the family's custom ones are queried
+            query = model.filter(family_id=family_id, is_default=False)
+        elif not include_global and table_name == "analysis_template_items":
+            query = model.filter(family_id=family_id)
+        elif table_name in ["component_types", "chelator_types"]:
+            # Pull items that are default OR belongs to this family
+            query = model.filter(Q(is_default=True) | Q(family_id=family_id))
+        elif table_name == "analysis_templates":
+            # Pull items that are default OR belongs to this family
+            query = model.filter(Q(is_default=True) | Q(family_id=family_id))
+        elif table_name == "analysis_template_items":
+            # Pull items where parent template is default OR template family is this family
+            # Complex query, simplified: pull all items connected to visible templates
+            # But simpler: pull items where (family_id is None) OR (family_id == family_id)
+            # Assuming we set family_id=None for global items too
+            query = model.filter(Q(family_id=None) | Q(family_id=family_id))
+        else:
+            has_family = "family" in model._meta.fields_map
+            if has_family:
+                query = model.filter(family_id=family_id)
+            else:
+                query = model.all()
+
+        if last_pulled_at:
+            query = query.filter(updated_at__gt=last_pulled_at)
+        return query
+
+    @staticmethod
+    async def _pull_table(
+        table_name: str,
+        family_id: str,
+        last_pulled_at: Optional[datetime],
+        versions: Optional[Versions] = None,
+    ) -> Dict[str, List[Any]]:
+        res_created, res_updated, res_deleted = [], [], []
+
+        model = SYNC_MODELS.get(table_name)
+        if model:
+            try:
+                cached = SyncLookupService.enabled(table_name)
+                if cached:
+                    lookups = SyncLookupService.split(
+                        await SyncLookupService.get_rows(table_name, model, versions or {}), last_pulled_at
+                    )
+                    res_created, res_updated, res_deleted = lookups["created"], lookups["updated"], lookups["deleted"]
+
+                query = SyncService._table_query(
+                    table_name, model, family_id, last_pulled_at, include_global=not cached
+                )
+
+                # Сырые кортежи вместо экземпляров моделей: ORM-объекты не нужны,
+                # план сам знает порядок колонок и конвертеры
+                plan = get_plan(model)
+                rows = await query.values_list(*plan.columns)
+                id_index, created_index, deleted_index = plan.id_index, plan.created_index, plan.deleted_index
+
+                for row in rows:
+                    if row[deleted_index] is not None:
+                        res_deleted.append(str(row[id_index]))
+                    elif last_pulled_at is None or row[created_index] > last_pulled_at:
+                        res_created.append(plan.serialize_row(row))
+                    else:
+                        res_updated.append(plan.serialize_row(row))
+            except Exception as e:
+                logging.error(f"Таблица {table_name} пропущена: {e}")
+
+        return {
+            "created": res_created,
+            "updated": res_updated,
+            "deleted": res_deleted
+        }
+
+    @staticmethod
+    async def stream_pull(
+        family_id: str,
+        last_pulled_at: Optional[datetime] = None,
+        batch_size: Optional[int] = None,
+        cursor: Optional[int] = None,
+        versions: Optional[Versions] = None,
+        timestamp: Optional[datetime] = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Same document as pull_changes, written incrementally.
+
+        Every bucket is read with its own keyset-paginated query (``id > last``,
+        ``batch_size`` rows at a time) and encoded batch by batch, so memory
+        stays bounded by one batch regardless of the family's history.
+        ``cursor`` replaces the trailing timestamp (changelog pull source);
+        ``timestamp`` is as in pull_changes. The purge horizon must be
+        checked by the caller: once streaming has started the status code
+        can no longer change.
+        """
+        if timestamp is None and cursor is None:
+            timestamp = await SyncService.pull_started(family_id)
+        if batch_size is None:
+            batch_size = settings.SYNC_STREAM_BATCH_SIZE
+        if versions is None:
+            versions = await SyncVersionService.get_versions(family_id)
+        tables = set(SyncVersionService.changed_tables(versions, family_id, last_pulled_at, PULL_TABLES))
+
+        yield b'{"changes":{'
+        for position, table_name in enumerate(PULL_TABLES):
+            prefix = b"," if position else b""
+            yield prefix + dumps(table_name) + b":{"
+
+            model = SYNC_MODELS.get(table_name) if table_name in tables else None
+            buckets = ("created", "updated", "deleted")
+            for bucket_position, bucket in enumerate(buckets):
+                yield (b"," if bucket_position else b"") + dumps(bucket) + b":["
+                if model:
+                    try:
+                        first = True
+                        async for chunk in SyncService._stream_bucket(
+                            table_name, model, bucket, family_id, last_pulled_at, batch_size, versions
+                        ):
+                            yield chunk if first else b"," + chunk
+                            first = False
+                    except Exception as e:
+                        # Заголовки уже отправлены: закрываем массив, чтобы JSON остался валидным
+                        logging.error(f"Таблица {table_name} ({bucket}) пропущена: {e}")
+                yield b"]"
+            yield b"}"
+
+        if cursor is None:
+            cursor = int(timestamp.timestamp() * 1000)
+        yield b'},"timestamp":' + dumps(cursor) + b"}"
+
+    @staticmethod
+    async def _stream_bucket(
+        table_name: str,
+        model: Any,
+        bucket: str,
+        family_id: str,
+        last_pulled_at: Optional[datetime],
+        batch_size: int,
+        versions: Optional[Versions] = None,
+    ) -> AsyncIterator[bytes]:
+        cached = SyncLookupService.enabled(table_name)
+        if cached:
+            entries = await SyncLookupService.get_rows(table_name, model, versions or {})
+            rows = SyncLookupService.split(entries, last_pulled_at)[bucket]
+            for start in range(0, len(rows), batch_size):
+                yield b",".join(dumps(row) for row in rows[start:start + batch_size])
+
+        query = SyncService._table_query(table_name, model, family_id, last_pulled_at, include_global=not cached)
+        if bucket == "deleted":
+            query = query.filter(deleted_at__isnull=False)
+        elif bucket == "created":
+            query = query.filter(deleted_at__isnull=True)
+            if last_pulled_at:
+                query = query.filter(created_at__gt=last_pulled_at)
+        else:
+            if last_pulled_at is None:
+                return  # при первой синхронизации всё попадает в created
+            query = query.filter(deleted_at__isnull=True, created_at__lte=last_pulled_at)
+
+        plan = get_plan(model)
+        id_index = plan.id_index
+        last_id = None
+        while True:
+            page = query.filter(id__gt=last_id) if last_id is not None else query
+            if bucket == "deleted":
+                rows = await page.order_by("id").limit(batch_size).values_list("id", flat=True)
+                if rows:
+                    yield b",".join(dumps(str(record_id)) for record_id in rows)
+                    last_id = rows[-1]
+            else:
+                rows = await page.order_by("id").limit(batch_size).values_list(*plan.columns)
+                if rows:
+                    yield b",".join(dumps(plan.serialize_row(row)) for row in rows)
+                    last_id = rows[-1][id_index]
+            if len(rows) < batch_size:
+                return
+
+    @staticmethod
+    async def push_changes(
+        family_id: str,
+        changes: Dict[str, Any],
+        last_pulled_at: Optional[int] = None,
+    ) -> PushResult:
+        """
+        Apply a push; returns the number of rows tombstoned per table
+        (cascades included) and the pushed records skipped as orphans.
+
+        With ``last_pulled_at`` (the ``timestamp`` of the client's last pull)
+        the push is rejected with PushConflict if any pushed record changed on
+        the server after it, as the WatermelonDB protocol expects.
+        """
+        touched = set()
+        for table_name, table_changes in changes.items():
+            if table_name in SYNC_MODELS and any(table_changes.get(k) for k in ("created", "updated", "deleted")):
+                touched.add(table_name)
+            if table_name in SYNC_MODELS and table_changes.get("deleted"):
+                touched.update(SyncService.descendant_tables(table_name))
+        # Весь push - одна транзакция: при ошибке клиент повторяет его целиком,
+        # а повтор уже применённых записей ничего не меняет
+        async with in_transaction():
+            await SyncService.lock_pushes(family_id)
+            version = None
+            if last_pulled_at is not None:
+                # Версия журнала берётся до проверки: блокировка счётчика не даёт
+                # другому push этой семьи записать что-то между проверкой и записью
+                version = await SyncChangelogService.next_version(str(family_id))
+                conflicts = await SyncService.find_conflicts(family_id, changes, last_pulled_at, version - 1)
+                if conflicts:
+                    raise PushConflict(conflicts)
+            result = await SyncService._apply_changes(family_id, changes, version)
+            # Версии меняются в той же транзакции: pull, увидевший новую версию, видит и записи
+            await SyncVersionService.bump(str(family_id), touched)
+            return result
+
+    @staticmethod
+    async def push_stream(
+        family_id: str,
+        batches: AsyncIterator[tuple],
+        last_pulled_at: Optional[int] = None,
+        pending: Optional[Dict[str, Set[str]]] = None,
+    ) -> PushResult:
+        """
+        Apply a push read incrementally (see sync_push_stream.iter_push).
+
+        Record batches are written as they arrive, so memory stays at one
+        batch however large the push is. Tables can arrive in any order:
+        foreign keys between synced tables are DEFERRABLE (migration 7) and
+        are checked at commit; `pending` holds the ids of parent tables
+        found in the body (sync_push_stream.record_ids), so a child that
+        arrives before its parent is not taken for an orphan. Deletions are
+        applied at the end, children first, as in push_changes. Conflicts
+        are collected over the whole body and reported together.
+
+        `batches` should read a spooled body: the transaction stays open
+        until they are exhausted.
+        """
+        scope = str(family_id)
+        # Какие таблицы придут, заранее не известно
+        touched = set(SYNC_MODELS)
+        async with in_transaction():
+            await SyncService.lock_pushes(family_id)
+            await connections.get("default").execute_query("SET CONSTRAINTS ALL DEFERRED")
+            version = await SyncChangelogService.next_version(scope)
+            conflicts: Dict[str, List[str]] = {}
+            deletes: Dict[str, List[Any]] = {}
+            orphans: Dict[str, List[str]] = {}
+            # Id, уже проверенные на конфликт до их первой записи: после неё find_conflicts
+            # видел бы изменения самого этого push (повтор id в пачках, update + delete)
+            checked: Dict[str, Set[str]] = {}
+
+            async for table_name, kind, items in batches:
+                model = SYNC_MODELS.get(table_name)
+                if model is None:
+                    continue
+                if kind == "deleted":
+                    deletes[table_name] = items
+                    continue
+                if last_pulled_at is not None:
+                    seen = checked.setdefault(table_name, set())
+                    unchecked = [record for record in items if str(record.get("id")) not in seen]
+                    seen.update(str(record.get("id")) for record in unchecked)
+                    found = await SyncService.find_conflicts(
+                        family_id, {table_name: {"created": unchecked}}, last_pulled_at, version - 1
+                    )
+                    for conflict_table, ids in found.items():
+                        conflicts.setdefault(conflict_table, []).extend(ids)
+                if conflicts:
+                    # Дочитываем тело только ради полного списка конфликтов
+                    continue
+                try:
+                    entries = await SyncService._apply_table(
+                        table_name, model, {"created": items}, family_id, orphans, pending
+                    )
+                except Exception as e:
+                    logging.error(f"Error syncing table {table_name}: {e}")
+                    raise e
+                await SyncChangelogService.record(scope, version, table_name, entries)
+
+            if last_pulled_at is not None and deletes:
+                unchecked = {
+                    t: {"deleted": [record_id for record_id in ids if str(record_id) not in checked.get(t, ())]}
+                    for t, ids in deletes.items()
+                }
+                found = await SyncService.find_conflicts(family_id, unchecked, last_pulled_at, version - 1)
+                for conflict_table, ids in found.items():
+                    conflicts.setdefault(conflict_table, []).extend(ids)
+            if conflicts:
+                raise PushConflict({t: sorted(set(ids)) for t, ids in conflicts.items()})
+
+            logged: Dict[str, List[tuple]] = {}
+            deleted_counts = await SyncService._apply_deletes(family_id, deletes, logged)
+            for table_name, entries in logged.items():
+                await SyncChangelogService.record(scope, version, table_name, entries)
+            # Проверка ссылок до COMMIT: нарушение приходит как IntegrityError, а не ошибкой коммита
+            try:
+                await connections.get("default").execute_query("SET CONSTRAINTS ALL IMMEDIATE")
+            except IntegrityError as e:
+                # Ребёнок пришёл раньше родителя, а родитель потом не записан (строка по
+                # умолчанию или сам сирота): такой push клиент должен исправить, а не повторять
+                table = getattr(e.args[0], "table_name", None) if e.args else None
+                raise PushValidationError(
+                    table or "changes", None, None, "record references a parent that was not written"
+                ) from e
+            await SyncVersionService.bump(scope, touched)
+            return deleted_counts, orphans
+
+    @staticmethod
+    async def find_conflicts(
+        family_id: str,
+        changes: Dict[str, Any],
+        last_pulled_at: int,
+        head: int,
+    ) -> Dict[str, List[str]]:
+        """
+        Pushed ids per table that changed on the server after ``last_pulled_at``.
+
+        One query per table. In changelog mode a cursor up to ``head`` is a
+        changelog version and the changelog is searched up to ``head``, so
+        entries of the running push are not taken for conflicts; otherwise,
+        as in pull, it is a millisecond timestamp compared with ``updated_at``.
+        """
+        by_version = settings.SYNC_PULL_SOURCE == "changelog" and last_pulled_at <= head
+        since = datetime.fromtimestamp(last_pulled_at / 1000, tz=timezone.utc)
+        db = connections.get("default")
+
+        conflicts: Dict[str, List[str]] = {}
         for table_name, table_changes in changes.items():
             model = SYNC_MODELS.get(table_name)
-            if not model: continue
-            
+            if model is None:
+                continue
+            record_ids = list({
+                str(record_id)
+                for record_id in (
+                    [record.get("id") for record in table_changes.get("created", []) + table_changes.get("updated", [])]
+                    + list(table_changes.get("deleted", []))
+                )
+                if record_id is not None
+            })
+            if not record_ids:
+                continue
+
+            if by_version:
+                rows = await db.execute_query_dict(
+                    'SELECT DISTINCT "record_id" AS "id" FROM "sync_changes" '
+                    'WHERE "scope" = $1 AND "table_name" = $2 AND "version" > $3 AND "version" <= $4 '
+                    'AND "record_id" = ANY($5::varchar[])',
+                    [str(family_id), table_name, last_pulled_at, head, record_ids],
+                )
+            elif "family" in model._meta.fields_map:
+                rows = await db.execute_query_dict(
+                    f'SELECT "id" FROM "{model._meta.db_table}" '
+                    f'WHERE "family_id" = $1 AND "id" = ANY($2::varchar[]) AND "updated_at" > $3',
+                    [str(family_id), record_ids, since],
+                )
+            else:
+                rows = await db.execute_query_dict(
+                    f'SELECT "id" FROM "{model._meta.db_table}" '
+                    f'WHERE "id" = ANY($1::varchar[]) AND "updated_at" > $2',
+                    [record_ids, since],
+                )
+            if rows:
+                conflicts[table_name] = sorted(row["id"] for row in rows)
+        return conflicts
+
+    @staticmethod
+    async def _apply_changes(family_id: str, changes: Dict[str, Any], version: Optional[int] = None) -> PushResult:
+        """
+        Apply a push inside the caller's transaction.
+
+        Upserts go parents before children; deletions run afterwards, children
+        first, so a record updated and deleted in the same push ends deleted.
+        ``version`` is the changelog version if the caller already allocated it.
+        """
+        order = SyncService.table_order()
+        logged: Dict[str, List[tuple]] = {}
+        orphans: Dict[str, List[str]] = {}
+        for table_name in order:
+            table_changes = changes.get(table_name)
+            if not table_changes: continue
+            model = SYNC_MODELS[table_name]
+
             try:
-                # Check for family_id field
-                has_family = "family" in model._meta.fields_map
-
-                for record_data in table_changes.get("created", []):
-                    # For lookups, only allow syncing non-default (custom) items
-                    if table_name in ["component_types", "chelator_types", "analysis_templates"] and record_data.get("is_default"):
-                        continue
-
-                    if has_family:
-                        record_data["family_id"] = family_id
-                    await SyncService._create_or_update_record(model, record_data, family_id if has_family else None)
-                for record_data in table_changes.get("updated", []):
-                    if table_name in ["component_types", "chelator_types", "analysis_templates"] and record_data.get("is_default"):
-                        continue
-
-                    if has_family:
-                        record_data["family_id"] = family_id
-                    await SyncService._create_or_update_record(model, record_data, family_id if has_family else None)
-                for record_id in table_changes.get("deleted", []):
-                    if has_family:
-                        await SyncService._soft_delete_record(model, record_id, family_id)
+                logged[table_name] = await SyncService._apply_table(
+                    table_name, model, table_changes, family_id, orphans
+                )
             except Exception as e:
                 logging.error(f"Error syncing table {table_name}: {e}")
                 raise e
 
+        deletes = {table_name: (changes.get(table_name) or {}).get("deleted") for table_name in order}
+        deleted_counts = await SyncService._apply_deletes(family_id, deletes, logged)
+
+        # Одна версия журнала на весь push; счётчик блокируется только до коммита
+        if any(logged.values()):
+            if version is None:
+                version = await SyncChangelogService.next_version(str(family_id))
+            for table_name, entries in logged.items():
+                await SyncChangelogService.record(str(family_id), version, table_name, entries)
+        return deleted_counts, orphans
+
     @staticmethod
-    async def _serialize_record(record: Any) -> Dict[str, Any]:
-        data = {}
-        for field_name, field_object in record._meta.fields_map.items():
-            value = getattr(record, field_name, None)
-            
-            # Skip relations themselves
-            if field_name in record._meta.fk_fields:
-                 # WatermelonDB expects _{field}_id suffix for relations
-                 fk_id = getattr(record, f"{field_name}_id", None)
-                 data[f"{field_name}_id"] = str(fk_id) if fk_id else None
-            elif 'ReverseRelation' in field_object.__class__.__name__ or 'BackwardFKRelation' in field_object.__class__.__name__:
-                continue
-            else:
-                if isinstance(value, datetime):
-                    data[field_name] = int(value.timestamp() * 1000)
-                elif hasattr(value, '_meta'): # It's a model instance
-                    continue 
-                else:
-                    data[field_name] = value
-        return data
-
-    @staticmethod
-    async def _create_or_update_record(model: Any, data: Dict[str, Any], family_id: Optional[str] = None) -> None:
-        record_id = data.get("id")
-        
-        # Determine valid fields, including _{field}_id for all foreign keys
-        valid_fields = set(model._meta.fields_map.keys())
-        for field_name in model._meta.fk_fields:
-            valid_fields.add(f"{field_name}_id")
-
-        # Map WatermelonDB keys to Tortoise fields if necessary (usually they already match)
-        # e.g. mapping camelCase if it was present, though here we use snake_case mostly.
-        
-        # Filter data to only include valid fields
-        data = {k: v for k, v in data.items() if k in valid_fields or k == 'id'}
-
-        # Обработка дат из timestamp
-        for field in ["created_at", "updated_at", "deleted_at"]: 
-            if field in data and isinstance(data[field], int):
-                data[field] = datetime.fromtimestamp(data[field] / 1000, tz=timezone.utc)
-        
-        if "updated_at" not in data:
-            data["updated_at"] = datetime.now(timezone.utc)
-
-        query = model.filter(id=record_id)
-        
-        # Check if record exists (either belonging to family OR global)
-        # Global records (family_id is NULL) should be found regardless of user's family_id
-        if family_id:
-             has_family = "family" in model._meta.fields_map
-             if has_family:
-                 query = query.filter(Q(family_id=family_id) | Q(family_id__isnull=True))
-
-        existing = await query.first()
-        if existing:
-            # If it's a global record (family_id is None), DO NOT update it from a user sync
-            # unless we specifically allow it (which we don't for defaults)
-            if hasattr(existing, 'family_id') and existing.family_id is None:
-                 return # Skip update for global record
-
-            update_data = {k: v for k, v in data.items() if k != 'id'}
-            await model.filter(id=record_id).update(**update_data)
-        else:
+    async def _apply_deletes(
+        family_id: str,
+        deletes: Dict[str, Optional[List[Any]]],
+        logged: Dict[str, List[tuple]],
+    ) -> Dict[str, int]:
+        """Tombstone pushed ids children first; appends changelog entries to `logged`"""
+        deleted_counts: Dict[str, int] = {}
+        now = datetime.now(timezone.utc)
+        for table_name in reversed(SyncService.table_order()):
+            record_ids = deletes.get(table_name)
+            model = SYNC_MODELS[table_name]
+            if not record_ids or "family" not in model._meta.fields_map: continue
+
             try:
-                await model.create(**data)
-            except IntegrityError:
-                # If we hit a duplicate key error, it means the record exists but we missed it 
-                # (e.g. global record that our filter didn't catch). 
-                # In this case, it's safe to ignore as we don't want to overwrite it anyway.
-                logging.warning(f"Skipping duplicate creation for {model.__name__} id={record_id}")
-                pass
+                deleted = await SyncService._soft_delete_records(table_name, record_ids, family_id, now)
+            except Exception as e:
+                logging.error(f"Error deleting from table {table_name}: {e}")
+                raise e
+            for deleted_table, deleted_ids in deleted.items():
+                logged.setdefault(deleted_table, []).extend((record_id, "delete") for record_id in deleted_ids)
+                deleted_counts[deleted_table] = deleted_counts.get(deleted_table, 0) + len(deleted_ids)
+        return deleted_counts
 
     @staticmethod
-    async def _soft_delete_record(model: Any, record_id: str, family_id: str) -> None:
-        try:
-            # Removed UUID casting since ID is now string
-            await model.filter(id=record_id, family_id=family_id).update(deleted_at=datetime.now(timezone.utc))
-        except: pass
+    async def _apply_table(
+        table_name: str,
+        model: Any,
+        table_changes: Dict[str, Any],
+        family_id: str,
+        orphans: Dict[str, List[str]],
+        pending: Optional[Dict[str, Set[str]]] = None,
+    ) -> List[tuple]:
+        """Upsert a table's created and updated records; orphans are skipped and added to `orphans`"""
+        # Check for family_id field
+        has_family = "family" in model._meta.fields_map
+
+        # updated_at записи - всегда время сервера
+        fixed = {"updated_at": datetime.now(timezone.utc)}
+        if has_family:
+            fixed["family_id"] = str(family_id)
+        records = table_changes.get("created", []) + table_changes.get("updated", [])
+        rows = get_decoder(model).decode_many(records, **fixed)
+
+        # For lookups, only allow syncing non-default (custom) items
+        if table_name in ["component_types", "chelator_types", "analysis_templates"]:
+            rows = [row for row in rows if not row.get("is_default")]
+
+        rows = await SyncService._skip_orphans(table_name, model, rows, orphans, pending)
+        if pending and table_name in pending:
+            # Не записанный родитель больше не ждёт своих детей: следующие из них - сироты
+            written = {str(row["id"]) for row in rows}
+            pending[table_name] -= {str(record.get("id")) for record in records} - written
+        return await SyncService._upsert_records(model, rows, has_family)
+
+    @staticmethod
+    async def _skip_orphans(
+        table_name: str,
+        model: Any,
+        rows: List[Dict[str, Any]],
+        orphans: Dict[str, List[str]],
+        pending: Optional[Dict[str, Set[str]]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Drop rows referencing a synced parent that does not exist.
+
+        Such a record (a child of a parent deleted on another device and
+        purged since, say) would fail the whole push on its foreign key, on
+        every retry. It is skipped instead, as the per-record push did, and
+        reported to the client in `orphans`. Parents written earlier in the
+        same transaction exist already; `pending` holds ids per table that
+        are still to be written by this push.
+        """
+        parents = {parent: name for name, parent in SYNC_MODELS.items()}
+        db = connections.get("default")
+        skipped: Set[str] = set()
+        for fk_name in model._meta.fk_fields:
+            field = model._meta.fields_map[fk_name]
+            parent_table = parents.get(field.related_model)
+            if parent_table is None:
+                continue
+            column = field.source_field or f"{fk_name}_id"
+            wanted = list({str(row[column]) for row in rows if row.get(column) is not None})
+            missing: Set[str] = set()
+            if wanted:
+                found = await db.execute_query_dict(
+                    f'SELECT "id" FROM "{field.related_model._meta.db_table}" WHERE "id" = ANY($1::varchar[])',
+                    [wanted],
+                )
+                missing = set(wanted) - {row["id"] for row in found} - (pending or {}).get(parent_table, set())
+            for row in rows:
+                if column not in row:
+                    continue  # обновление без ссылки её не меняет
+                value = row[column]
+                if (value is None and not field.null) or (value is not None and str(value) in missing):
+                    skipped.add(str(row["id"]))
+
+        if not skipped:
+            return rows
+        logging.warning(f"Таблица {table_name}: пропущено записей без родителя: {len(skipped)}")
+        orphans.setdefault(table_name, []).extend(sorted(skipped))
+        return [row for row in rows if str(row["id"]) not in skipped]
+
+    @staticmethod
+    async def _soft_delete_records(
+        table_name: str,
+        record_ids: List[Any],
+        family_id: str,
+        now: datetime,
+        column: str = "id",
+    ) -> Dict[str, List[str]]:
+        """
+        Tombstone the family's rows whose `column` is in `record_ids`, then
+        their children in SYNC_MODELS, with one UPDATE per table.
+
+        Rows that are already deleted are left alone. updated_at moves with
+        deleted_at so incremental pulls see the deletion.
+        Returns the ids tombstoned per table.
+        """
+        model = SYNC_MODELS[table_name]
+        rows = await connections.get("default").execute_query_dict(
+            f'UPDATE "{model._meta.db_table}" SET "deleted_at" = $3, "updated_at" = $3 '
+            f'WHERE "family_id" = $1 AND "{column}" = ANY($2::varchar[]) AND "deleted_at" IS NULL '
+            f'RETURNING "id"',
+            [str(family_id), [str(record_id) for record_id in record_ids], now],
+        )
+        deleted = {table_name: [row["id"] for row in rows]}
+
+        # Каскад по требуемым id, а не только по только что удалённым: так
+        # повтор push дочищает детей, оставшихся от старых удалений
+        parent_ids = record_ids if column == "id" else deleted[table_name]
+        for child_name, _, fk_column in SyncService.child_tables(model):
+            if not parent_ids:
+                break
+            for deleted_table, deleted_ids in (
+                await SyncService._soft_delete_records(child_name, parent_ids, family_id, now, fk_column)
+            ).items():
+                deleted.setdefault(deleted_table, []).extend(deleted_ids)
+        return deleted
+
+    @staticmethod
+    async def _upsert_records(model: Any, rows: List[Dict[str, Any]], has_family: bool) -> List[tuple]:
+        """
+        Write decoded rows (see DecoderPlan) with multi-row INSERT ... ON CONFLICT (id) DO UPDATE.
+
+        Rows are grouped by their set of columns so every statement has a
+        fixed column list; each group goes out in chunks of SYNC_PUSH_BATCH_SIZE
+        rows. The conflict branch only fires for rows of the pushing family, so
+        global rows (family_id NULL) and other families' rows are never
+        overwritten, same as the per-record path; rows whose values did not
+        change are skipped too.
+
+        Returns (record_id, "create" | "update") for the changelog.
+        """
+        if not rows:
+            return []
+
+        table = model._meta.db_table
+
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        logged = []
+        for columns, group in groups.items():
+            column_list = ", ".join(f'"{column}"' for column in columns)
+            updates = ", ".join(f'"{column}" = EXCLUDED."{column}"' for column in columns if column != "id")
+            conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+            conditions = []
+            if has_family:
+                conditions.append('t."family_id" = EXCLUDED."family_id"')
+            # Unchanged rows are left alone (no updated_at bump, no changelog entry),
+            # so re-sending an already applied push is a no-op
+            compared = [column for column in columns if column not in ("id", "updated_at")]
+            if updates and compared:
+                conditions.append(
+                    "(" + ", ".join(f't."{column}"' for column in compared) + ") IS DISTINCT FROM ("
+                    + ", ".join(f'EXCLUDED."{column}"' for column in compared) + ")"
+                )
+            if conditions:
+                conflict += " WHERE " + " AND ".join(conditions)
+            # asyncpg: не больше 32767 параметров в запросе
+            chunk_size = max(1, min(settings.SYNC_PUSH_BATCH_SIZE, 32767 // len(columns)))
+
+            for start in range(0, len(group), chunk_size):
+                chunk = group[start:start + chunk_size]
+                values, params = [], []
+                for row in chunk:
+                    base = len(params)
+                    values.append("(" + ", ".join(f"${base + i + 1}" for i in range(len(columns))) + ")")
+                    params.extend(row[column] for column in columns)
+                written = await connections.get("default").execute_query_dict(
+                    f'INSERT INTO "{table}" AS t ({column_list}) VALUES {", ".join(values)} '
+                    f'ON CONFLICT ("id") {conflict} '
+                    f'RETURNING t."id", (t.xmax = 0) AS "inserted"',
+                    params,
+                )
+                for result in written:
+                    logged.append((result["id"], "create" if result["inserted"] else "update"))
+        return logged
@@ -0,0 +1,112 @@
+"""
+Append-only sync changelog: per-family ordered log of pushed writes
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tortoise import connections
+
+# Counter row in sync_versions that hands out changelog versions of a scope
+CHANGELOG_COUNTER = "__changelog__"
+
+# (table_name, record_id, op, version)
+ChangeEntry = Tuple[str, str, str, int]
+
+
+class SyncChangelogService:
+    @staticmethod
+    async def next_version(scope: str) -> int:
+        """
+        Allocate the next changelog version of `scope`.
+
+        Must be called inside the transaction that writes the records: the
+        counter row stays locked until commit, which serializes writers of one
+        family and makes their versions visible strictly in order.
+        """
+        rows = await connections.get("default").execute_query_dict(
+            'INSERT INTO "sync_versions" ("scope", "table_name", "version", "changed_at") '
+            'VALUES ($1, $2, 1, $3) '
+            'ON CONFLICT ("scope", "table_name") DO UPDATE SET '
+            '"version" = "sync_versions"."version" + 1, "changed_at" = EXCLUDED."changed_at" '
+            'RETURNING "version"',
+            [scope, CHANGELOG_COUNTER, datetime.now(timezone.utc)],
+        )
+        return rows[0]["version"]
+
+    @staticmethod
+    async def head(scope: str) -> int:
+        """Highest committed changelog version of `scope`, 0 before the first push"""
+        rows = await connections.get("default").execute_query_dict(
+            'SELECT "version" FROM "sync_versions" WHERE "scope" = $1 AND "table_name" = $2',
+            [scope, CHANGELOG_COUNTER],
+        )
+        return rows[0]["version"] if rows else 0
+
+    @staticmethod
+    async def record(scope: str, version: int, table_name: str, entries: Iterable[Tuple[str, str]]) -> None:
+        """Append (record_id, op) entries in one statement"""
+        entries = list(entries)
+        if not entries:
+            return
+        await connections.get("default").execute_query(
+            'INSERT INTO "sync_changes" ("scope", "version", "table_name", "record_id", "op", "changed_at") '
+            'SELECT $1, $2, $3, e.record_id, e.op, now() '
+            'FROM unnest($4::varchar[], $5::varchar[]) AS e(record_id, op)',
+            [scope, version, table_name, [str(record_id) for record_id, _ in entries], [op for _, op in entries]],
+        )
+
+    @staticmethod
+    async def read(scope: str, after: int) -> List[ChangeEntry]:
+        rows = await connections.get("default").execute_query_dict(
+            'SELECT "table_name", "record_id", "op", "version" FROM "sync_changes" '
+            'WHERE "scope" = $1 AND "version" > $2 ORDER BY "id"',
+            [scope, after],
+        )
+        return [(row["table_name"], row["record_id"], row["op"], row["version"]) for row in rows]
+
+    @staticmethod
+    async def changed_at(scope: str, version: int) -> Optional[datetime]:
+        """Time of the newest entry at or before `version` (a lower bound for the client's pull time)"""
+        rows = await connections.get("default").execute_query_dict(
+            'SELECT "changed_at" FROM "sync_changes" WHERE "scope" = $1 AND "version" <= $2 '
+            'ORDER BY "version" DESC LIMIT 1',
+            [scope, version],
+        )
+        return rows[0]["changed_at"] if rows else None
+
+    @staticmethod
+    def collapse(entries: List[ChangeEntry]) -> Dict[str, Dict[str, Tuple[str, bool]]]:
+        """table -> record_id -> (last op, created within the range)"""
+        tables: Dict[str, Dict[str, Tuple[str, bool]]] = {}
+        for table_name, record_id, op, _ in entries:
+            records = tables.setdefault(table_name, {})
+            _, created = records.get(record_id, (None, False))
+            records[record_id] = (op, created or op == "create")
+        return tables
+
+    @staticmethod
+    async def compact(batch_size: int = 5000) -> int:
+        """
+        Drop up to `batch_size` entries superseded by a newer entry for the same record.
+
+        The surviving entry inherits "create" so clients whose cursor predates
+        the creation still receive the record as created.
+        """
+        rows = await connections.get("default").execute_query_dict(
+            'WITH doomed AS ('
+            '  SELECT c."id", c."scope", c."table_name", c."record_id", c."op" FROM "sync_changes" c'
+            '  WHERE EXISTS (SELECT 1 FROM "sync_changes" n WHERE n."scope" = c."scope"'
+            '    AND n."table_name" = c."table_name" AND n."record_id" = c."record_id" AND n."id" > c."id")'
+            '  ORDER BY c."id" LIMIT $1'
+            '), promoted AS ('
+            '  UPDATE "sync_changes" s SET "op" = \'create\' WHERE s."op" = \'update\''
+            '  AND NOT EXISTS (SELECT 1 FROM "sync_changes" n WHERE n."scope" = s."scope"'
+            '    AND n."table_name" = s."table_name" AND n."record_id" = s."record_id" AND n."id" > s."id")'
+            '  AND EXISTS (SELECT 1 FROM doomed d WHERE d."op" = \'create\' AND d."scope" = s."scope"'
+            '    AND d."table_name" = s."table_name" AND d."record_id" = s."record_id")'
+            '), removed AS ('
+            '  DELETE FROM "sync_changes" WHERE "id" IN (SELECT "id" FROM doomed) RETURNING "id"'
+            ') SELECT count(*) AS "removed" FROM removed',
+            [batch_size],
+        )
+        return rows[0]["removed"]
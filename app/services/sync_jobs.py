@@ -0,0 +1,187 @@
+"""
+Asynchronous push queue: sync_jobs table worked off by in-process workers
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from tortoise import connections
+
+from app.core.config import settings
+from app.models.sync_job import SyncJob
+from app.services.sync import PushConflict, SyncService
+from app.services.sync_plans import PushValidationError
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+
+
+class SyncJobService:
+    @staticmethod
+    async def submit(family_id: str, body: bytes, last_pulled_at: Optional[int], records: int) -> SyncJob:
+        """Store a validated push body; a worker of this or another process applies it"""
+        job = await SyncJob.create(
+            family_id=family_id,
+            payload=body.decode("utf-8"),
+            last_pulled_at=last_pulled_at,
+            records=records,
+        )
+        if _wakeup is not None:
+            _wakeup.set()
+        return job
+
+    @staticmethod
+    async def claim() -> Optional[SyncJob]:
+        """
+        Take the oldest queued job, or a running one whose heartbeat stopped.
+
+        SKIP LOCKED lets workers of every process claim concurrently without
+        handing the same job out twice. A running job is only taken over
+        when its worker has not renewed the heartbeat for SYNC_JOB_TIMEOUT,
+        i.e. it died or hung; a worker that is merely slow keeps its job.
+        Delivery is still at-least-once: a worker stalled past the timeout
+        (event loop blocked, database unreachable) may find its push
+        applied a second time. Its own result is then discarded, and a
+        repeated push changes nothing unless it carries last_pulled_at, in
+        which case the second run can end as a conflict.
+        """
+        rows = await connections.get("default").execute_query_dict(
+            'UPDATE "sync_jobs" SET "status" = $1, "started_at" = now(), "heartbeat_at" = now(), '
+            '"attempts" = "attempts" + 1 '
+            'WHERE "id" = (SELECT "id" FROM "sync_jobs" '
+            '  WHERE "status" = $2 OR ("status" = $1 '
+            '    AND COALESCE("heartbeat_at", "started_at") < now() - make_interval(secs => $3)) '
+            '  ORDER BY "created_at" LIMIT 1 FOR UPDATE SKIP LOCKED) '
+            'RETURNING "id"',
+            [JOB_RUNNING, JOB_QUEUED, settings.SYNC_JOB_TIMEOUT],
+        )
+        if not rows:
+            return None
+        return await SyncJob.get(id=rows[0]["id"])
+
+    @staticmethod
+    def _owned(job: SyncJob):
+        """The job row while `job` is still this worker's attempt"""
+        return SyncJob.filter(id=job.id, status=JOB_RUNNING, attempts=job.attempts)
+
+    @staticmethod
+    async def _heartbeat(job: SyncJob) -> None:
+        """Renew the job's heartbeat while it runs (cancelled when the run ends)"""
+        interval = max(1, settings.SYNC_JOB_TIMEOUT // 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await connections.get("default").execute_query(
+                    'UPDATE "sync_jobs" SET "heartbeat_at" = now() '
+                    'WHERE "id" = $1 AND "status" = $2 AND "attempts" = $3',
+                    [job.id, JOB_RUNNING, job.attempts],
+                )
+            except Exception as e:
+                logging.error(f"Ошибка heartbeat фоновой синхронизации {job.id}: {e}")
+
+    @staticmethod
+    async def _finish(job: SyncJob, status: str, result: Any = None, error: Any = None) -> None:
+        # Тело push больше не нужно - не храним его до очистки задачи.
+        # Задачу, которую уже перезапустил другой обработчик, не трогаем
+        await SyncJobService._owned(job).update(
+            status=status, result=result, error=error, payload=None, finished_at=datetime.now(timezone.utc)
+        )
+
+    @staticmethod
+    async def run(job: SyncJob) -> None:
+        try:
+            changes = json.loads(job.payload).get("changes", {})
+            deleted, orphans = await SyncService.push_changes(job.family_id, changes, job.last_pulled_at)
+        except PushConflict as e:
+            await SyncJobService._finish(job, JOB_FAILED, error={"code": "conflict", "conflicts": e.conflicts})
+        except PushValidationError as e:
+            await SyncJobService._finish(job, JOB_FAILED, error={
+                "code": "invalid", "table": e.table, "id": e.record_id, "field": e.key, "message": e.message,
+            })
+        except asyncio.CancelledError:
+            # Остановка сервера: транзакция откатилась, задачу подберёт следующий запуск
+            await SyncJobService._owned(job).update(status=JOB_QUEUED)
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка фоновой синхронизации {job.id}: {e}")
+            if job.attempts >= settings.SYNC_JOB_MAX_ATTEMPTS:
+                await SyncJobService._finish(job, JOB_FAILED, error={"code": "error", "message": str(e)})
+            else:
+                await SyncJobService._owned(job).update(status=JOB_QUEUED)
+        else:
+            await SyncJobService._finish(job, JOB_DONE, result={"status": "ok", "deleted": deleted, "orphans": orphans})
+
+    @staticmethod
+    def describe(job: SyncJob) -> Dict[str, Any]:
+        return {
+            "id": job.id,
+            "status": job.status,
+            "records": job.records,
+            "attempts": job.attempts,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+            "result": job.result,
+            "error": job.error,
+        }
+
+    @staticmethod
+    async def purge(before: datetime) -> int:
+        """Delete finished jobs older than `before`"""
+        return await SyncJob.filter(status__in=[JOB_DONE, JOB_FAILED], finished_at__lt=before).delete()
+
+    @staticmethod
+    async def _worker() -> None:
+        while True:
+            _wakeup.clear()
+            try:
+                job = await SyncJobService.claim()
+            except Exception as e:
+                logging.error(f"Ошибка очереди синхронизации: {e}")
+                job = None
+            if job is None:
+                # Задачи из других процессов и зависшие задачи подбираются опросом
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=settings.SYNC_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heartbeat = asyncio.create_task(SyncJobService._heartbeat(job))
+            try:
+                await SyncJobService.run(job)
+            except Exception as e:
+                # Не удалось даже записать статус - задачу подберут, когда истечёт heartbeat
+                logging.error(f"Ошибка фоновой синхронизации {job.id}: {e}")
+            finally:
+                heartbeat.cancel()
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.SYNC_JOB_WORKERS > 0
+
+    @staticmethod
+    def start() -> None:
+        global _wakeup
+        if not SyncJobService.enabled() or _workers:
+            return
+        _wakeup = asyncio.Event()
+        for _ in range(settings.SYNC_JOB_WORKERS):
+            _workers.append(asyncio.create_task(SyncJobService._worker()))
+
+    @staticmethod
+    async def stop() -> None:
+        for task in _workers:
+            task.cancel()
+        for task in _workers:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        _workers.clear()
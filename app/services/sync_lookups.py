@@ -0,0 +1,105 @@
+"""
+Cache of the global lookup rows (default component/chelator types and templates)
+"""
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.cache import get_cache
+from app.core.config import settings
+from app.models.sync_version import GLOBAL_SCOPE
+from app.services.sync_plans import get_plan
+from app.services.sync_versions import GLOBAL_TABLES, SyncVersionService, Versions
+
+LOOKUP_CACHE = "sync_lookups"
+
+# (id, created_at, updated_at, deleted_at, serialized row or None for tombstones)
+LookupRow = Tuple[str, datetime, datetime, Optional[datetime], Optional[Dict[str, Any]]]
+
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+class SyncLookupService:
+    @staticmethod
+    def enabled(table_name: str) -> bool:
+        return table_name in GLOBAL_TABLES and settings.SYNC_LOOKUP_CACHE_TTL > 0
+
+    @staticmethod
+    def _cache():
+        return get_cache(LOOKUP_CACHE, maxsize=len(GLOBAL_TABLES), ttl=settings.SYNC_LOOKUP_CACHE_TTL)
+
+    @staticmethod
+    def global_query(table_name: str, model: Any) -> Any:
+        if table_name == "analysis_template_items":
+            return model.filter(family_id=None)
+        return model.filter(is_default=True)
+
+    @staticmethod
+    async def get_rows(table_name: str, model: Any, versions: Versions) -> List[LookupRow]:
+        """
+        Global rows of `table_name`, serialized once per global version.
+
+        An entry is reused while the table's global version is unchanged and the
+        TTL has not expired; the TTL only matters when defaults are edited
+        without bumping the version.
+        """
+        version = versions.get((GLOBAL_SCOPE, table_name), (0, None))[0]
+        cache = SyncLookupService._cache()
+        cached = cache.get(table_name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        # Один запрос на таблицу, остальные pull ждут его результата
+        lock = _locks.setdefault(table_name, asyncio.Lock())
+        async with lock:
+            cached = cache.get(table_name)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+            plan = get_plan(model)
+            id_index, created_index, deleted_index = plan.id_index, plan.created_index, plan.deleted_index
+            updated_index = plan.columns.index("updated_at")
+            rows = await SyncLookupService.global_query(table_name, model).order_by("id").values_list(*plan.columns)
+            entries = [
+                (
+                    str(row[id_index]),
+                    row[created_index],
+                    row[updated_index],
+                    row[deleted_index],
+                    plan.serialize_row(row) if row[deleted_index] is None else None,
+                )
+                for row in rows
+            ]
+            cache.set(table_name, (version, entries))
+            return entries
+
+    @staticmethod
+    def split(entries: List[LookupRow], last_pulled_at: Optional[datetime]) -> Dict[str, List[Any]]:
+        """Bucket cached rows the way _pull_table buckets query results"""
+        created, updated, deleted = [], [], []
+        for record_id, created_at, updated_at, deleted_at, payload in entries:
+            if last_pulled_at is not None and updated_at <= last_pulled_at:
+                continue
+            if deleted_at is not None:
+                deleted.append(record_id)
+            elif last_pulled_at is None or created_at > last_pulled_at:
+                created.append(payload)
+            else:
+                updated.append(payload)
+        return {"created": created, "updated": updated, "deleted": deleted}
+
+    @staticmethod
+    def invalidate(tables: Optional[Iterable[str]] = None) -> None:
+        cache = SyncLookupService._cache()
+        if tables is None:
+            cache.clear()
+            return
+        for table_name in tables:
+            cache.pop(table_name)
+
+    @staticmethod
+    async def defaults_changed(tables: Iterable[str]) -> None:
+        """Call after editing default rows: other processes notice the version bump"""
+        tables = list(tables)
+        await SyncVersionService.bump(GLOBAL_SCOPE, tables)
+        SyncLookupService.invalidate(tables)
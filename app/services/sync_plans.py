@@ -0,0 +1,241 @@
+"""
+Precompiled per-model serialization plans for sync pull.
+
+Walking ``_meta.fields_map`` for every row is expensive, so the field
+layout of each synced model is resolved once into a flat list of
+``(key, attribute, converter)`` steps and rows are serialized by a plain
+loop over that list. The same steps double as the column list for
+``values_list()`` so pull can skip model instantiation entirely.
+
+Datetimes are left as-is: the response encoder (app.core.responses)
+renders them as millisecond timestamps.
+
+Push goes the other way with a DecoderPlan: pushed keys are mapped to
+``(column, converter)`` once per model, so a table array is validated and
+converted by dict lookups instead of re-reading field metadata per record.
+"""
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+from tortoise.exceptions import ValidationError
+from tortoise.fields import CharField, DatetimeField, Field
+from tortoise.models import Model
+
+
+Converter = Optional[Callable[[Any], Any]]
+
+
+def _fk_id(value: Any) -> Optional[str]:
+    return str(value) if value else None
+
+
+class SerializerPlan:
+    """
+    Flat serialization plan for one model.
+
+    ``steps`` is ordered the same way the old reflective serializer emitted
+    keys, so the encoded JSON is identical.
+    ``columns`` lists the attributes in step order for ``values_list()``;
+    the ``*_index`` attributes point into such a row.
+    """
+
+    __slots__ = ("model", "steps", "columns", "_row_steps", "id_index", "created_index", "deleted_index")
+
+    def __init__(self, model: Type[Model], steps: Tuple[Tuple[str, str, Converter], ...]):
+        self.model = model
+        self.steps = steps
+        self.columns = tuple(attr for _, attr, _ in steps)
+        self._row_steps = tuple((key, convert) for key, _, convert in steps)
+        self.id_index = self.columns.index("id")
+        self.created_index = self.columns.index("created_at")
+        self.deleted_index = self.columns.index("deleted_at")
+
+    def serialize(self, record: Model) -> Dict[str, Any]:
+        data = {}
+        for key, attr, convert in self.steps:
+            value = getattr(record, attr, None)
+            data[key] = convert(value) if convert is not None else value
+        return data
+
+    def serialize_row(self, row: Sequence[Any]) -> Dict[str, Any]:
+        """Serialize a tuple fetched with ``values_list(*plan.columns)``"""
+        data = {}
+        for (key, convert), value in zip(self._row_steps, row):
+            data[key] = convert(value) if convert is not None else value
+        return data
+
+
+def compile_plan(model: Type[Model]) -> SerializerPlan:
+    """Resolve the model's fields into a SerializerPlan"""
+    meta = model._meta
+    skipped = meta.backward_fk_fields | meta.backward_o2o_fields | meta.m2m_fields | meta.o2o_fields
+
+    # dict keeps the position of the first writer and the converter of the last one,
+    # which is how the old serializer behaved when `family` and `family_id` both appear
+    steps: Dict[str, Tuple[str, Converter]] = {}
+    for field_name in meta.fields_map:
+        if field_name in meta.fk_fields:
+            # WatermelonDB expects {field}_id for relations
+            steps[f"{field_name}_id"] = (f"{field_name}_id", _fk_id)
+        elif field_name in skipped:
+            continue
+        else:
+            steps[field_name] = (field_name, None)
+
+    return SerializerPlan(model, tuple((key, attr, convert) for key, (attr, convert) in steps.items()))
+
+
+class PushValidationError(ValueError):
+    """A pushed record has a value its column cannot take"""
+
+    def __init__(self, table: str, record_id: Any, key: Optional[str], message: str):
+        super().__init__(f"{table}/{record_id}: {key}: {message}" if key else f"{table}: {message}")
+        self.table = table
+        self.record_id = record_id
+        self.key = key
+        self.message = message
+
+
+def _datetime_converter(field: DatetimeField) -> Callable[[Any], Any]:
+    def convert(value: Any) -> Any:
+        if value is None or isinstance(value, datetime):
+            return value
+        # WatermelonDB шлёт даты как timestamp в мс
+        if type(value) is int or type(value) is float:
+            return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+        if isinstance(value, str):
+            return field.to_python_value(value)
+        raise ValueError(f"expected a timestamp in ms, got {type(value).__name__}")
+    return convert
+
+
+def _value_converter(field: Field) -> Callable[[Any], Any]:
+    """field.to_db_value with a shortcut for values that already have the column's type"""
+    to_db_value = field.to_db_value
+    field_type = field.field_type
+
+    if isinstance(field, CharField) and len(field.validators) == 1:
+        max_length = field.max_length
+
+        def convert(value: Any) -> Any:
+            if type(value) is str and len(value) <= max_length:
+                return value
+            return to_db_value(value, None) if value is not None else None
+    elif not field.validators:
+        def convert(value: Any) -> Any:
+            if value is None or type(value) is field_type:
+                return value
+            return to_db_value(value, None)
+    else:
+        def convert(value: Any) -> Any:
+            return to_db_value(value, None) if value is not None else None
+    return convert
+
+
+class DecoderPlan:
+    """
+    Compiled push decoder for one model.
+
+    ``steps`` maps every accepted key to its column and converter; anything
+    else (WatermelonDB's ``_status`` / ``_changed``, relation objects,
+    unknown keys) is dropped. Records of one table almost always carry the
+    same keys, so the steps for each key order seen are cached as a flat
+    tuple and a record is decoded by a single comprehension.
+    """
+
+    __slots__ = ("model", "table", "steps", "pk_default", "_shapes")
+
+    # Сколько разных наборов ключей помнить: клиент может прислать что угодно
+    MAX_SHAPES = 64
+
+    def __init__(self, model: Type[Model], steps: Dict[str, Tuple[str, Callable[[Any], Any]]]):
+        self.model = model
+        self.table = model._meta.db_table
+        self.steps = steps
+        self.pk_default = model._meta.fields_map["id"].default
+        self._shapes: Dict[tuple, Tuple[Tuple[str, str, Callable[[Any], Any]], ...]] = {}
+
+    def _shape(self, keys: tuple) -> Tuple[Tuple[str, str, Callable[[Any], Any]], ...]:
+        shape = self._shapes.get(keys)
+        if shape is None:
+            shape = tuple((key, *self.steps[key]) for key in keys if key in self.steps)
+            if len(self._shapes) < self.MAX_SHAPES:
+                self._shapes[keys] = shape
+        return shape
+
+    def decode(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Pushed record -> {column: db value}"""
+        if type(data) is not dict:
+            raise PushValidationError(self.table, None, None, "record must be an object")
+        try:
+            row = {column: convert(data[key]) for key, column, convert in self._shape(tuple(data))}
+        except (ValueError, TypeError, ValidationError):
+            # Медленный проход только ради того, чтобы назвать поле с ошибкой
+            for key, value in data.items():
+                step = self.steps.get(key)
+                if step is None:
+                    continue
+                try:
+                    step[1](value)
+                except (ValueError, TypeError, ValidationError) as e:
+                    raise PushValidationError(self.table, data.get("id"), key, str(e)) from e
+            raise
+        if row.get("id") is None:
+            row["id"] = self.pk_default() if callable(self.pk_default) else self.pk_default
+        return row
+
+    def decode_many(self, records: Iterable[Dict[str, Any]], **fixed: Any) -> List[Dict[str, Any]]:
+        """
+        Decode a whole table array, overriding `fixed` columns on every row.
+
+        Repeated ids are merged with later values winning, the same as
+        writing `created` and then `updated` record by record.
+        """
+        rows: Dict[str, Dict[str, Any]] = {}
+        for data in records:
+            row = self.decode(data)
+            row.update(fixed)
+            record_id = str(row["id"])
+            previous = rows.get(record_id)
+            rows[record_id] = {**previous, **row} if previous is not None else row
+        return list(rows.values())
+
+
+def compile_decoder(model: Type[Model]) -> DecoderPlan:
+    """Resolve the model's writable columns into a DecoderPlan"""
+    meta = model._meta
+    steps = {}
+    for key, column in meta.fields_db_projection.items():
+        field = meta.fields_map[key]
+        if isinstance(field, DatetimeField):
+            steps[key] = (column, _datetime_converter(field))
+        else:
+            steps[key] = (column, _value_converter(field))
+    return DecoderPlan(model, steps)
+
+
+_plans: Dict[Type[Model], SerializerPlan] = {}
+_decoders: Dict[Type[Model], DecoderPlan] = {}
+
+
+def get_plan(model: Type[Model]) -> SerializerPlan:
+    """Return the compiled plan for a model, compiling it on first use"""
+    plan = _plans.get(model)
+    if plan is None:
+        plan = _plans[model] = compile_plan(model)
+    return plan
+
+
+def get_decoder(model: Type[Model]) -> DecoderPlan:
+    """Return the compiled push decoder for a model, compiling it on first use"""
+    decoder = _decoders.get(model)
+    if decoder is None:
+        decoder = _decoders[model] = compile_decoder(model)
+    return decoder
+
+
+def compile_plans(models: Iterable[Type[Model]]) -> None:
+    """Compile plans and decoders up front (called on startup, after Tortoise is initialised)"""
+    for model in models:
+        _plans[model] = compile_plan(model)
+        _decoders[model] = compile_decoder(model)
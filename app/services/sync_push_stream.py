@@ -0,0 +1,191 @@
+"""
+Incremental reading of push bodies: size limit, spooling and table-by-table record batches
+"""
+import hashlib
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Iterable, List, Set, Tuple
+
+import aiofiles.tempfile
+
+try:
+    import ijson
+except ImportError:  # ijson is an optional dependency (pip install .[fast]); without it pushes are read whole
+    ijson = None
+
+from app.services.sync_plans import PushValidationError
+
+# Ошибки разбора тела (400)
+JSON_ERRORS = (ijson.JSONError,) if ijson is not None else ()
+
+# (table_name, "records" | "deleted", items)
+PushBatch = Tuple[str, str, List]
+
+RECORD_KINDS = ("created", "updated")
+SCALARS = ("null", "boolean", "integer", "double", "number", "string")
+
+
+class BodyTooLarge(Exception):
+    """The request body exceeds SYNC_PUSH_MAX_BODY"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Request body exceeds {limit} bytes")
+        self.limit = limit
+
+
+class LimitedReader:
+    """
+    Async file-like view of the request stream for ijson, failing once more
+    than `limit` bytes arrive.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes], limit: int):
+        self.chunks = chunks.__aiter__()
+        self.limit = limit
+        self.size = 0
+        self.pending = b""
+        self.offset = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        # read(0) ijson делает, чтобы узнать тип потока - данные не трогаем
+        if size == 0:
+            return b""
+        while self.offset >= len(self.pending):
+            try:
+                chunk = await self.chunks.__anext__()
+            except StopAsyncIteration:
+                return b""
+            self.size += len(chunk)
+            if self.size > self.limit:
+                raise BodyTooLarge(self.limit)
+            self.pending, self.offset = chunk, 0
+        # Не больше, чем просили: ijson разбирает каждый кусок целиком, и большой
+        # кусок (тело одним сообщением) превратился бы во все его события сразу
+        start = self.offset
+        self.offset = len(self.pending) if size < 0 else min(len(self.pending), start + size)
+        if start == 0 and self.offset == len(self.pending):
+            return self.pending
+        return self.pending[start:self.offset]
+
+
+async def read_body(chunks: AsyncIterator[bytes], limit: int) -> bytes:
+    """Whole body, failing as soon as it grows past `limit`"""
+    reader = LimitedReader(chunks, limit)
+    parts = []
+    while True:
+        chunk = await reader.read()
+        if not chunk:
+            return b"".join(parts)
+        parts.append(chunk)
+
+
+async def spool(chunks: AsyncIterator[bytes], limit: int, max_memory: int) -> Tuple[Any, str]:
+    """
+    Copy the body into a temporary file while hashing it.
+
+    The file stays in memory up to `max_memory` bytes and goes to disk
+    after that; the size limit applies as in read_body. Returns the async
+    file, positioned at the start (the caller closes it), and the sha256
+    hex digest of the body, the same hash IdempotencyService.request_key
+    computes for a buffered body.
+    """
+    reader = LimitedReader(chunks, limit)
+    digest = hashlib.sha256()
+    spooled = await aiofiles.tempfile.SpooledTemporaryFile(max_size=max_memory)
+    try:
+        while True:
+            chunk = await reader.read()
+            if not chunk:
+                break
+            digest.update(chunk)
+            await spooled.write(chunk)
+        await spooled.seek(0)
+    except BaseException:
+        await spooled.close()
+        raise
+    return spooled, digest.hexdigest()
+
+
+def available() -> bool:
+    return ijson is not None
+
+
+async def record_ids(reader: Any, tables: Iterable[str]) -> Dict[str, Set[str]]:
+    """
+    Ids of the created and updated records of `tables`, in one pass over
+    the parse events without building the records.
+    """
+    targets = {f"changes.{table}.{kind}.item.id": table for table in tables for kind in RECORD_KINDS}
+    found: Dict[str, Set[str]] = defaultdict(set)
+    async for prefix, event, value in ijson.parse_async(reader, use_float=True):
+        table = targets.get(prefix)
+        if table is not None and event in ("string", "integer", "number"):
+            found[table].add(str(value))
+    return found
+
+
+async def iter_push(reader: Any, batch_size: int) -> AsyncIterator[PushBatch]:
+    """
+    Parse ``{"changes": {table: {created, updated, deleted}}}`` incrementally
+    from `reader` (anything with an async ``read``).
+
+    Created and updated records come out in batches of up to `batch_size`
+    in body order, so only one batch is held in memory. Deleted ids are
+    only ids and are yielded once per table when the body ends, because
+    deletions are applied after every upsert anyway.
+    """
+    batch: List = []
+    batch_table = None
+    deleted: Dict[str, List[str]] = defaultdict(list)
+    builder = None
+    depth = 0
+
+    async for prefix, event, value in ijson.parse_async(reader, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if event in ("start_map", "start_array"):
+                depth += 1
+            elif event in ("end_map", "end_array"):
+                depth -= 1
+            if depth == 0:
+                batch.append(builder.value)
+                builder = None
+                if len(batch) >= batch_size:
+                    yield batch_table, "records", batch
+                    batch = []
+            continue
+
+        # Та же проверка структуры, что и у SyncPushRequest
+        if prefix == "" and (event == "start_array" or event in SCALARS):
+            raise PushValidationError("body", None, None, "body must be an object")
+        parts = prefix.split(".")
+        if parts[0] != "changes":
+            continue
+        if len(parts) == 1 and (event == "start_array" or event in SCALARS):
+            raise PushValidationError("changes", None, None, "changes must be an object")
+        if len(parts) == 2 and (event == "start_array" or event in SCALARS):
+            raise PushValidationError(parts[1], None, None, "table changes must be an object")
+        if len(parts) == 3 and parts[2] in RECORD_KINDS + ("deleted",) and (event == "start_map" or event in SCALARS):
+            raise PushValidationError(parts[1], None, None, f"{parts[2]} must be an array")
+        if len(parts) != 4 or parts[3] != "item":
+            continue
+
+        table_name, kind = parts[1], parts[2]
+        if kind == "deleted":
+            if event not in ("string", "number", "integer"):
+                raise PushValidationError(table_name, None, None, "deleted must hold record ids")
+            deleted[table_name].append(str(value))
+        elif kind in RECORD_KINDS:
+            if event != "start_map":
+                raise PushValidationError(table_name, None, None, "record must be an object")
+            if batch and batch_table != table_name:
+                yield batch_table, "records", batch
+                batch = []
+            batch_table = table_name
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            depth = 1
+
+    if batch:
+        yield batch_table, "records", batch
+    for table_name, record_ids in deleted.items():
+        yield table_name, "deleted", record_ids
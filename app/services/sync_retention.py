@@ -0,0 +1,82 @@
+"""
+Tombstone retention: purge horizon and batched hard delete of old soft-deleted rows
+"""
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from tortoise import connections
+
+from app.models.sync_version import GLOBAL_SCOPE
+from app.services.sync_versions import Versions
+
+# Marker row in sync_versions: changed_at is the purge horizon
+PURGE_MARKER = "__purge__"
+
+
+class ResyncRequired(Exception):
+    """The client's cursor predates purged tombstones; it must pull from scratch"""
+
+    def __init__(self, horizon: datetime):
+        super().__init__(f"last_pulled_at is older than the purge horizon {horizon.isoformat()}")
+        self.horizon = horizon
+
+
+class SyncRetentionService:
+    @staticmethod
+    def horizon(versions: Versions) -> Optional[datetime]:
+        entry = versions.get((GLOBAL_SCOPE, PURGE_MARKER))
+        return entry[1] if entry else None
+
+    @staticmethod
+    def check(versions: Versions, last_pulled_at: Optional[datetime]) -> None:
+        horizon = SyncRetentionService.horizon(versions)
+        if last_pulled_at is not None and horizon is not None and last_pulled_at < horizon:
+            raise ResyncRequired(horizon)
+
+    @staticmethod
+    async def advance(horizon: datetime) -> Optional[datetime]:
+        """
+        Move the horizon forward (never back); returns the previous one.
+
+        The marker's version is left alone so the pull ETag does not change
+        on every maintenance run; pull checks the horizon before answering 304.
+        """
+        rows = await connections.get("default").execute_query_dict(
+            'WITH previous AS (SELECT "changed_at" FROM "sync_versions" WHERE "scope" = $1 AND "table_name" = $2) '
+            'INSERT INTO "sync_versions" ("scope", "table_name", "version", "changed_at") VALUES ($1, $2, 1, $3) '
+            'ON CONFLICT ("scope", "table_name") DO UPDATE SET '
+            '"changed_at" = GREATEST("sync_versions"."changed_at", EXCLUDED."changed_at") '
+            'RETURNING (SELECT "changed_at" FROM previous) AS "previous"',
+            [GLOBAL_SCOPE, PURGE_MARKER, horizon],
+        )
+        return rows[0]["previous"]
+
+    @staticmethod
+    async def purge_batch(
+        model: Any,
+        children: List[Tuple[str, str]],
+        before: datetime,
+        batch_size: int,
+    ) -> int:
+        """
+        Hard-delete up to `batch_size` rows soft-deleted before `before`.
+
+        Rows still referenced by a child are kept until the child is purged
+        itself: ON DELETE CASCADE would otherwise remove live children that no
+        client has been told about. SKIP LOCKED keeps the purge from waiting on
+        rows a push is writing.
+        """
+        table = model._meta.db_table
+        referenced = "".join(
+            f' AND NOT EXISTS (SELECT 1 FROM "{child}" c WHERE c."{column}" = t."id")'
+            for child, column in children
+        )
+        rows = await connections.get("default").execute_query_dict(
+            f'WITH doomed AS (SELECT t."id" FROM "{table}" t '
+            f'WHERE t."deleted_at" IS NOT NULL AND t."deleted_at" < $1{referenced} '
+            f'LIMIT $2 FOR UPDATE SKIP LOCKED), '
+            f'removed AS (DELETE FROM "{table}" WHERE "id" IN (SELECT "id" FROM doomed) RETURNING 1) '
+            f'SELECT count(*) AS "removed" FROM removed',
+            [before, batch_size],
+        )
+        return rows[0]["removed"]
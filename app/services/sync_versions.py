@@ -0,0 +1,97 @@
+"""
+Per-family change versions for sync pull
+"""
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tortoise import connections
+
+from app.models.sync_version import GLOBAL_SCOPE, SyncVersion
+
+# Marker row: every write after its changed_at is guaranteed to have bumped a version
+TRACKING_TABLE = "__tracking__"
+
+# Tables that also hold default rows (family_id NULL) shared by all families
+GLOBAL_TABLES = frozenset({
+    "analysis_templates", "analysis_template_items",
+    "component_types", "chelator_types",
+})
+
+# (scope, table_name) -> (version, changed_at)
+Versions = Dict[Tuple[str, str], Tuple[int, datetime]]
+
+
+class SyncVersionService:
+    @staticmethod
+    async def bump(scope: str, tables: Iterable[str]) -> None:
+        """Increment the version of `tables` in `scope` in one statement"""
+        # Sorted so concurrent bumps lock rows in the same order
+        tables = sorted(set(tables))
+        if not tables:
+            return
+        await connections.get("default").execute_query(
+            'INSERT INTO "sync_versions" ("scope", "table_name", "version", "changed_at") '
+            'SELECT $1, t, 1, $3 FROM unnest($2::varchar[]) AS t '
+            'ON CONFLICT ("scope", "table_name") DO UPDATE SET '
+            '"version" = "sync_versions"."version" + 1, '
+            '"changed_at" = GREATEST("sync_versions"."changed_at", EXCLUDED."changed_at")',
+            [scope, tables, datetime.now(timezone.utc)],
+        )
+
+    @staticmethod
+    async def ensure_tracking() -> None:
+        """Start tracking on a fresh database; older pulls always query every table"""
+        await connections.get("default").execute_query(
+            'INSERT INTO "sync_versions" ("scope", "table_name", "version", "changed_at") '
+            'VALUES ($1, $2, 0, $3) ON CONFLICT ("scope", "table_name") DO NOTHING',
+            [GLOBAL_SCOPE, TRACKING_TABLE, datetime.now(timezone.utc)],
+        )
+
+    @staticmethod
+    async def get_versions(family_id: str) -> Versions:
+        try:
+            rows = await SyncVersion.filter(scope__in=[str(family_id), GLOBAL_SCOPE]).values_list(
+                "scope", "table_name", "version", "changed_at"
+            )
+        except Exception as e:
+            # Без версий pull просто опрашивает все таблицы
+            logging.error(f"Версии синхронизации недоступны: {e}")
+            return {}
+        return {(scope, table): (version, changed_at) for scope, table, version, changed_at in rows}
+
+    @staticmethod
+    def changed_tables(
+        versions: Versions,
+        family_id: str,
+        last_pulled_at: Optional[datetime],
+        tables: Iterable[str],
+    ) -> List[str]:
+        """Tables that may hold changes newer than `last_pulled_at`"""
+        tables = list(tables)
+        if last_pulled_at is None:
+            return tables
+
+        tracking = versions.get((GLOBAL_SCOPE, TRACKING_TABLE))
+        if tracking is None or last_pulled_at < tracking[1]:
+            return tables
+
+        family_scope = str(family_id)
+        changed = []
+        for table_name in tables:
+            scopes = (family_scope, GLOBAL_SCOPE) if table_name in GLOBAL_TABLES else (family_scope,)
+            for scope in scopes:
+                entry = versions.get((scope, table_name))
+                if entry is not None and entry[1] > last_pulled_at:
+                    changed.append(table_name)
+                    break
+        return changed
+
+    @staticmethod
+    def etag(family_id: str, versions: Versions) -> str:
+        digest = hashlib.sha1(str(family_id).encode())
+        for (scope, table_name), (version, _) in sorted(versions.items()):
+            digest.update(f"|{scope}/{table_name}={version}".encode())
+        # Weak: the body's timestamp differs even when the data does not
+        return f'W/"{digest.hexdigest()}"'
@@ -0,0 +1,146 @@
+"""
+Streaming multipart upload: the file part goes to disk chunk by chunk
+"""
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+
+try:
+    import python_multipart as multipart
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import parse_options_header
+
+FILE_FIELD = "file"
+
+# Заголовки частей и граница multipart поверх самого файла
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """The file (or the whole body) exceeds MAX_FILE_SIZE"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"File too large. Maximum size: {limit} bytes")
+        self.limit = limit
+
+
+class InvalidUpload(Exception):
+    """Not a multipart body, or no file part in it"""
+
+
+class _FilePart:
+    """python-multipart callbacks picking the data of the first `file` part with a filename"""
+
+    def __init__(self) -> None:
+        self.header_name = b""
+        self.header_value = b""
+        self.disposition = b""
+        self.active = False
+        self.filename: Optional[str] = None
+        self.finished = False
+        self.pending: List[bytes] = []
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self) -> None:
+        self.disposition = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self.header_name.lower() == b"content-disposition":
+            self.disposition = self.header_value
+        self.header_name = self.header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self.disposition)
+        self.active = (
+            not self.finished
+            and options.get(b"name") == FILE_FIELD.encode()
+            and b"filename" in options
+        )
+        if self.active:
+            self.filename = options[b"filename"].decode("utf-8", errors="replace")
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.active:
+            self.pending.append(data[start:end])
+
+    def on_part_end(self) -> None:
+        if self.active:
+            self.active = False
+            self.finished = True
+
+
+async def save_upload(
+    content_type: Optional[str],
+    chunks: AsyncIterator[bytes],
+    directory: Path,
+    limit: int,
+    chunk_size: int,
+) -> Tuple[str, str, int]:
+    """
+    Write the `file` part of a multipart body into `directory`.
+
+    The data goes to a temporary file in the same directory in pieces of at
+    most `chunk_size` bytes and is renamed into place only when complete, so
+    memory stays constant and a rejected upload leaves nothing behind.
+    Returns (client filename, stored filename, size).
+    """
+    _, params = parse_options_header(content_type or "")
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise InvalidUpload("Expected a multipart/form-data body")
+
+    part = _FilePart()
+    parser = multipart.MultipartParser(boundary, part.callbacks())
+    await aiofiles.os.makedirs(directory, exist_ok=True)
+    temp_path = directory / f".{uuid.uuid4()}.part"
+    size = 0
+    received = 0
+    try:
+        async with aiofiles.open(temp_path, "wb") as out:
+            async for chunk in chunks:
+                received += len(chunk)
+                if received > limit + MULTIPART_OVERHEAD:
+                    raise UploadTooLarge(limit)
+                # Большой кусок (тело одним сообщением) режем, чтобы не держать его части целиком
+                for offset in range(0, len(chunk), chunk_size):
+                    parser.write(chunk[offset:offset + chunk_size])
+                    for data in part.pending:
+                        size += len(data)
+                        if size > limit:
+                            raise UploadTooLarge(limit)
+                        await out.write(data)
+                    part.pending.clear()
+            parser.finalize()
+        if not part.finished:
+            raise InvalidUpload(f"Field '{FILE_FIELD}' with a file is required")
+
+        unique_filename = f"{uuid.uuid4()}{Path(part.filename).suffix if part.filename else ''}"
+        await aiofiles.os.replace(temp_path, directory / unique_filename)
+    except BaseException:
+        # Синхронно: при отмене запроса await здесь мог бы уже не выполниться
+        temp_path.unlink(missing_ok=True)
+        raise
+    return part.filename or unique_filename, unique_filename, size
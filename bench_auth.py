@@ -0,0 +1,193 @@
+"""
+Auth benchmarks.
+
+Usage:
+    python bench_auth.py logins [--logins 20] [--probes 40] [--mode inline|pool|both]
+    python bench_auth.py tokens [--requests 20000]
+    python bench_auth.py onboarding [--signups 500] [--concurrency 20] [--path sequential|single|both]
+
+logins needs a running database configured the same way as the app (see .env).
+It measures the latency of a sync pull while a burst of password checks runs
+on the same event loop: bcrypt inline (previous behaviour) vs the hashing pool.
+
+tokens measures access token verification per request (no database):
+python-jose vs the stdlib HMAC backend, each uncached and cached.
+
+onboarding measures concurrent registrations without bcrypt (the hash is
+computed once): the previous four sequential statements vs the single
+statement of OnboardingService.register.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from tortoise import Tortoise
+
+from app.core import security
+from app.core.config import TORTOISE_ORM, settings
+from app.core.security import get_password_hash, verify_password, verify_password_async
+from app.models import Family, User
+from app.services.onboarding import OnboardingService
+from app.services.sync import SyncService
+
+PASSWORD = "bench-password"
+
+
+def percentile(samples, p):
+    return statistics.quantiles(samples, n=100, method="inclusive")[p - 1]
+
+
+def report(label, samples):
+    print(
+        f"{label:<24} p50={percentile(samples, 50) * 1000:8.1f} ms  "
+        f"p99={percentile(samples, 99) * 1000:8.1f} ms  "
+        f"max={max(samples) * 1000:8.1f} ms"
+    )
+
+
+async def seed_user() -> User:
+    family = await Family.create(patient_name=f"bench-{uuid.uuid4().hex[:8]}")
+    return await User.create(
+        email=f"bench-{uuid.uuid4().hex[:8]}@example.com",
+        password_hash=get_password_hash(PASSWORD),
+        family_id=family.id,
+    )
+
+
+async def login_inline(email: str) -> None:
+    """Previous login path: bcrypt on the event loop"""
+    user = await User.filter(email=email).first()
+    verify_password(PASSWORD, user.password_hash)
+
+
+async def login_pool(email: str) -> None:
+    user = await User.filter(email=email).first()
+    await verify_password_async(PASSWORD, user.password_hash)
+
+
+async def probe(family_id: str, count: int) -> list:
+    """Sync pulls one after another, like a device syncing during the burst"""
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        await SyncService.pull_changes(family_id)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def bench_logins(logins: int, probes: int, mode: str) -> None:
+    user = await seed_user()
+    family_id = str(user.family_id)
+    await SyncService.pull_changes(family_id)  # прогрев
+
+    report("idle", await probe(family_id, probes))
+
+    paths = {"inline": login_inline, "pool": login_pool}
+    selected = list(paths) if mode == "both" else [mode]
+    for name in selected:
+        login = paths[name]
+        started = time.perf_counter()
+        burst = asyncio.gather(*(login(user.email) for _ in range(logins)))
+        samples = await probe(family_id, probes)
+        await burst
+        report(f"{name} ({logins} logins)", samples)
+        print(f"{'':<24} burst done in {time.perf_counter() - started:.2f} s")
+
+
+def bench_tokens(requests: int) -> None:
+    backend, cache_size = settings.JWT_BACKEND, settings.JWT_CACHE_MAX_ENTRIES
+    token = security.create_access_token(data={"sub": str(uuid.uuid4())})
+    cache = security._token_cache()  # создаётся с настоящим размером до отключения кэша ниже
+    try:
+        for name in ("jose", "hmac"):
+            for cached in (False, True):
+                settings.JWT_BACKEND = name
+                settings.JWT_CACHE_MAX_ENTRIES = cache_size if cached else 0
+                cache.clear()
+                assert security.decode_access_token(token) is not None  # прогрев
+                started = time.perf_counter()
+                for _ in range(requests):
+                    security.decode_access_token(token)
+                elapsed = time.perf_counter() - started
+                label = f"{name}{' + cache' if cached else ''}"
+                print(f"{label:<24} {elapsed / requests * 1e6:8.1f} us/request  {requests / elapsed:10.0f} requests/s")
+    finally:
+        settings.JWT_BACKEND, settings.JWT_CACHE_MAX_ENTRIES = backend, cache_size
+
+
+async def register_sequential(email: str, password_hash: str) -> None:
+    """Previous register path: existence check, family, user, family owner update"""
+    if await User.filter(email=email).first():
+        return
+    family = await Family.create()
+    user = await User.create(email=email, password_hash=password_hash, family_id=family.id)
+    family.owner_id = str(user.id)
+    await family.save()
+
+
+async def register_single(email: str, password_hash: str) -> None:
+    await OnboardingService.register(email, password_hash)
+
+
+async def bench_onboarding(signups: int, concurrency: int, path: str) -> None:
+    paths = {"sequential": register_sequential, "single": register_single}
+    selected = list(paths) if path == "both" else [path]
+    password_hash = get_password_hash(PASSWORD)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    for name in selected:
+        register = paths[name]
+        run = uuid.uuid4().hex[:8]
+
+        async def signup(i: int) -> float:
+            async with semaphore:
+                started = time.perf_counter()
+                await register(f"bench-{run}-{i}@example.com", password_hash)
+                return time.perf_counter() - started
+
+        await signup(-1)  # прогрев
+        started = time.perf_counter()
+        samples = await asyncio.gather(*(signup(i) for i in range(signups)))
+        elapsed = time.perf_counter() - started
+        report(f"{name} (x{concurrency})", samples)
+        print(f"{'':<24} {signups / elapsed:10.0f} signups/s")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    logins = sub.add_parser("logins", help="sync pull latency during a burst of logins, inline bcrypt vs hashing pool")
+    logins.add_argument("--logins", type=int, default=20, help="concurrent password checks in the burst")
+    logins.add_argument("--probes", type=int, default=40, help="sync pulls measured during the burst")
+    logins.add_argument("--mode", choices=["inline", "pool", "both"], default="both")
+
+    tokens = sub.add_parser("tokens", help="access token verification: python-jose vs stdlib HMAC, uncached vs cached (no database)")
+    tokens.add_argument("--requests", type=int, default=20000)
+
+    onboarding = sub.add_parser("onboarding", help="concurrent registrations: four statements vs one (bcrypt excluded)")
+    onboarding.add_argument("--signups", type=int, default=500)
+    onboarding.add_argument("--concurrency", type=int, default=20)
+    onboarding.add_argument("--path", choices=["sequential", "single", "both"], default="both")
+
+    args = parser.parse_args()
+
+    if args.command == "tokens":
+        bench_tokens(args.requests)
+        return
+
+    print(f"PASSWORD_HASH_WORKERS={settings.PASSWORD_HASH_WORKERS}")
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        if args.command == "logins":
+            await bench_logins(args.logins, args.probes, args.mode)
+        elif args.command == "onboarding":
+            await bench_onboarding(args.signups, args.concurrency, args.path)
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
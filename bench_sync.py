@@ -0,0 +1,361 @@
+"""
+Sync benchmarks.
+
+Usage:
+    python bench_sync.py pull [--family-id ID | --seed N] [--iterations 50]
+    python bench_sync.py fetch [--family-id ID | --seed 50000] [--path models|values]
+    python bench_sync.py encode [--rows 20000]
+    python bench_sync.py push [--records 2000] [--path per-record|bulk|both]
+    python bench_sync.py decode [--records 20000]
+
+pull/fetch/push need a running database configured the same way as the app (see .env).
+"""
+import argparse
+import asyncio
+import resource
+import statistics
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+
+from tortoise import Tortoise
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import Q
+from tortoise.fields import DatetimeField
+
+from app.core.config import TORTOISE_ORM
+from app.core import responses
+from app.models import Family, Transfusion, Analysis, AnalysisItem, Reminder
+from app.services.sync import SyncService
+from app.services.sync_plans import get_decoder, get_plan
+
+
+async def seed_family(rows: int) -> str:
+    """Create a synthetic family with `rows` analysis items spread over analyses."""
+    family = await Family.create(patient_name=f"bench-{uuid.uuid4().hex[:8]}")
+
+    await Transfusion.bulk_create([
+        Transfusion(family_id=family.id, date=f"2024-01-{i % 28 + 1:02d}", volume=300, weight=60.0)
+        for i in range(max(rows // 20, 1))
+    ], batch_size=1000)
+    await Reminder.bulk_create([
+        Reminder(family_id=family.id, title=f"Reminder {i}", date="2024-01-01", time="09:00", repeat="none")
+        for i in range(max(rows // 100, 1))
+    ], batch_size=1000)
+
+    analyses = [
+        Analysis(id=str(uuid.uuid4()), family_id=family.id, name=f"Analysis {i}", date="2024-01-01")
+        for i in range(max(rows // 10, 1))
+    ]
+    await Analysis.bulk_create(analyses, batch_size=1000)
+    await AnalysisItem.bulk_create([
+        AnalysisItem(
+            family_id=family.id,
+            analysis_id=analyses[i % len(analyses)].id,
+            name="Ферритин",
+            value=str(1000 + i),
+            unit="нг/мл",
+        )
+        for i in range(rows)
+    ], batch_size=1000)
+
+    print(f"Seeded family {family.id} with {rows} analysis items")
+    return str(family.id)
+
+
+def percentile(samples, p):
+    return statistics.quantiles(samples, n=100, method="inclusive")[p - 1]
+
+
+def report(label, samples):
+    print(
+        f"{label:<24} p50={percentile(samples, 50) * 1000:8.1f} ms  "
+        f"p99={percentile(samples, 99) * 1000:8.1f} ms  "
+        f"mean={statistics.mean(samples) * 1000:8.1f} ms"
+    )
+
+
+async def bench_pull(family_id: str, iterations: int, concurrency: int) -> None:
+    modes = [("sequential", 1), (f"concurrent (cap={concurrency})", concurrency)]
+
+    # Прогрев: кэш планов PostgreSQL и пул соединений
+    for _, mode_concurrency in modes:
+        await SyncService.pull_changes(family_id, concurrency=mode_concurrency)
+
+    for label, mode_concurrency in modes:
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            await SyncService.pull_changes(family_id, concurrency=mode_concurrency)
+            samples.append(time.perf_counter() - started)
+        report(label, samples)
+
+
+async def fetch_models(family_id: str) -> int:
+    """Previous pull path: hydrate model instances, then serialize them"""
+    plan = get_plan(AnalysisItem)
+    records = await AnalysisItem.filter(family_id=family_id).all()
+    return len([plan.serialize(record) for record in records])
+
+
+async def fetch_values(family_id: str) -> int:
+    table = await SyncService._pull_table("analysis_items", family_id, None)
+    return len(table["created"]) + len(table["updated"]) + len(table["deleted"])
+
+
+async def bench_fetch(family_id: str, path: str, iterations: int) -> None:
+    paths = {"models": fetch_models, "values": fetch_values}
+    selected = list(paths) if path == "both" else [path]
+    if len(selected) > 1:
+        print("Note: peak RSS only grows within a process; run each --path separately for clean RSS numbers")
+
+    for name in selected:
+        fetch = paths[name]
+        await fetch(family_id)  # прогрев
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        rows = 0
+        for _ in range(iterations):
+            rows += await fetch(family_id)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(
+            f"{name:<8} {rows / elapsed:10.0f} rows/s  "
+            f"python peak={peak / 1024 / 1024:7.1f} MiB  process max RSS={max_rss_mb:7.1f} MiB"
+        )
+
+
+def push_payload(records: int) -> dict:
+    """A device coming back online: new analyses with their items"""
+    analyses = [
+        {"id": str(uuid.uuid4()), "name": f"Analysis {i}", "date": "2024-01-01", "_status": "created", "_changed": ""}
+        for i in range(max(records // 10, 1))
+    ]
+    items = [
+        {
+            "id": str(uuid.uuid4()), "analysis_id": analyses[i % len(analyses)]["id"],
+            "name": "Ферритин", "value": str(1000 + i), "unit": "нг/мл", "_status": "created", "_changed": "",
+        }
+        for i in range(records)
+    ]
+    return {
+        "analyses": {"created": analyses, "updated": [], "deleted": []},
+        "analysis_items": {"created": items, "updated": [], "deleted": []},
+    }
+
+
+async def create_or_update_record(model, data: dict, family_id: str) -> None:
+    """Previous per-record upsert, kept verbatim as the baseline"""
+    record_id = data.get("id")
+
+    valid_fields = set(model._meta.fields_map.keys())
+    for field_name in model._meta.fk_fields:
+        valid_fields.add(f"{field_name}_id")
+    data = {k: v for k, v in data.items() if k in valid_fields or k == 'id'}
+
+    for field in ["created_at", "updated_at", "deleted_at"]:
+        if field in data and isinstance(data[field], int):
+            data[field] = datetime.fromtimestamp(data[field] / 1000, tz=timezone.utc)
+    if "updated_at" not in data:
+        data["updated_at"] = datetime.now(timezone.utc)
+
+    query = model.filter(id=record_id)
+    if family_id and "family" in model._meta.fields_map:
+        query = query.filter(Q(family_id=family_id) | Q(family_id__isnull=True))
+
+    existing = await query.first()
+    if existing:
+        if hasattr(existing, 'family_id') and existing.family_id is None:
+            return
+        update_data = {k: v for k, v in data.items() if k != 'id'}
+        await model.filter(id=record_id).update(**update_data)
+    else:
+        try:
+            await model.create(**data)
+        except IntegrityError:
+            pass
+
+
+async def push_per_record(family_id: str, changes: dict) -> None:
+    """Previous push path: SELECT + INSERT/UPDATE per record"""
+    for table_name, model in (("analyses", Analysis), ("analysis_items", AnalysisItem)):
+        for record in changes[table_name]["created"]:
+            record["family_id"] = family_id
+            await create_or_update_record(model, record, family_id)
+
+
+async def push_bulk(family_id: str, changes: dict) -> None:
+    await SyncService.push_changes(family_id, changes)
+
+
+async def bench_push(records: int, path: str, iterations: int) -> None:
+    paths = {"per-record": push_per_record, "bulk": push_bulk}
+    selected = list(paths) if path == "both" else [path]
+
+    for name in selected:
+        push = paths[name]
+        family = await Family.create(patient_name=f"bench-{uuid.uuid4().hex[:8]}")
+        await push(str(family.id), push_payload(10))  # прогрев
+
+        samples = []
+        for iteration in range(iterations):
+            changes = push_payload(records)
+            total = sum(len(table["created"]) for table in changes.values())
+            started = time.perf_counter()
+            await push(str(family.id), changes)
+            samples.append(time.perf_counter() - started)
+        report(f"{name} ({total} records)", samples)
+        print(f"{'':<24} {total / statistics.mean(samples):10.0f} records/s")
+
+
+def decode_filtered(model, records: list) -> list:
+    """Oldest push path: field whitelist rebuilt and date keys converted for every record"""
+    rows = []
+    for data in records:
+        valid_fields = set(model._meta.fields_map.keys())
+        for field_name in model._meta.fk_fields:
+            valid_fields.add(f"{field_name}_id")
+        data = {k: v for k, v in data.items() if k in valid_fields or k == 'id'}
+        for field in ["created_at", "updated_at", "deleted_at"]:
+            if field in data and isinstance(data[field], int):
+                data[field] = datetime.fromtimestamp(data[field] / 1000, tz=timezone.utc)
+        rows.append(data)
+    return rows
+
+
+def decode_per_record(model, records: list) -> list:
+    """Previous push path: field metadata looked up per key of every record"""
+    columns = model._meta.fields_db_projection
+    fields_map = model._meta.fields_map
+    rows = []
+    for data in records:
+        row = {}
+        for key, value in data.items():
+            column = columns.get(key)
+            if column is None:
+                continue
+            field = fields_map[key]
+            if isinstance(field, DatetimeField):
+                if isinstance(value, int):
+                    value = datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+                elif isinstance(value, str):
+                    value = field.to_python_value(value)
+            elif value is not None:
+                value = field.to_db_value(value, None)
+            row[column] = value
+        rows.append(row)
+    return rows
+
+
+def decode_compiled(model, records: list) -> list:
+    return get_decoder(model).decode_many(records)
+
+
+def bench_decode(records: int, iterations: int) -> None:
+    now = int(datetime.now(timezone.utc).timestamp() * 1000)
+    items = push_payload(records)["analysis_items"]["created"]
+    for item in items:
+        item.update(created_at=now, updated_at=now, deleted_at=None, family_id=str(uuid.uuid4()))
+
+    decoders = [("filter", decode_filtered), ("per-record", decode_per_record), ("compiled", decode_compiled)]
+    for label, decode in decoders:
+        decode(AnalysisItem, items)  # прогрев
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            decode(AnalysisItem, items)
+            samples.append(time.perf_counter() - started)
+        report(f"{label} ({records} records)", samples)
+        print(f"{'':<24} {records / statistics.mean(samples):10.0f} records/s")
+
+
+def bench_encode(rows: int, iterations: int) -> None:
+    now = datetime.now(timezone.utc)
+    items = [
+        {
+            "id": str(uuid.uuid4()), "created_at": now, "updated_at": now, "deleted_at": None,
+            "family_id": str(uuid.uuid4()), "analysis_id": str(uuid.uuid4()),
+            "name": "Ферритин", "value": str(1000 + i), "unit": "нг/мл",
+        }
+        for i in range(rows)
+    ]
+    payload = {
+        "changes": {"analysis_items": {"created": items, "updated": [], "deleted": []}},
+        "timestamp": int(now.timestamp() * 1000),
+    }
+
+    encoders = [("stdlib json", responses.stdlib_dumps)]
+    if responses.orjson is not None:
+        encoders.append(("orjson", responses.orjson_dumps))
+    else:
+        print("orjson is not installed, only the stdlib fallback is measured")
+
+    for label, encode in encoders:
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            body = encode(payload)
+            samples.append(time.perf_counter() - started)
+        report(f"{label} ({len(body) // 1024} KiB)", samples)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    pull = sub.add_parser("pull", help="initial pull latency, sequential vs concurrent")
+    pull.add_argument("--family-id")
+    pull.add_argument("--seed", type=int, default=5000, help="analysis items to seed when no --family-id")
+    pull.add_argument("--iterations", type=int, default=50)
+    pull.add_argument("--concurrency", type=int, default=4)
+
+    fetch = sub.add_parser("fetch", help="analysis_items fetch: model instances vs values_list tuples")
+    fetch.add_argument("--family-id")
+    fetch.add_argument("--seed", type=int, default=50000, help="analysis items to seed when no --family-id")
+    fetch.add_argument("--path", choices=["models", "values", "both"], default="both")
+    fetch.add_argument("--iterations", type=int, default=5)
+
+    encode = sub.add_parser("encode", help="response encoding, stdlib json vs orjson (no database)")
+    encode.add_argument("--rows", type=int, default=20000)
+    encode.add_argument("--iterations", type=int, default=20)
+
+    push = sub.add_parser("push", help="push throughput: per-record writes vs bulk upsert")
+    push.add_argument("--records", type=int, default=2000, help="analysis items per push (plus 1 analysis per 10)")
+    push.add_argument("--path", choices=["per-record", "bulk", "both"], default="both")
+    push.add_argument("--iterations", type=int, default=5)
+
+    decode = sub.add_parser("decode", help="push record decoding: per-record field lookups vs compiled decoders (no database)")
+    decode.add_argument("--records", type=int, default=20000)
+    decode.add_argument("--iterations", type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == "encode":
+        bench_encode(args.rows, args.iterations)
+        return
+    if args.command == "decode":
+        Tortoise.init_models([m for m in TORTOISE_ORM["apps"]["models"]["models"] if m != "aerich.models"], "models")
+        bench_decode(args.records, args.iterations)
+        return
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        if args.command == "pull":
+            family_id = args.family_id or await seed_family(args.seed)
+            await bench_pull(family_id, args.iterations, args.concurrency)
+        elif args.command == "fetch":
+            family_id = args.family_id or await seed_family(args.seed)
+            await bench_fetch(family_id, args.path, args.iterations)
+        elif args.command == "push":
+            await bench_push(args.records, args.path, args.iterations)
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
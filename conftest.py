@@ -0,0 +1,5 @@
+import os
+
+# Settings() requires mail credentials at import time; tests never send mail
+for key in ("MAIL_USERNAME", "MAIL_PASSWORD", "MAIL_FROM", "MAIL_SERVER"):
+    os.environ.setdefault(key, "test")
@@ -0,0 +1,80 @@
+"""
+Index advisor for sync pull.
+
+Runs EXPLAIN (ANALYZE) on the pull query of every synced table and reports
+whether PostgreSQL answers it from an index or falls back to a sequential scan.
+
+Usage:
+    python explain_sync_queries.py --family-id ID [--since-hours 24]
+
+Without --since-hours the initial (full) pull query is explained. Note that on
+small tables the planner prefers a sequential scan even when an index exists.
+"""
+import argparse
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+from tortoise import Tortoise, connections
+
+from app.core.config import TORTOISE_ORM
+from app.services.sync import PULL_TABLES, SYNC_MODELS, SyncService
+from app.services.sync_plans import get_plan
+
+INDEX_NODES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+def walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+async def explain(family_id: str, last_pulled_at) -> None:
+    conn = connections.get("default")
+    print(f"{'table':<26} {'verdict':<10} {'ms':>8}  plan")
+
+    for table_name in PULL_TABLES:
+        model = SYNC_MODELS[table_name]
+        query = SyncService._table_query(table_name, model, family_id, last_pulled_at)
+        sql = query.values_list(*get_plan(model).columns).sql()
+
+        rows = await conn.execute_query_dict(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}")
+        plan = rows[0]["QUERY PLAN"]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        plan = plan[0]
+
+        nodes = list(walk(plan["Plan"]))
+        indexes = sorted({n["Index Name"] for n in nodes if n["Node Type"] in INDEX_NODES and "Index Name" in n})
+        seq_scans = [n for n in nodes if n["Node Type"] == "Seq Scan"]
+
+        if seq_scans:
+            verdict = "SEQ SCAN"
+        elif indexes:
+            verdict = "index"
+        else:
+            verdict = "?"
+        summary = ", ".join(indexes) or " -> ".join(n["Node Type"] for n in nodes)
+        print(f"{table_name:<26} {verdict:<10} {plan['Execution Time']:8.2f}  {summary}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--family-id", required=True)
+    parser.add_argument("--since-hours", type=float, help="explain an incremental pull from N hours ago")
+    args = parser.parse_args()
+
+    last_pulled_at = None
+    if args.since_hours is not None:
+        last_pulled_at = datetime.now(timezone.utc) - timedelta(hours=args.since_hours)
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        await explain(args.family_id, last_pulled_at)
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
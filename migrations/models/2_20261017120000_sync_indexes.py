@@ -0,0 +1,48 @@
+"""
+Indexes for sync pull: (family_id, updated_at) on every synced table and a
+partial (updated_at) WHERE is_default index on the lookup tables.
+
+CREATE INDEX CONCURRENTLY cannot run inside a transaction, so apply this with
+`aerich upgrade --in-transaction False` on a live database. Under the default
+transactional upgrade the indexes are built with a plain CREATE INDEX.
+"""
+from tortoise import BaseDBAsyncClient
+from tortoise.backends.base.client import BaseTransactionWrapper
+
+# (name, table, columns, predicate) - names match app.models.base.sync_indexes
+INDEXES = [
+    ("idx_transfusions_family_updated", "transfusions", '"family_id", "updated_at"', ""),
+    ("idx_analyses_family_updated", "analyses", '"family_id", "updated_at"', ""),
+    ("idx_analysis_items_family_updated", "analysis_items", '"family_id", "updated_at"', ""),
+    ("idx_analysis_templates_family_updated", "analysis_templates", '"family_id", "updated_at"', ""),
+    ("idx_analysis_templates_default_updated", "analysis_templates", '"updated_at"', " WHERE is_default = true"),
+    ("idx_analysis_template_items_family_updated", "analysis_template_items", '"family_id", "updated_at"', ""),
+    ("idx_reminders_family_updated", "reminders", '"family_id", "updated_at"', ""),
+    ("idx_documents_family_updated", "documents", '"family_id", "updated_at"', ""),
+    ("idx_component_types_family_updated", "component_types", '"family_id", "updated_at"', ""),
+    ("idx_component_types_default_updated", "component_types", '"updated_at"', " WHERE is_default = true"),
+    ("idx_chelator_types_family_updated", "chelator_types", '"family_id", "updated_at"', ""),
+    ("idx_chelator_types_default_updated", "chelator_types", '"updated_at"', " WHERE is_default = true"),
+]
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    concurrently = "" if isinstance(db, BaseTransactionWrapper) else " CONCURRENTLY"
+    for name, table, columns, predicate in INDEXES:
+        # An interrupted CONCURRENTLY build leaves an INVALID index behind that
+        # IF NOT EXISTS would silently keep
+        invalid = await db.execute_query_dict(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = $1 AND NOT i.indisvalid",
+            [name],
+        )
+        if invalid:
+            await db.execute_script(f'DROP INDEX{concurrently} IF EXISTS "{name}";')
+        # One statement per call: a multi-statement script runs as an implicit transaction
+        await db.execute_script(f'CREATE INDEX{concurrently} IF NOT EXISTS "{name}" ON "{table}" ({columns}){predicate};')
+    # aerich executes whatever is returned; the indexes are already built
+    return "SELECT 1;"
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return "\n".join(f'DROP INDEX IF EXISTS "{name}";' for name, _, _, _ in INDEXES)
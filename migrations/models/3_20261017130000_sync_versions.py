@@ -0,0 +1,24 @@
+"""
+Per-family change versions for sync pull (table `sync_versions`).
+
+The "__tracking__" marker row is inserted by the application on startup; pulls
+with a cursor older than the marker query every table as before.
+"""
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "sync_versions" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "scope" VARCHAR(255) NOT NULL,
+    "table_name" VARCHAR(64) NOT NULL,
+    "version" BIGINT NOT NULL DEFAULT 0,
+    "changed_at" TIMESTAMPTZ NOT NULL,
+    CONSTRAINT "uid_sync_versio_scope_809f97" UNIQUE ("scope", "table_name")
+);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "sync_versions";"""
@@ -0,0 +1,28 @@
+"""
+Append-only sync changelog (table `sync_changes`).
+
+Entries are only written by pushes made after this migration. A client's
+first pull with SYNC_PULL_SOURCE=changelog still carries a millisecond
+cursor and is answered with an updated_at scan, so history is not backfilled.
+"""
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "sync_changes" (
+    "id" BIGSERIAL NOT NULL PRIMARY KEY,
+    "scope" VARCHAR(255) NOT NULL,
+    "version" BIGINT NOT NULL,
+    "table_name" VARCHAR(64) NOT NULL,
+    "record_id" VARCHAR(255) NOT NULL,
+    "op" VARCHAR(16) NOT NULL,
+    "changed_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS "idx_sync_changes_scope_version" ON "sync_changes" ("scope", "version");
+CREATE INDEX IF NOT EXISTS "idx_sync_changes_record" ON "sync_changes" ("scope", "table_name", "record_id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "sync_changes";"""
@@ -0,0 +1,44 @@
+"""
+Partial (deleted_at) WHERE deleted_at IS NOT NULL index on every synced table,
+used by the tombstone purge to find old soft-deleted rows.
+
+Like 2_20261017120000_sync_indexes, run with `aerich upgrade --in-transaction False`
+on a live database to build the indexes CONCURRENTLY.
+"""
+from tortoise import BaseDBAsyncClient
+from tortoise.backends.base.client import BaseTransactionWrapper
+
+# (name, table, columns, predicate) - names match app.models.base.sync_indexes
+INDEXES = [
+    ("idx_transfusions_deleted", "transfusions", '"deleted_at"', ' WHERE "deleted_at" IS NOT NULL'),
+    ("idx_analyses_deleted", "analyses", '"deleted_at"', ' WHERE "deleted_at" IS NOT NULL'),
+    ("idx_analysis_items_deleted", "analysis_items", '"deleted_at"', ' WHERE "deleted_at" IS NOT NULL'),
+    ("idx_analysis_templates_deleted", "analysis_templates", '"deleted_at"', ' WHERE "deleted_at" IS NOT NULL'),
+    ("idx_analysis_template_items_deleted", "analysis_template_items", '"deleted_at"', ' WHERE "deleted_at" IS NOT NULL'),
+    ("idx_reminders_deleted", "reminders", '"deleted_at"', ' WHERE "deleted_at" IS NOT NULL'),
+    ("idx_documents_deleted", "documents", '"deleted_at"', ' WHERE "deleted_at" IS NOT NULL'),
+    ("idx_component_types_deleted", "component_types", '"deleted_at"', ' WHERE "deleted_at" IS NOT NULL'),
+    ("idx_chelator_types_deleted", "chelator_types", '"deleted_at"', ' WHERE "deleted_at" IS NOT NULL'),
+]
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    concurrently = "" if isinstance(db, BaseTransactionWrapper) else " CONCURRENTLY"
+    for name, table, columns, predicate in INDEXES:
+        # An interrupted CONCURRENTLY build leaves an INVALID index behind that
+        # IF NOT EXISTS would silently keep
+        invalid = await db.execute_query_dict(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = $1 AND NOT i.indisvalid",
+            [name],
+        )
+        if invalid:
+            await db.execute_script(f'DROP INDEX{concurrently} IF EXISTS "{name}";')
+        # One statement per call: a multi-statement script runs as an implicit transaction
+        await db.execute_script(f'CREATE INDEX{concurrently} IF NOT EXISTS "{name}" ON "{table}" ({columns}){predicate};')
+    # aerich executes whatever is returned; the indexes are already built
+    return "SELECT 1;"
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return "\n".join(f'DROP INDEX IF EXISTS "{name}";' for name, _, _, _ in INDEXES)
@@ -0,0 +1,28 @@
+"""
+Queue of asynchronous pushes (table `sync_jobs`).
+"""
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "sync_jobs" (
+    "id" VARCHAR(36) NOT NULL  PRIMARY KEY,
+    "status" VARCHAR(16) NOT NULL  DEFAULT 'queued',
+    "payload" TEXT,
+    "last_pulled_at" BIGINT,
+    "records" INT NOT NULL  DEFAULT 0,
+    "attempts" INT NOT NULL  DEFAULT 0,
+    "result" JSONB,
+    "error" JSONB,
+    "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "started_at" TIMESTAMPTZ,
+    "finished_at" TIMESTAMPTZ,
+    "family_id" VARCHAR(255) NOT NULL REFERENCES "families" ("id") ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS "idx_sync_jobs_status_created" ON "sync_jobs" ("status", "created_at");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "sync_jobs";"""
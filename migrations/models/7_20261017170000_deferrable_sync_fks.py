@@ -0,0 +1,20 @@
+"""
+Foreign keys between synced tables become DEFERRABLE INITIALLY IMMEDIATE.
+
+Nothing changes for ordinary statements; a streamed push runs
+SET CONSTRAINTS ALL DEFERRED so a child table may arrive before its parent
+and the references are checked at commit.
+"""
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "analysis_items" ALTER CONSTRAINT "analysis_items_analysis_id_fkey" DEFERRABLE INITIALLY IMMEDIATE;
+        ALTER TABLE "analysis_template_items" ALTER CONSTRAINT "analysis_template_items_template_id_fkey" DEFERRABLE INITIALLY IMMEDIATE;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "analysis_items" ALTER CONSTRAINT "analysis_items_analysis_id_fkey" NOT DEFERRABLE;
+        ALTER TABLE "analysis_template_items" ALTER CONSTRAINT "analysis_template_items_template_id_fkey" NOT DEFERRABLE;"""
@@ -0,0 +1,19 @@
+"""
+Sequence behind invite codes (app/services/invite_codes.py).
+
+Each nextval() reserves a block of 64 numbers that a worker hands out
+without further queries; numbers are scrambled into 6 base36 characters,
+36**6 codes in total (MAXVALUE is the start of the last block).
+"""
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE SEQUENCE IF NOT EXISTS "family_invite_seq" AS BIGINT
+    INCREMENT BY 64 MINVALUE 0 MAXVALUE 2176782272 START WITH 0 NO CYCLE;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP SEQUENCE IF EXISTS "family_invite_seq";"""
@@ -0,0 +1,17 @@
+"""
+Heartbeat of running sync jobs (`sync_jobs.heartbeat_at`).
+
+The worker applying a job renews it while the push runs; another worker
+takes the job over only once it is older than SYNC_JOB_TIMEOUT.
+"""
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "sync_jobs" ADD COLUMN IF NOT EXISTS "heartbeat_at" TIMESTAMPTZ;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "sync_jobs" DROP COLUMN IF EXISTS "heartbeat_at";"""
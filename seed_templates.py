@@ -2,6 +2,7 @@ import asyncio
 from tortoise import Tortoise
 from app.core.config import TORTOISE_ORM
 from app.models.analysis_template import AnalysisTemplate, AnalysisTemplateItem
+from app.services.sync_lookups import SyncLookupService
 
 async def seed():
     await Tortoise.init(config=TORTOISE_ORM)
@@ -66,6 +67,9 @@ async def seed():
     else:
         print(f"{bio_id} already exists")
 
+    # Шаблоны по умолчанию видны всем семьям - их pull должен увидеть изменения
+    await SyncLookupService.defaults_changed(["analysis_templates", "analysis_template_items"])
+
     await Tortoise.close_connections()
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+"""
+Auth admission control: token buckets refill at the configured rate up to
+the burst, and a rejection carries Retry-After. Run with
+`python -m pytest test_admission.py`.
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.core import admission
+from app.core.admission import MemoryBackend
+from app.core.config import settings
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def backend():
+    backend = MemoryBackend()
+    backend.cache.clear()
+    admission.set_backend(backend)
+    yield backend
+    admission.set_backend(None)
+
+
+def request(host: str = "10.0.0.1") -> Request:
+    return Request({"type": "http", "method": "POST", "path": "/login", "headers": [], "client": (host, 5000)})
+
+
+def test_bucket_admits_the_burst_then_refills_at_the_rate(clock, backend):
+    async def main():
+        take = lambda: backend.take("ip:a", 0.5, 3)
+        assert [await take() for _ in range(3)] == [0, 0, 0]
+        # Пусто: следующий токен через 1 / rate секунд
+        assert await take() == pytest.approx(2.0)
+
+        clock.now += 1.0
+        assert await take() == pytest.approx(1.0)
+        clock.now += 1.0
+        assert await take() == 0
+
+        # Долгий простой наполняет ведро только до burst
+        clock.now += 3600
+        assert [await take() for _ in range(3)] == [0, 0, 0]
+        assert await take() > 0
+
+        # Ведра разных ключей независимы
+        assert await backend.take("ip:b", 0.5, 3) == 0
+
+    asyncio.run(main())
+
+
+def test_rejection_carries_retry_after(clock, backend, monkeypatch):
+    monkeypatch.setattr(settings, "AUTH_IP_RATE_PER_MINUTE", 2)
+    monkeypatch.setattr(settings, "AUTH_IP_BURST", 1)
+    monkeypatch.setattr(settings, "AUTH_EMAIL_RATE_PER_MINUTE", 6)
+    monkeypatch.setattr(settings, "AUTH_EMAIL_BURST", 1)
+
+    async def main():
+        await admission.admit(request(), "A@example.com")
+        with pytest.raises(HTTPException) as rejected:
+            await admission.admit(request())
+        assert rejected.value.status_code == 429
+        assert rejected.value.headers["Retry-After"] == "30"
+
+        # Другой IP, тот же email (регистр и пробелы не важны): ограничение по email
+        clock.now += 1.5
+        with pytest.raises(HTTPException) as rejected:
+            await admission.admit(request("10.0.0.2"), " a@example.com")
+        assert rejected.value.headers["Retry-After"] == "9"
+
+        clock.now += 30
+        await admission.admit(request(), "a@example.com")
+
+    asyncio.run(main())
+
+
+def test_disabled_limit_admits_everything(clock, backend, monkeypatch):
+    monkeypatch.setattr(settings, "AUTH_IP_RATE_PER_MINUTE", 0)
+
+    async def main():
+        for _ in range(100):
+            await admission.admit(request())
+
+    asyncio.run(main())
+
+
+def test_hash_slots_are_capped(monkeypatch):
+    monkeypatch.setattr(settings, "AUTH_MAX_CONCURRENT_HASHES", 1)
+
+    async def main():
+        async with admission.hash_slot():
+            with pytest.raises(HTTPException) as rejected:
+                async with admission.hash_slot():
+                    pass
+            assert rejected.value.headers["Retry-After"] == "1"
+        async with admission.hash_slot():
+            pass
+
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""
+Concurrent identical pushes through IdempotencyService are applied once,
+also when the first attempt fails. Run with `python -m pytest test_idempotency.py`.
+"""
+import asyncio
+
+import pytest
+
+from app.services import idempotency
+from app.services.idempotency import IdempotencyConflict, IdempotencyService, MemoryBackend
+
+
+@pytest.fixture(autouse=True)
+def fresh_backend():
+    backend = MemoryBackend()
+    backend.cache.clear()
+    idempotency.set_backend(backend)
+    yield
+    idempotency.set_backend(None)
+
+
+def test_waiters_apply_once_after_the_first_attempt_fails():
+    calls = []
+
+    async def apply():
+        calls.append(len(calls))
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise RuntimeError("connection lost")
+        return {"status": "ok"}
+
+    async def main():
+        return await asyncio.gather(
+            *(IdempotencyService.run("family:key:k1", "hash", apply) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    first, second, third = asyncio.run(main())
+
+    assert isinstance(first, RuntimeError)
+    assert second == ({"status": "ok"}, False)
+    assert third == ({"status": "ok"}, True)
+    assert len(calls) == 2
+
+
+def test_stored_response_is_replayed_and_checked_against_the_body():
+    calls = []
+
+    async def apply():
+        calls.append(1)
+        return {"status": "ok"}
+
+    async def main():
+        assert await IdempotencyService.run("family:key:k2", "hash", apply) == ({"status": "ok"}, False)
+        assert await IdempotencyService.run("family:key:k2", "hash", apply) == ({"status": "ok"}, True)
+        with pytest.raises(IdempotencyConflict):
+            await IdempotencyService.run("family:key:k2", "other-hash", apply)
+
+    asyncio.run(main())
+    assert len(calls) == 1
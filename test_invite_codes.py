@@ -0,0 +1,55 @@
+"""
+Invite codes: the keyed Feistel permutation is a bijection, cycle walking
+keeps codes inside the 6-character space, and codes use the alphabet only.
+Run with `python -m pytest test_invite_codes.py`.
+"""
+import random
+
+from app.core.config import settings
+from app.services import invite_codes
+from app.services.invite_codes import ALPHABET, CODE_LENGTH, CODE_SPACE
+
+
+def test_feistel_is_a_bijection_on_32_bits():
+    key = invite_codes._key()
+    # Раунд Фейстеля обратим: та же сеть в обратном порядке раундов восстанавливает вход
+    def invert(value: int) -> int:
+        left, right = value >> 16, value & 0xFFFF
+        for round_no in reversed(range(4)):
+            digest = invite_codes.hmac.new(key, f"{round_no}:{left}".encode("ascii"), invite_codes.hashlib.sha256).digest()
+            left, right = right ^ int.from_bytes(digest[:2], "big"), left
+        return (left << 16) | right
+
+    samples = [0, 1, 0xFFFF, 0x10000, 2**32 - 1] + random.Random(1).sample(range(2**32), 2000)
+    outputs = [invite_codes._feistel(value, key) for value in samples]
+
+    assert all(0 <= value < 2**32 for value in outputs)
+    assert [invert(value) for value in outputs] == samples
+
+
+def test_scramble_stays_in_range_without_collisions():
+    numbers = list(range(20000)) + random.Random(2).sample(range(CODE_SPACE), 5000) + [CODE_SPACE - 1]
+
+    codes = [invite_codes.scramble(number) for number in numbers]
+
+    assert all(0 <= code < CODE_SPACE for code in codes)
+    assert len(set(codes)) == len(set(numbers))
+    # Соседние номера не дают соседних кодов
+    assert sum(abs(a - b) == 1 for a, b in zip(codes, codes[1:20000])) < 5
+
+
+def test_scramble_depends_on_the_secret(monkeypatch):
+    before = [invite_codes.scramble(number) for number in range(100)]
+    monkeypatch.setattr(settings, "SECRET_KEY", settings.SECRET_KEY + "-rotated")
+
+    assert [invite_codes.scramble(number) for number in range(100)] != before
+
+
+def test_encode_gives_six_alphabet_characters():
+    assert invite_codes.encode(0) == "000000"
+    assert invite_codes.encode(35) == "00000Z"
+    assert invite_codes.encode(CODE_SPACE - 1) == "ZZZZZZ"
+    for number in random.Random(3).sample(range(CODE_SPACE), 1000):
+        code = invite_codes.encode(number)
+        assert len(code) == CODE_LENGTH and set(code) <= set(ALPHABET)
+        assert int(code, 36) == number
@@ -0,0 +1,123 @@
+"""
+JWT_BACKEND=hmac: tokens match python-jose byte for byte, and decode
+rejects what python-jose rejects for the tokens this app issues.
+Run with `python -m pytest test_jwt_hmac.py`.
+"""
+import base64
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from jose import jwt
+
+from app.core import jwt_hmac
+from app.core.jwt_hmac import InvalidToken
+
+KEY = "test-secret"
+
+
+def segment(data) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+
+def resign(header: dict, claims: dict, algorithm: str = "HS256") -> str:
+    """Correctly signed token with an arbitrary header and payload"""
+    signing_input = f"{segment(header)}.{segment(claims)}".encode()
+    signature = base64.urlsafe_b64encode(jwt_hmac._sign(signing_input, KEY, algorithm)).rstrip(b"=")
+    return (signing_input + b"." + signature).decode()
+
+
+def claims(**extra) -> dict:
+    return {"sub": "user-1", "exp": int(time.time()) + 600, **extra}
+
+
+@pytest.mark.parametrize("algorithm", ["HS256", "HS384", "HS512"])
+def test_tokens_match_python_jose(algorithm):
+    data = {"sub": "6c1b1f52-1111-4d2c-9a53-2f1b1e0c0a01", "exp": datetime.utcnow() + timedelta(minutes=5)}
+
+    token = jwt_hmac.encode(data, KEY, algorithm)
+
+    assert token == jwt.encode(data, KEY, algorithm=algorithm)
+    assert jwt_hmac.decode(token, KEY, algorithm) == jwt.decode(token, KEY, algorithms=[algorithm])
+
+
+def test_tampered_signature_or_payload_is_rejected():
+    header, payload, signature = jwt_hmac.encode(claims(), KEY, "HS256").split(".")
+    flipped = ("A" if signature[0] != "A" else "B") + signature[1:]
+
+    with pytest.raises(InvalidToken, match="Signature"):
+        jwt_hmac.decode(f"{header}.{payload}.{flipped}", KEY, "HS256")
+    with pytest.raises(InvalidToken, match="Signature"):
+        jwt_hmac.decode(f"{header}.{segment(claims(sub='user-2'))}.{signature}", KEY, "HS256")
+    with pytest.raises(InvalidToken, match="Signature"):
+        jwt_hmac.decode(f"{header}.{payload}.{signature}", "other-secret", "HS256")
+
+
+@pytest.mark.parametrize("header", [
+    {"alg": "none", "typ": "JWT"},
+    {"alg": "HS512", "typ": "JWT"},
+    {"typ": "JWT"},
+])
+def test_unexpected_algorithm_is_rejected(header):
+    with pytest.raises(InvalidToken, match="algorithm"):
+        jwt_hmac.decode(resign(header, claims()), KEY, "HS256")
+
+
+def test_unsigned_token_is_rejected():
+    token = f"{segment({'alg': 'none', 'typ': 'JWT'})}.{segment(claims())}."
+    with pytest.raises(InvalidToken):
+        jwt_hmac.decode(token, KEY, "HS256")
+
+
+@pytest.mark.parametrize("token", [
+    "",
+    "abc",
+    "abc.def",
+    "a.b.c.d",
+    "%%%.%%%.%%%",
+    "e30.e30.x",
+    "ключ.e30.e30",
+])
+def test_malformed_tokens_are_rejected(token):
+    with pytest.raises(InvalidToken):
+        jwt_hmac.decode(token, KEY, "HS256")
+
+
+def test_extra_segment_of_a_valid_token_is_rejected():
+    token = jwt_hmac.encode(claims(), KEY, "HS256")
+    with pytest.raises(InvalidToken, match="segments"):
+        jwt_hmac.decode(token + ".x", KEY, "HS256")
+
+
+@pytest.mark.parametrize("extra, message", [
+    ({"exp": int(time.time()) - 1}, "expired"),
+    ({"exp": "tomorrow"}, "exp"),
+    ({"nbf": int(time.time()) + 600}, "not yet valid"),
+    ({"sub": 42}, "Subject"),
+    ({"aud": "someone-else"}, "audience"),
+])
+def test_invalid_claims_are_rejected(extra, message):
+    token = resign({"alg": "HS256", "typ": "JWT"}, claims(**extra))
+    with pytest.raises(InvalidToken, match=message):
+        jwt_hmac.decode(token, KEY, "HS256")
+
+
+def test_payload_must_be_an_object():
+    with pytest.raises(InvalidToken, match="payload"):
+        jwt_hmac.decode(resign({"alg": "HS256", "typ": "JWT"}, ["user-1"]), KEY, "HS256")
+
+
+def test_signature_is_compared_in_constant_time(monkeypatch):
+    compared = []
+    compare_digest = jwt_hmac.hmac.compare_digest
+
+    def spy(a, b):
+        compared.append((a, b))
+        return compare_digest(a, b)
+
+    monkeypatch.setattr(jwt_hmac.hmac, "compare_digest", spy)
+    token = jwt_hmac.encode(claims(), KEY, "HS256")
+
+    assert jwt_hmac.decode(token, KEY, "HS256")["sub"] == "user-1"
+    assert len(compared) == 1
@@ -0,0 +1,121 @@
+"""
+Streamed push bodies: the size limit, spooling with the body hash, and
+table-by-table record batches with the same structure checks as
+SyncPushRequest. Run with `python -m pytest test_sync_push_stream.py`.
+"""
+import asyncio
+import hashlib
+import json
+
+import pytest
+
+pytest.importorskip("ijson")
+
+from app.services import sync_push_stream
+from app.services.sync_plans import PushValidationError
+from app.services.sync_push_stream import BodyTooLarge
+
+
+async def chunks(body: bytes, size: int = 7):
+    for offset in range(0, len(body), size):
+        yield body[offset:offset + size]
+
+
+def push_body(changes) -> bytes:
+    return json.dumps({"changes": changes}).encode()
+
+
+async def collect(body: bytes, batch_size: int):
+    spooled, _ = await sync_push_stream.spool(chunks(body), len(body), 16)
+    try:
+        return [batch async for batch in sync_push_stream.iter_push(spooled, batch_size)]
+    finally:
+        await spooled.close()
+
+
+def test_records_come_in_batches_per_table_and_deletions_last():
+    body = push_body({
+        "analyses": {
+            "created": [{"id": f"a{i}", "name": "ОАК"} for i in range(5)],
+            "updated": [{"id": "a9", "name": "x", "nested": {"k": [1, 2]}}],
+            "deleted": ["a7", "a8"],
+        },
+        "analysis_items": {"created": [{"id": "i1", "analysis_id": "a0"}], "deleted": [3]},
+        "unknown": {"created": [{"id": "u1"}]},
+    })
+
+    batches = asyncio.run(collect(body, batch_size=2))
+
+    assert [(table, kind, [r["id"] for r in items] if kind == "records" else items) for table, kind, items in batches] == [
+        ("analyses", "records", ["a0", "a1"]),
+        ("analyses", "records", ["a2", "a3"]),
+        ("analyses", "records", ["a4", "a9"]),
+        ("analysis_items", "records", ["i1"]),
+        ("unknown", "records", ["u1"]),
+        ("analyses", "deleted", ["a7", "a8"]),
+        ("analysis_items", "deleted", ["3"]),
+    ]
+    assert batches[2][2][1]["nested"] == {"k": [1, 2]}
+
+
+@pytest.mark.parametrize("body, message", [
+    (b"[1]", "body must be an object"),
+    (b'{"changes": 5}', "changes must be an object"),
+    (b'{"changes": {"analyses": []}}', "table changes must be an object"),
+    (b'{"changes": {"analyses": {"created": "nope"}}}', "created must be an array"),
+    (b'{"changes": {"analyses": {"deleted": {}}}}', "deleted must be an array"),
+    (b'{"changes": {"analyses": {"deleted": [{"id": 1}]}}}', "deleted must hold record ids"),
+    (b'{"changes": {"analyses": {"updated": [1]}}}', "record must be an object"),
+])
+def test_structure_errors(body, message):
+    with pytest.raises(PushValidationError, match=message):
+        asyncio.run(collect(body, batch_size=10))
+
+
+def test_truncated_body_is_a_json_error():
+    with pytest.raises(sync_push_stream.JSON_ERRORS):
+        asyncio.run(collect(b'{"changes": {"analyses": {"created": [{"id": ', batch_size=10))
+
+
+def test_spool_hashes_the_body_and_keeps_it_whole():
+    body = push_body({"analyses": {"created": [{"id": str(i)} for i in range(100)]}})
+
+    async def main():
+        spooled, body_hash = await sync_push_stream.spool(chunks(body), len(body), 64)
+        try:
+            assert body_hash == hashlib.sha256(body).hexdigest()
+            assert await spooled.read() == body
+        finally:
+            await spooled.close()
+
+    asyncio.run(main())
+
+
+def test_size_limit():
+    body = b"x" * 100
+
+    async def main():
+        assert await sync_push_stream.read_body(chunks(body), 100) == body
+        with pytest.raises(BodyTooLarge):
+            await sync_push_stream.read_body(chunks(body), 99)
+        with pytest.raises(BodyTooLarge):
+            await sync_push_stream.spool(chunks(body), 99, 10)
+
+    asyncio.run(main())
+
+
+def test_record_ids_of_parent_tables():
+    body = push_body({
+        "analysis_items": {"created": [{"id": "i1", "analysis_id": "a1"}]},
+        "analyses": {"created": [{"id": "a1"}], "updated": [{"id": 2}], "deleted": ["a3"]},
+        "transfusions": {"created": [{"id": "t1"}]},
+    })
+
+    async def main():
+        spooled, _ = await sync_push_stream.spool(chunks(body), len(body), 1024)
+        try:
+            return await sync_push_stream.record_ids(spooled, ["analyses"])
+        finally:
+            await spooled.close()
+
+    assert asyncio.run(main()) == {"analyses": {"a1", "2"}}
@@ -0,0 +1,110 @@
+"""
+Streaming upload: the file part is renamed into place only when complete,
+and a rejected or broken upload leaves nothing in the directory.
+Run with `python -m pytest test_upload_stream.py`.
+"""
+import asyncio
+
+import pytest
+
+from app.services.upload_stream import InvalidUpload, UploadTooLarge, save_upload
+
+BOUNDARY = "test-boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def multipart_body(data: bytes, name: str = "file", filename: str = "scan.pdf") -> bytes:
+    disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="comment"\r\n\r\n'
+        f"анализ\r\n"
+        f"--{BOUNDARY}\r\n"
+        f"Content-Disposition: {disposition}\r\n"
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def chunks(body: bytes, size: int = 1000, fail_after: int = None):
+    for offset in range(0, len(body), size):
+        if fail_after is not None and offset >= fail_after:
+            raise ConnectionResetError("client went away")
+        yield body[offset:offset + size]
+
+
+def upload(directory, body: bytes, limit: int = 1_000_000, **kwargs):
+    return asyncio.run(save_upload(CONTENT_TYPE, chunks(body, **kwargs), directory, limit, chunk_size=256))
+
+
+def test_file_is_written_and_renamed_into_place(tmp_path):
+    data = bytes(range(256)) * 40
+
+    filename, stored, size = upload(tmp_path, multipart_body(data))
+
+    assert filename == "scan.pdf"
+    assert stored.endswith(".pdf") and size == len(data)
+    assert [path.name for path in tmp_path.iterdir()] == [stored]
+    assert (tmp_path / stored).read_bytes() == data
+
+
+def test_directory_is_created(tmp_path):
+    directory = tmp_path / "family"
+    _, stored, _ = upload(directory, multipart_body(b"abc"))
+    assert (directory / stored).read_bytes() == b"abc"
+
+
+def test_oversized_file_leaves_nothing(tmp_path):
+    with pytest.raises(UploadTooLarge):
+        upload(tmp_path, multipart_body(b"x" * 5000), limit=4096)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_oversized_body_is_cut_off_before_parsing(tmp_path):
+    # Поток сильно больше лимита обрывается по числу полученных байт
+    body = multipart_body(b"x" * 100) + b"-" * 200_000
+    with pytest.raises(UploadTooLarge):
+        upload(tmp_path, body, limit=1024)
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("body", [
+    multipart_body(b"abc", name="other"),
+    multipart_body(b"abc", filename=""),
+    f"--{BOUNDARY}--\r\n".encode(),
+])
+def test_missing_file_part_leaves_nothing(tmp_path, body):
+    with pytest.raises(InvalidUpload):
+        upload(tmp_path, body)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_not_multipart(tmp_path):
+    for content_type in (None, "application/json", "multipart/form-data"):
+        with pytest.raises(InvalidUpload):
+            asyncio.run(save_upload(content_type, chunks(b"{}"), tmp_path, 1000, 256))
+
+
+def test_broken_stream_leaves_nothing(tmp_path):
+    with pytest.raises(ConnectionResetError):
+        upload(tmp_path, multipart_body(b"x" * 10_000), fail_after=5000)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cancelled_upload_leaves_nothing(tmp_path):
+    started = asyncio.Event()
+
+    async def stalled():
+        yield multipart_body(b"x" * 10_000)[:3000]
+        started.set()
+        await asyncio.sleep(3600)
+        yield b""
+
+    async def main():
+        task = asyncio.create_task(save_upload(CONTENT_TYPE, stalled(), tmp_path, 1_000_000, 256))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert list(tmp_path.iterdir()) == []
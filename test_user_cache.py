@@ -0,0 +1,99 @@
+"""
+Auth user cache: invalidate_user drops the user's cached entries instead of
+remembering every invalidated id, and a user loaded while an invalidation
+happened is not cached. Run with `python -m pytest test_user_cache.py`.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi.security import HTTPAuthorizationCredentials
+
+from app.core import dependencies
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+
+class FakeUsers:
+    """Stands in for User.get(...).prefetch_related(...); each load can be held on `gate`"""
+
+    def __init__(self) -> None:
+        self.loads = 0
+        self.family_id = "family-1"
+        self.gate = None
+
+    def get(self, id):
+        return self
+
+    def prefetch_related(self, *fields):
+        return self._load()
+
+    async def _load(self):
+        self.loads += 1
+        family_id = self.family_id
+        if self.gate is not None:
+            await self.gate.wait()
+        return SimpleNamespace(id="user-1", family=None, family_id=family_id, deleted_at=None)
+
+
+@pytest.fixture
+def users(monkeypatch):
+    users = FakeUsers()
+    monkeypatch.setattr(dependencies, "User", users)
+    monkeypatch.setattr(dependencies, "decode_access_token", lambda token: {"sub": token.split(":")[0]})
+    monkeypatch.setattr(settings, "AUTH_USER_CACHE_TTL", 30)
+    dependencies._user_cache().clear()
+    yield users
+    dependencies._user_cache().clear()
+
+
+def current_user(token: str = "user-1:a"):
+    return dependencies.get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+
+
+def test_discard_drops_matching_keys_only():
+    cache = TTLCache("test")
+    for key in [("u1", "a"), ("u1", "b"), ("u2", "a")]:
+        cache.set(key, key)
+
+    assert cache.discard(lambda key: key[0] == "u1") == 2
+    assert cache.get(("u1", "a")) is None and cache.get(("u2", "a")) == ("u2", "a")
+
+
+def test_invalidate_drops_every_token_of_the_user(users):
+    async def main():
+        await current_user("user-1:a")
+        await current_user("user-1:b")
+        await current_user("user-2:a")
+        assert users.loads == 3 and len(dependencies._user_cache()) == 3
+
+        users.family_id = "family-2"
+        dependencies.invalidate_user("user-1")
+        assert len(dependencies._user_cache()) == 1
+
+        assert (await current_user("user-1:a")).family_id == "family-2"
+        assert users.loads == 4
+        # Ничего не накапливается по id: повторные сбросы не растят состояние модуля
+        for _ in range(100):
+            dependencies.invalidate_user("user-3")
+        assert len(dependencies._user_cache()) == 2
+
+    asyncio.run(main())
+
+
+def test_user_loaded_across_an_invalidation_is_not_cached(users):
+    async def main():
+        users.gate = asyncio.Event()
+        loading = asyncio.create_task(current_user())
+        await asyncio.sleep(0)
+
+        # Семья сменилась, пока первый запрос читал пользователя
+        users.family_id = "family-2"
+        dependencies.invalidate_user("user-1")
+        users.gate.set()
+        assert (await loading).family_id == "family-1"
+
+        assert (await current_user()).family_id == "family-2"
+        assert users.loads == 2
+
+    asyncio.run(main())